@@ -11,7 +11,7 @@ with open('cityblock.c') as f:
     
 ffi.set_source("_cityblock",
                code,
-               extra_compile_args=["-fopenmp"],
+               extra_compile_args=["-O3", "-march=native", "-fopenmp"],
                extra_link_args=["-lgomp"])
 
 ffi.compile(verbose=True)
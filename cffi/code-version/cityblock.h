@@ -1,3 +1,9 @@
 /* cityblock.c */
 
 void cbdm(double *a, double *b, double *r, int num_rows, int num_cols);
+void cbdm_self(double *a, double *r, int num_rows, int num_cols);
+void cbdm_condensed(double *a, double *d, int num_rows, int num_cols);
+void cbdm_double(const double *a, const double *b, double *r, int n, int m,
+                 int k, int nthreads);
+void cbdm_float(const float *a, const float *b, float *r, int n, int m, int k,
+                int nthreads);
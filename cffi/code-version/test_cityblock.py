@@ -1,8 +1,8 @@
 import time
 import numpy as np
 from cffi import FFI
-from scipy.spatial.distance import cdist
-from _cityblock.lib import cbdm
+from scipy.spatial.distance import cdist, pdist
+from _cityblock.lib import cbdm, cbdm_condensed, cbdm_self
 
 
 nsamples = 12000
@@ -27,3 +27,20 @@ print(f'cdist : {time.time() - start:.2f} seconds')
 
 # check the result by comparing to cdist
 print(f'\ndiff  : {(r - r_cdist).max():.2e}')
+
+# the distances of x to itself, computed only for i < j
+r_self = np.empty((nsamples, nsamples))
+d = np.empty(nsamples * (nsamples - 1) // 2)
+r_self_c = ffi.cast('double *', r_self.ctypes.data)
+d_c = ffi.cast('double *', d.ctypes.data)
+
+start = time.time()
+cbdm_self(x_c, r_self_c, nsamples, nfeat)
+print(f'\nC self      : {time.time() - start:.2f} seconds')
+
+start = time.time()
+cbdm_condensed(x_c, d_c, nsamples, nfeat)
+print(f'C condensed : {time.time() - start:.2f} seconds')
+
+print(f'\ndiff self      : {np.abs(r_self - r_cdist).max():.2e}')
+print(f'diff condensed : {np.abs(d - pdist(x, "cityblock")).max():.2e}')
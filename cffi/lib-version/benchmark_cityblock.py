@@ -0,0 +1,68 @@
+import argparse
+import time
+
+import numpy as np
+from cffi import FFI
+from scipy.spatial.distance import cdist
+from _cityblock.lib import cbdm, cbdm_double, cbdm_float
+
+
+# a cityblock distance takes a subtraction, an absolute value and an addition
+# per feature
+def gflops(nsamples, nfeat, seconds):
+    return 3 * nsamples**2 * nfeat / seconds / 1e9
+
+
+def best(f, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+parser = argparse.ArgumentParser(
+    description='GFLOP/s of the cityblock distance matrix kernels')
+parser.add_argument('--nsamples', type=int, default=4000)
+parser.add_argument('--nfeat', type=int, default=50)
+parser.add_argument('--threads', type=int, nargs='+', default=[0],
+                    help='threads of cbdm_double and cbdm_float, 0 for the '
+                         'OpenMP default')
+parser.add_argument('--repeat', type=int, default=3)
+args = parser.parse_args()
+nsamples, nfeat = args.nsamples, args.nfeat
+
+rng = np.random.default_rng()
+x = rng.random((nsamples, nfeat))
+x32 = x.astype(np.float32)
+r = np.empty((nsamples, nsamples))
+r32 = np.empty((nsamples, nsamples), dtype=np.float32)
+
+ffi = FFI()
+x_c = ffi.cast('double *', x.ctypes.data)
+r_c = ffi.cast('double *', r.ctypes.data)
+x32_c = ffi.cast('float *', x32.ctypes.data)
+r32_c = ffi.cast('float *', r32.ctypes.data)
+
+r_cdist = cdist(x, x, 'cityblock')
+
+seconds = best(lambda: cdist(x, x, 'cityblock'), args.repeat)
+print(f'cdist             : {gflops(nsamples, nfeat, seconds):6.2f} GFLOP/s')
+
+seconds = best(lambda: cbdm(x_c, x_c, r_c, nsamples, nfeat), args.repeat)
+print(f'cbdm              : {gflops(nsamples, nfeat, seconds):6.2f} GFLOP/s'
+      f'   diff {np.abs(r - r_cdist).max():.2e}')
+
+for threads in args.threads:
+    seconds = best(lambda: cbdm_double(x_c, x_c, r_c, nsamples, nsamples,
+                                       nfeat, threads), args.repeat)
+    print(f'cbdm_double ({threads:2d}) : '
+          f'{gflops(nsamples, nfeat, seconds):6.2f} GFLOP/s'
+          f'   diff {np.abs(r - r_cdist).max():.2e}')
+
+    seconds = best(lambda: cbdm_float(x32_c, x32_c, r32_c, nsamples, nsamples,
+                                      nfeat, threads), args.repeat)
+    print(f'cbdm_float  ({threads:2d}) : '
+          f'{gflops(nsamples, nfeat, seconds):6.2f} GFLOP/s'
+          f'   diff {np.abs(r32 - r_cdist).max():.2e}')
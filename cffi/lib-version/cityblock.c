@@ -1,13 +1,15 @@
 #include <math.h>
+#include <stddef.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 
 
 void cbdm(double *a, double *b, double *r, int num_rows, int num_cols) {
-    double _r = 0.0;
-
-#pragma omp parallel for reduction (+:_r)
+#pragma omp parallel for
     for(int i = 0; i < num_rows; i++) {
         for(int j = 0; j < num_rows ; j++) {
-            _r = 0.0;
+            double _r = 0.0;
             for(int k = 0; k < num_cols ; k++) {
                 _r += fabs(a[i * num_cols + k] - b[j * num_cols + k]);
             }
@@ -15,3 +17,142 @@ void cbdm(double *a, double *b, double *r, int num_rows, int num_cols) {
         }
     }
 }
+
+
+/* The (n, m) distance matrix of the rows of the (n, k) and (m, k) arrays a
+ * and b, in double or single precision, on nthreads threads, or as many as
+ * OpenMP starts by default if nthreads is 0.
+ *
+ * cbdm() compares every row of a to every row of b, reading all of b from
+ * memory for every row of a. Here every thread takes BLOCK_I rows of a,
+ * which stay in cache, and copies TILE_J rows of b at a time transposed into
+ * bt, so that the TILE_J distances of a row of a are summed over k by
+ * vector instructions, TILE_I rows of a at a time in registers. The
+ * features are taken BLOCK_K at a time, so that bt stays in the L1 cache
+ * for any k.
+ *
+ * The distances of the rows of a to each other, b being a, are computed
+ * only for i < j, by the tiles that hold any, and written to both halves of
+ * the matrix, SYMMETRIC, or to the n * (n - 1) / 2 entries of r in the order
+ * of scipy.spatial.distance.pdist, CONDENSED: (0, 1), (0, 2), ..., (1, 2),
+ * ... The blocks of rows then have fewer and fewer distances, so they are
+ * handed out to the threads one by one as they get done. */
+
+#define BLOCK_I 64
+#define TILE_I 4
+#define TILE_J 16
+#define BLOCK_K 128
+
+#define MIN(x, y) ((x) < (y) ? (x) : (y))
+
+enum {FULL, SYMMETRIC, CONDENSED};
+
+static int default_threads(void) {
+#ifdef _OPENMP
+    return omp_get_max_threads();
+#else
+    return 1;
+#endif
+}
+
+/* the sum over the first block of features, or adding that of the others */
+#define STORE(r, ij, acc, k0) ((r)[ij] = (k0) ? (r)[ij] + (acc) : (acc))
+
+#define CBDM_TILES(name, real, abs)                                          \
+static void name(const real *a, const real *b, real *r, int n, int m, int k, \
+                 int nthreads, int mode) {                                   \
+    int blocks = (n + BLOCK_I - 1) / BLOCK_I;                                \
+    if (nthreads <= 0) {                                                     \
+        nthreads = default_threads();                                        \
+    }                                                                        \
+                                                                             \
+_Pragma("omp parallel for schedule(dynamic) num_threads(nthreads)")          \
+    for(int block = 0; block < blocks; block++) {                            \
+        real bt[BLOCK_K * TILE_J];                                           \
+        int i0 = block * BLOCK_I, i1 = MIN(i0 + BLOCK_I, n);                 \
+        int j_first = mode == FULL ? 0 : i0 / TILE_J * TILE_J;               \
+        for(int j0 = j_first; j0 < m; j0 += TILE_J) {                        \
+            int cols = MIN(TILE_J, m - j0);                                  \
+            for(int k0 = 0; k0 < k; k0 += BLOCK_K) {                         \
+                int depth = MIN(BLOCK_K, k - k0);                            \
+                                                                             \
+                /* the tile of b, transposed and padded with zeros */        \
+                for(int kk = 0; kk < depth; kk++) {                          \
+                    for(int jj = 0; jj < TILE_J; jj++) {                     \
+                        bt[kk * TILE_J + jj] = jj < cols ?                   \
+                            b[(size_t)(j0 + jj) * k + k0 + kk] : 0;          \
+                    }                                                        \
+                }                                                            \
+                                                                             \
+                for(int i = i0; i < i1; i += TILE_I) {                       \
+                    int rows = MIN(TILE_I, i1 - i);                          \
+                    if (mode != FULL && j0 + cols - 1 < i) {                 \
+                        continue;                                            \
+                    }                                                        \
+                                                                             \
+                    real acc[TILE_I][TILE_J] = {{0}};                        \
+                    for(int kk = 0; kk < depth; kk++) {                      \
+                        for(int ii = 0; ii < TILE_I; ii++) {                 \
+                            real aik = a[(size_t)(i + MIN(ii, rows - 1)) * k \
+                                         + k0 + kk];                         \
+_Pragma("omp simd")                                                          \
+                            for(int jj = 0; jj < TILE_J; jj++) {             \
+                                acc[ii][jj] +=                               \
+                                    abs(aik - bt[kk * TILE_J + jj]);         \
+                            }                                                \
+                        }                                                    \
+                    }                                                        \
+                                                                             \
+                    for(int ii = 0; ii < rows; ii++) {                       \
+                        size_t row = i + ii;                                 \
+                        for(int jj = 0; jj < cols; jj++) {                   \
+                            size_t col = j0 + jj;                            \
+                            real d = acc[ii][jj];                            \
+                            if (mode == FULL) {                              \
+                                STORE(r, row * m + col, d, k0);              \
+                            } else if (col == row && mode == SYMMETRIC) {    \
+                                r[row * m + col] = 0;                        \
+                            } else if (col > row && mode == SYMMETRIC) {     \
+                                STORE(r, row * m + col, d, k0);              \
+                                STORE(r, col * m + row, d, k0);              \
+                            } else if (col > row) {                          \
+                                STORE(r, row * n - row * (row + 1) / 2       \
+                                      + col - row - 1, d, k0);               \
+                            }                                                \
+                        }                                                    \
+                    }                                                        \
+                }                                                            \
+            }                                                                \
+        }                                                                    \
+    }                                                                        \
+}
+
+CBDM_TILES(cbdm_tiles_double, double, fabs)
+CBDM_TILES(cbdm_tiles_float, float, fabsf)
+
+
+void cbdm_double(const double *a, const double *b, double *r, int n, int m,
+                 int k, int nthreads) {
+    cbdm_tiles_double(a, b, r, n, m, k, nthreads, FULL);
+}
+
+
+void cbdm_float(const float *a, const float *b, float *r, int n, int m, int k,
+                int nthreads) {
+    cbdm_tiles_float(a, b, r, n, m, k, nthreads, FULL);
+}
+
+
+/* The distances of the rows of a to each other, only for i < j. */
+
+void cbdm_self(double *a, double *r, int num_rows, int num_cols) {
+    cbdm_tiles_double(a, a, r, num_rows, num_rows, num_cols, 0, SYMMETRIC);
+}
+
+
+/* The same distances in the num_rows * (num_rows - 1) / 2 entries of d, in
+ * the order of scipy.spatial.distance.pdist. */
+
+void cbdm_condensed(double *a, double *d, int num_rows, int num_cols) {
+    cbdm_tiles_double(a, a, d, num_rows, num_rows, num_cols, 0, CONDENSED);
+}
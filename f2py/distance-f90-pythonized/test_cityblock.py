@@ -1,7 +1,9 @@
 import time
 import numpy as np
-from scipy.spatial.distance import cdist
-from metrics.cbdm import cityblock_distance_matrix
+from scipy.spatial.distance import cdist, pdist
+from metrics.cbdm import (cityblock_distance_condensed,
+                          cityblock_distance_matrix,
+                          cityblock_distance_matrix_self)
 
 
 nsamples, nfeat = (12000, 50)
@@ -17,3 +19,16 @@ cbdm_np = cdist(x, x, 'cityblock')
 print("scipy: %.2f seconds" % (time.time() - start))
 
 print('diff : %.2e' % np.abs(cbdm_f90 - cbdm_np).max())
+
+# the distances of x to itself, computed only for i < j
+start = time.time()
+cbdm_self = cityblock_distance_matrix_self(x.T)
+print("\nf90 self:      %.2f seconds" % (time.time() - start))
+
+start = time.time()
+cbdm_condensed = cityblock_distance_condensed(x.T)
+print("f90 condensed: %.2f seconds" % (time.time() - start))
+
+print('\ndiff self      : %.2e' % np.abs(cbdm_self - cbdm_np).max())
+print('diff condensed : %.2e'
+      % np.abs(cbdm_condensed - pdist(x, 'cityblock')).max())
@@ -1,6 +1,8 @@
 import time
 import numpy as np
-from metrics.edm import euclidean_distance_matrix
+from metrics.edm import (euclidean_distance_condensed,
+                         euclidean_distance_matrix,
+                         euclidean_distance_matrix_self)
 
 
 def euclidean_numpy(x, y):
@@ -20,7 +22,7 @@ def euclidean_numpy(x, y):
 
     xy = x @ y.T
 
-    return np.abs(x2 + y2 - 2. * xy)
+    return np.maximum(x2 + y2 - 2. * xy, 0.)
 
 
 nsamples, nfeat = (12000, 50)
@@ -35,3 +37,16 @@ edm_np = euclidean_numpy(x, x)
 print("numpy: %.2f seconds" % (time.time() - start))
 
 print('\ndiff : %.2e'% np.abs(edm_f90 - edm_np).max())
+
+# the distances of x to itself, computed only for i < j
+start = time.time()
+edm_self = euclidean_distance_matrix_self(x.T)
+print("\nf90 self:      %.2f seconds" % (time.time() - start))
+
+start = time.time()
+edm_condensed = euclidean_distance_condensed(x.T)
+print("f90 condensed: %.2f seconds" % (time.time() - start))
+
+print('\ndiff self      : %.2e' % np.abs(edm_self - edm_f90).max())
+print('diff condensed : %.2e'
+      % np.abs(edm_condensed - edm_f90[np.triu_indices(nsamples, 1)]).max())
@@ -25,3 +25,67 @@
 !$OMP END PARALLEL DO
   
       end subroutine euclidean_distance_matrix
+
+
+! The distances of the samples of x to each other, only for i < j. Sample j
+! has j - 1 of them, so the samples are handed out to the threads one by one
+! as they get done rather than in equal blocks.
+      subroutine euclidean_distance_matrix_self(x, nsamples, nfeat, r)
+
+      implicit none
+  
+      double precision, dimension(:,:), intent(in) :: x
+      integer, intent(in) :: nsamples
+      integer, intent(in) :: nfeat
+      double precision, dimension(:,:), intent(inout) :: r
+  
+      integer :: i, j, k
+      double precision :: tmp
+  
+!$OMP PARALLEL DO PRIVATE (i, k, tmp) SCHEDULE (DYNAMIC)
+      do j = 1, nsamples
+          do i = 1, j - 1
+              tmp = 0.0
+              do k = 1, nfeat
+                  tmp = (x(k,i) - x(k,j))**2 + tmp
+              enddo
+              r(i,j) = tmp
+              r(j,i) = tmp
+          enddo
+          r(j,j) = 0.0
+      enddo
+!$OMP END PARALLEL DO
+  
+      end subroutine euclidean_distance_matrix_self
+
+
+! The same distances in the nsamples*(nsamples-1)/2 entries of d, in the
+! order of scipy.spatial.distance.pdist: (1,2), (1,3), ..., (2,3), ...
+      subroutine euclidean_distance_condensed(x, nsamples, nfeat, d)
+
+      implicit none
+  
+      double precision, dimension(:,:), intent(in) :: x
+      integer, intent(in) :: nsamples
+      integer, intent(in) :: nfeat
+      double precision, dimension(:), intent(inout) :: d
+  
+      integer :: i, j, k
+      integer(kind=8) :: ij
+      double precision :: tmp
+  
+!$OMP PARALLEL DO PRIVATE (ij, j, k, tmp) SCHEDULE (DYNAMIC)
+      do i = 1, nsamples - 1
+          ij = int(i - 1, 8) * nsamples - int(i - 1, 8) * i / 2
+          do j = i + 1, nsamples
+              tmp = 0.0
+              do k = 1, nfeat
+                  tmp = (x(k,i) - x(k,j))**2 + tmp
+              enddo
+              ij = ij + 1
+              d(ij) = tmp
+          enddo
+      enddo
+!$OMP END PARALLEL DO
+  
+      end subroutine euclidean_distance_condensed
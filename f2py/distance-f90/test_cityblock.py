@@ -1,7 +1,9 @@
 import time
 import numpy as np
-from scipy.spatial.distance import cdist
-from metrics.cbdm import cityblock_distance_matrix
+from scipy.spatial.distance import cdist, pdist
+from metrics.cbdm import (cityblock_distance_condensed,
+                          cityblock_distance_matrix,
+                          cityblock_distance_matrix_self)
 
 
 nsamples, nfeats = (12000, 50)
@@ -18,3 +20,19 @@ cbdm_sp = cdist(x, x, 'cityblock')
 print("cdist: %.2f seconds" % (time.time() - start))
 
 print('\ndiff %.2e' % np.abs(cbdm_f90 - cbdm_sp).max())
+
+# the distances of x to itself, computed only for i < j
+cbdm_self = np.empty([nsamples, nsamples], order='F')
+cbdm_condensed = np.empty(nsamples * (nsamples - 1) // 2)
+
+start = time.time()
+cityblock_distance_matrix_self(x.T, nsamples, nfeats, cbdm_self)
+print("\nf90 self     : %.2f seconds" % (time.time() - start))
+
+start = time.time()
+cityblock_distance_condensed(x.T, nsamples, nfeats, cbdm_condensed)
+print("f90 condensed: %.2f seconds" % (time.time() - start))
+
+print('\ndiff self      %.2e' % np.abs(cbdm_self - cbdm_sp).max())
+print('diff condensed %.2e'
+      % np.abs(cbdm_condensed - pdist(x, 'cityblock')).max())
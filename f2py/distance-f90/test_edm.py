@@ -1,6 +1,8 @@
 import time
 import numpy as np
-from metrics.edm import euclidean_distance_matrix
+from metrics.edm import (euclidean_distance_condensed,
+                         euclidean_distance_matrix,
+                         euclidean_distance_matrix_self)
 
 
 def euclidean_numpy(x, y):
@@ -20,7 +22,7 @@ def euclidean_numpy(x, y):
 
     xy = x @ y.T
 
-    return np.abs(x2 + y2 - 2. * xy)
+    return np.maximum(x2 + y2 - 2. * xy, 0.)
 
 
 nsamples, nfeat = (12000, 50)
@@ -36,3 +38,19 @@ edm_np = euclidean_numpy(x, x)
 print("numpy: %.2f seconds" % (time.time() - start))
 
 print('\ndiff : %.2e'% np.abs(edm_f90 - edm_np).max())
+
+# the distances of x to itself, computed only for i < j
+edm_self = np.empty([nsamples, nsamples], order='F')
+edm_condensed = np.empty(nsamples * (nsamples - 1) // 2)
+
+start = time.time()
+euclidean_distance_matrix_self(x.T, nsamples, nfeat, edm_self)
+print("\nf90 self     : %.2f seconds" % (time.time() - start))
+
+start = time.time()
+euclidean_distance_condensed(x.T, nsamples, nfeat, edm_condensed)
+print("f90 condensed: %.2f seconds" % (time.time() - start))
+
+print('\ndiff self      : %.2e' % np.abs(edm_self - edm_f90).max())
+print('diff condensed : %.2e'
+      % np.abs(edm_condensed - edm_f90[np.triu_indices(nsamples, 1)]).max())
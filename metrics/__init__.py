@@ -0,0 +1,28 @@
+#
+# Distance matrices of the course behind one function
+#
+#   import metrics
+#   r = metrics.distance_matrix(x, y, metric='cityblock')
+#
+# The Euclidean and cityblock distance matrices of the course are written
+# with NumPy, numba, C bound with cffi and Fortran bound with f2py, each
+# called in its own way. distance_matrix() computes them with any of these
+# backends, see backends.py, and by default with the one that is fastest for
+# the problem, see autotune.py.
+#
+# The compiled kernels are used where they have been built: the _cityblock
+# module of cffi/ has to be on sys.path, and the metrics.edm and
+# metrics.cbdm modules of f2py/ are found in any directory named metrics on
+# sys.path, such as the one `python setup.py build_ext -i` makes in
+# f2py/distance-f90-pythonized.
+
+from pkgutil import extend_path
+
+# the f2py modules of this package are built into directories of their own
+__path__ = extend_path(__path__, __name__)
+
+from .backends import BACKENDS, METRICS, accepts, available  # noqa: E402
+from .distance import distance_matrix  # noqa: E402
+from .tiled import TILE_BYTES, distance_memmap, distance_tiles  # noqa: E402
+from .neighbours import knn  # noqa: E402
+from .index import DistanceIndex  # noqa: E402
@@ -0,0 +1,168 @@
+#
+# The fastest backend of a distance matrix
+#
+# tune() times the available backends on a problem, of at most TUNE_SIZE
+# distances taken from the leading rows of x and y, or of x to itself if y is
+# None, and returns the fastest.
+# The choice is remembered in a JSON file, by default in ~/.cache/metrics,
+# or METRICS_CACHE if set, under a key of the metric, the dtype, the number
+# of threads and the sizes n, m and k rounded up to powers of 2, so that a
+# problem of about the same size is not timed again, unless the backend
+# chosen is not available anymore. The file is shared by the processes of
+# the user, which merge their choices into it.
+
+import json
+import math
+import os
+import platform
+import tempfile
+import time
+
+import numba
+import numpy as np
+
+from . import backends
+
+CACHE = os.environ.get(
+    'METRICS_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'metrics',
+                 'autotune.json')
+)
+
+# the largest number of distances that are timed, and the timed runs of
+# every backend, after one that loads or compiles its kernels
+TUNE_SIZE = 2**20
+REPEAT = 2
+
+# the choices read from or written to CACHE by this process
+_choices = None
+
+
+def threads():
+    # the number of threads of the parallel kernels
+    return numba.get_num_threads()
+
+
+def _bucket(n):
+    return 1 << max(0, n - 1).bit_length()
+
+
+def _order(out):
+    # the layout of out, of which the backends write into different ones
+    if out.flags.c_contiguous:
+        return 'C'
+
+    return 'F' if out.flags.f_contiguous else 'A'
+
+
+def key(metric, dtype, n, m, k, symmetric=None, out=None):
+    # the square kernels are not padded on square problems, see
+    # backends.compute(), the distances of x to itself, symmetric 'matrix'
+    # or 'condensed', are computed by other kernels, see
+    # backends.compute_self(), and only some backends write into out
+    shape = f'{_bucket(n)}x{_bucket(m)}x{_bucket(k)}'
+    if symmetric:
+        shape += f'-self-{symmetric}'
+    elif n == m:
+        shape += '-square'
+
+    if out is not None:
+        shape += f'-out-{out.dtype.name}-{_order(out)}'
+
+    return (f'{platform.node()}/{metric}/{np.dtype(dtype).name}/'
+            f'{threads()}/{shape}')
+
+
+def _read():
+    try:
+        with open(CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write(choices):
+    # merge choices into the cache, replacing the file in one step so that
+    # other processes never read half of it
+    directory = os.path.dirname(CACHE)
+    os.makedirs(directory, exist_ok=True)
+    merged = {**_read(), **choices}
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(merged, f, indent=2, sort_keys=True)
+
+    os.replace(path, CACHE)
+
+
+def timings(metric, x, y, candidates, condensed=False, out=None):
+    # the seconds each of the backends takes on the leading rows of x and y,
+    # in the proportions of the whole problem, or of x to itself if y is
+    # None, writing into an array of the layout and dtype of out if given
+    m = len(x) if y is None else len(y)
+    scale = min(1., math.sqrt(TUNE_SIZE / (len(x) * m)))
+    x = x[:max(1, round(scale*len(x)))]
+    if y is None:
+        n = len(x)
+        if out is not None:
+            out = np.empty(n*(n - 1)//2 if condensed else (n, n),
+                           dtype=out.dtype,
+                           order='F' if _order(out) == 'F' else 'C')
+
+        def run(name):
+            backends.compute_self(name, x, metric, condensed, out)
+    else:
+        y = y[:max(1, round(scale*len(y)))]
+        if out is not None:
+            out = np.empty((len(x), len(y)), dtype=out.dtype,
+                           order='F' if _order(out) == 'F' else 'C')
+
+        def run(name):
+            backends.compute(name, x, y, metric, out)
+
+    seconds = {}
+    for name in candidates:
+        run(name)
+        times = []
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            run(name)
+            times.append(time.perf_counter() - start)
+
+        seconds[name] = min(times)
+
+    return seconds
+
+
+def tune(metric, x, y, condensed=False, out=None):
+    """The fastest backend for the distance matrix of x and y, or of x to
+    itself, condensed or not, if y is None, timed on first use and read from
+    the cache afterwards. Given out, the backends that write into it without
+    a copy are timed, if there are any."""
+    global _choices
+    if _choices is None:
+        _choices = _read()
+
+    symmetric = None
+    if y is None:
+        symmetric = 'condensed' if condensed else 'matrix'
+        k = key(metric, x.dtype, len(x), len(x), x.shape[1], symmetric, out)
+    else:
+        k = key(metric, x.dtype, len(x), len(y), x.shape[1], out=out)
+
+    candidates = backends.available(metric)
+    if out is not None:
+        candidates = [name for name in candidates
+                      if backends.accepts(name, out, symmetric)] or candidates
+
+    if _choices.get(k) in candidates:
+        return _choices[k]
+
+    seconds = timings(metric, x, y, candidates, condensed, out)
+    _choices[k] = min(seconds, key=seconds.get)
+    try:
+        _write({k: _choices[k]})
+    except OSError:
+        # without a writable cache, the choice holds for this process only
+        pass
+
+    return _choices[k]
@@ -0,0 +1,539 @@
+#
+# The distance matrix kernels of the course
+#
+# Every backend computes the (n, m) matrix of the distances between the rows
+# of the (n, k) and (m, k) arrays x and y with its own kernels:
+#
+#   numpy   the Euclidean distances by |x|^2 + |y|^2 - 2*x.y^T, as in
+#           numpy/, and the cityblock distances by broadcasting, over blocks
+#           of rows to bound the temporary
+#   scipy   scipy.spatial.distance.cdist()
+#   numba   parallel loops, as in numba/simple/
+#   cffi    cbdm_double() and cbdm_float() of cffi/, cityblock only, on the
+#           threads of numba
+#   f2py    the metrics.edm and metrics.cbdm modules of f2py/
+#
+# The Fortran kernels only compute in double precision and only square
+# matrices, n == m, which is all they were written for; compute() runs them
+# on square blocks of other matrices.
+#
+# Every backend writes the distances into an array out of the layouts and
+# dtypes it reports by writes(out), see accepts(), and compute() copies them
+# into out only for the others, so that a call takes the memory of out and
+# of O(n + m) scratch: the numpy backend computes |x|^2 + |y|^2 - 2*x.y^T in
+# place in out, or those of single precision points or distances in double
+# precision over blocks of rows of at most BLOCK_BYTES, and its cityblock distances
+# with temporaries of at most BLOCK_BYTES. The square kernels take a block of scratch on rectangular
+# problems.
+#
+# The distances of the points of x to each other are symmetric and zero on
+# the diagonal. compute_self() computes them with the kernels of the backend
+# that compute only those of i < j, if it has any, the ones of cffi/ and
+# f2py/ and scipy's pdist(), and can return them condensed, as pdist() does,
+# which the other backends write into out tile by tile. The backends write
+# them into the arrays accepts(name, out, symmetric) tells, of which scipy
+# writes the whole matrix by cdist() rather than pdist() and a copy.
+
+import collections
+import importlib
+
+import numba
+import numpy as np
+
+METRICS = ['euclidean', 'sqeuclidean', 'cityblock']
+
+# the numpy backend broadcasts blocks of rows whose temporary is at most
+# this large
+BLOCK_BYTES = 2**24
+
+# metric: the metrics the backend computes
+# square: whether it only computes square matrices, see _square_blocks()
+# double: whether it only computes in double precision
+# compute: compute(x, y, metric, out), with x and y in the precision of the
+#   result, or in double precision for a single precision out, and, for the
+#   kernels of double precision only, C-contiguous, writing into out unless
+#   it is None
+# writes: writes(out), whether compute() writes into out as it is
+# symmetric: symmetric(x, metric, condensed, out), the distances of x to
+#   itself by kernels that compute only the ones of i < j, or None; it
+#   writes into out if it can, and returns the distances
+# writes_symmetric: writes_symmetric(out), whether symmetric() writes into
+#   out as it is, or None with symmetric
+# load: the modules of the kernels, raising ImportError if there are none
+Backend = collections.namedtuple(
+    'Backend',
+    ['name', 'metrics', 'square', 'double', 'compute', 'writes', 'symmetric',
+     'writes_symmetric', 'load']
+)
+
+
+def _contiguous(out, dtypes):
+    # whether out is C- or F-contiguous, of one of the dtypes
+    return (out.dtype in dtypes and
+            (out.flags.c_contiguous or out.flags.f_contiguous))
+
+
+def _floating(out):
+    return out.dtype in (np.float32, np.float64)
+
+
+def norms(x, dtype=None):
+    # the squared norms of the rows of x, summed in dtype if given
+    return np.einsum('ij,ij->i', x, x, dtype=dtype)
+
+
+def gram_distances(r, x2, y2, metric):
+    # the Euclidean distances |x|^2 + |y|^2 - 2*x.y^T in place of the
+    # products x.y^T in r, of the squared norms x2 and y2
+    r *= -2.
+    r += x2[:, np.newaxis]
+    r += y2[np.newaxis, :]
+
+    # rounding leaves some of the distances of close points below zero,
+    # which are clamped to zero, where np.abs() would turn the cancellation
+    # error into a distance
+    np.maximum(r, 0., out=r)
+    if metric == 'euclidean':
+        np.sqrt(r, out=r)
+
+    return r
+
+
+def _numpy(x, y, metric, out):
+    if metric == 'cityblock':
+        r = np.empty((len(x), len(y)), dtype=x.dtype) if out is None else out
+        rows = max(1, BLOCK_BYTES // max(1, y.nbytes))
+        for i in range(0, len(x), rows):
+            # summed in the precision of the points, not that of out
+            np.abs(x[i:i+rows, np.newaxis, :] - y[np.newaxis, :, :]).sum(
+                axis=-1, dtype=x.dtype, out=r[i:i+rows]
+            )
+
+        return r
+
+    if x.dtype == np.float32 or (out is not None and
+                                 out.dtype == np.float32):
+        return _numpy_single(x, y, metric, out)
+
+    # the product into out, or into its transpose, which is C-contiguous if
+    # out is F-contiguous
+    if out is None:
+        r = x @ y.T
+    elif out.flags.c_contiguous:
+        r = np.matmul(x, y.T, out=out)
+    else:
+        r = out
+        np.matmul(y, x.T, out=out.T)
+
+    return gram_distances(r, norms(x), norms(y), metric)
+
+
+def _numpy_single(x, y, metric, out):
+    # |x|^2 + |y|^2 - 2*x.y^T cancels to the few digits of single precision
+    # that are left for close points, so the products and the norms of
+    # single precision points, or of the points of single precision
+    # distances, are computed in double precision, over blocks of rows of
+    # at most BLOCK_BYTES, and rounded once into the result
+    r = np.empty((len(x), len(y)), dtype=x.dtype) if out is None else out
+    y = y.astype(np.float64, copy=False)
+    y2 = norms(y)
+    rows = max(1, BLOCK_BYTES // max(1, 8*len(y)))
+    for i in range(0, len(x), rows):
+        xb = x[i:i+rows].astype(np.float64, copy=False)
+        r[i:i+rows] = gram_distances(xb @ y.T, norms(xb), y2, metric)
+
+    return r
+
+
+def _numpy_writes(out):
+    return _contiguous(out, [np.float32, np.float64])
+
+
+def _scipy(x, y, metric, out):
+    from scipy.spatial.distance import cdist
+
+    return cdist(x, y, metric, out=out)
+
+
+def _scipy_writes(out):
+    return out.dtype == np.float64 and out.flags.c_contiguous
+
+
+def _scipy_symmetric(x, metric, condensed, out):
+    from scipy.spatial.distance import cdist, pdist, squareform
+
+    writes = out is not None and _scipy_writes(out)
+    if condensed:
+        return pdist(x, metric, out=out if writes else None)
+
+    # cdist() writes the whole matrix into out, of all the pairs rather
+    # than half of them but without the scratch of pdist() and squareform(),
+    # and with zeros of x - x on the diagonal
+    if writes:
+        return cdist(x, x, metric, out=out)
+
+    return squareform(pdist(x, metric), checks=False)
+
+
+def _load_scipy():
+    return importlib.import_module('scipy.spatial.distance')
+
+
+@numba.njit(cache=True, parallel=True)
+def _numba_sqeuclidean(x, y, r):
+    for i in numba.prange(x.shape[0]):
+        for j in range(y.shape[0]):
+            s = x.dtype.type(0.)
+            for k in range(x.shape[1]):
+                d = x[i, k] - y[j, k]
+                s += d*d
+
+            r[i, j] = s
+
+
+@numba.njit(cache=True, parallel=True)
+def _numba_cityblock(x, y, r):
+    for i in numba.prange(x.shape[0]):
+        for j in range(y.shape[0]):
+            s = x.dtype.type(0.)
+            for k in range(x.shape[1]):
+                s += abs(x[i, k] - y[j, k])
+
+            r[i, j] = s
+
+
+def _numba(x, y, metric, out):
+    # the kernels sum in the precision of the points, and round once into r
+    r = np.empty((len(x), len(y)), dtype=x.dtype) if out is None else out
+    if metric == 'cityblock':
+        _numba_cityblock(x, y, r)
+    else:
+        _numba_sqeuclidean(x, y, r)
+        if metric == 'euclidean':
+            np.sqrt(r, out=r)
+
+    return r
+
+
+def _numba_writes(out):
+    # the kernels are compiled for any layout
+    return _floating(out)
+
+
+def _cffi_kernel(cityblock, x, y, r):
+    # cbdm_float() or cbdm_double() into the C-contiguous r, of the dtype of
+    # x and y
+    if r.dtype == np.float32:
+        fn, real = cityblock.lib.cbdm_float, 'float *'
+    else:
+        fn, real = cityblock.lib.cbdm_double, 'double *'
+
+    ffi = cityblock.ffi
+    fn(ffi.cast(real, x.ctypes.data), ffi.cast(real, y.ctypes.data),
+       ffi.cast(real, r.ctypes.data), len(x), len(y), x.shape[1],
+       numba.get_num_threads())
+    return r
+
+
+def _cffi(x, y, metric, out):
+    cityblock = importlib.import_module('_cityblock')
+    x = np.ascontiguousarray(x)
+    y = np.ascontiguousarray(y)
+    r = np.empty((len(x), len(y)), dtype=x.dtype) if out is None else out
+    if r.dtype == x.dtype:
+        return _cffi_kernel(cityblock, x, y, r)
+
+    # the differences of double precision points cancel in single precision,
+    # so those of a single precision out are computed in double precision,
+    # over blocks of rows of at most BLOCK_BYTES, and rounded once into r
+    rows = max(1, BLOCK_BYTES // max(1, 8*len(y)))
+    for i in range(0, len(x), rows):
+        xb = x[i:i+rows]
+        r[i:i+rows] = _cffi_kernel(cityblock, xb, y,
+                                   np.empty((len(xb), len(y))))
+
+    return r
+
+
+def _cffi_writes(out):
+    return _floating(out) and out.flags.c_contiguous
+
+
+def _cffi_writes_symmetric(out):
+    # the kernels of x to itself are of double precision only
+    return out.dtype == np.float64 and out.flags.c_contiguous
+
+
+def _cffi_symmetric(x, metric, condensed, out):
+    cityblock = importlib.import_module('_cityblock')
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    n = len(x)
+    ffi = cityblock.ffi
+    fn = cityblock.lib.cbdm_condensed if condensed else cityblock.lib.cbdm_self
+    if out is not None and _cffi_writes_symmetric(out):
+        r = out
+    else:
+        r = np.empty(n*(n - 1)//2 if condensed else (n, n))
+
+    fn(ffi.cast('double *', x.ctypes.data),
+       ffi.cast('double *', r.ctypes.data), n, x.shape[1])
+    return r
+
+
+def _load_cffi():
+    cityblock = importlib.import_module('_cityblock')
+    if not all(hasattr(cityblock.lib, name)
+               for name in ['cbdm_condensed', 'cbdm_double', 'cbdm_float']):
+        raise ImportError('_cityblock was built from older sources, '
+                          'rebuild it')
+
+    return cityblock
+
+
+def _pythonized(fn):
+    # whether fn is of f2py/distance-f90-pythonized, returning its result
+    return fn.__doc__.lstrip()[:4] in ('r = ', 'd = ')
+
+
+def _f2py_kernel(metric):
+    if metric == 'cityblock':
+        module = importlib.import_module('metrics.cbdm')
+        return module.cityblock_distance_matrix
+
+    module = importlib.import_module('metrics.edm')
+    return module.euclidean_distance_matrix
+
+
+def _f2py(x, y, metric, out):
+    # the Fortran kernels take the points as columns, which x.T is without
+    # a copy; those of f2py/distance-f90 write into r, F-contiguous, which
+    # the transpose of a C-contiguous out is, of the distances of y and x,
+    # and those of f2py/distance-f90-pythonized return it
+    fn = _f2py_kernel(metric)
+    if _pythonized(fn):
+        r = fn(x.T, y.T)
+    elif out is not None and out.flags.c_contiguous:
+        r = out
+        fn(y.T, x.T, len(x), x.shape[1], r.T)
+    else:
+        r = np.empty((len(x), len(y)), order='F') if out is None else out
+        fn(x.T, y.T, len(x), x.shape[1], r)
+
+    if metric == 'euclidean':
+        np.sqrt(r, out=r)
+
+    return r
+
+
+def _f2py_writes(out):
+    return (_contiguous(out, [np.float64]) and
+            not _pythonized(_f2py_kernel('euclidean')))
+
+
+def _f2py_symmetric(x, metric, condensed, out):
+    n = len(x)
+    if metric == 'cityblock':
+        module, name = importlib.import_module('metrics.cbdm'), 'cityblock'
+    else:
+        module, name = importlib.import_module('metrics.edm'), 'euclidean'
+
+    if condensed:
+        fn = getattr(module, f'{name}_distance_condensed')
+        shape = n*(n - 1)//2
+    else:
+        fn = getattr(module, f'{name}_distance_matrix_self')
+        shape = (n, n)
+
+    if _pythonized(fn):
+        r = fn(x.T)
+    else:
+        # the symmetric matrix is its transpose, in either order
+        if out is not None and _f2py_writes(out):
+            r = out
+        else:
+            r = np.empty(shape, order='F')
+
+        fn(x.T, n, x.shape[1], r.T if r.flags.c_contiguous else r)
+
+    if metric == 'euclidean':
+        np.sqrt(r, out=r)
+
+    return r
+
+
+def _load_f2py():
+    modules = (importlib.import_module('metrics.edm'),
+               importlib.import_module('metrics.cbdm'))
+    if not all(hasattr(module, f'{name}_distance_condensed')
+               for module, name in zip(modules, ['euclidean', 'cityblock'])):
+        raise ImportError('metrics.edm and metrics.cbdm were built without '
+                          'the self-distance kernels, rebuild them')
+
+    return modules
+
+
+def _none():
+    return None
+
+
+BACKENDS = {
+    backend.name: backend for backend in [
+        Backend('numpy', METRICS, False, False, _numpy, _numpy_writes, None,
+                None, _none),
+        Backend('scipy', METRICS, False, True, _scipy, _scipy_writes,
+                _scipy_symmetric, _scipy_writes, _load_scipy),
+        Backend('numba', METRICS, False, False, _numba, _numba_writes, None,
+                None, _none),
+        Backend('cffi', ['cityblock'], False, False, _cffi, _cffi_writes,
+                _cffi_symmetric, _cffi_writes_symmetric, _load_cffi),
+        Backend('f2py', METRICS, True, True, _f2py, _f2py_writes,
+                _f2py_symmetric, _f2py_writes, _load_f2py),
+    ]
+}
+
+_loaded = {}
+
+
+def installed(name):
+    # whether the kernels of the backend can be imported
+    if name not in _loaded:
+        try:
+            BACKENDS[name].load()
+            _loaded[name] = True
+        except ImportError:
+            _loaded[name] = False
+
+    return _loaded[name]
+
+
+def available(metric):
+    """The names of the backends that compute `metric`."""
+    return [name for name, backend in BACKENDS.items()
+            if metric in backend.metrics and installed(name)]
+
+
+def accepts(name, out, symmetric=None):
+    """Whether the backend writes the distance matrix into the array `out`
+    without a copy, as it is laid out and of its dtype, or the distances of
+    the points to each other if `symmetric` is 'matrix' or 'condensed'."""
+    if not installed(name):
+        return False
+
+    backend = BACKENDS[name]
+    if symmetric is None:
+        return backend.writes(out)
+
+    if backend.symmetric is not None:
+        return backend.writes_symmetric(out)
+
+    # compute_self() writes the condensed rows into any out, and the matrix
+    # by compute()
+    return _floating(out) if symmetric == 'condensed' else backend.writes(out)
+
+
+def _square_blocks(compute, x, y, metric, out):
+    # the distances of x and y by a kernel of square matrices, on blocks of
+    # side min(n, m) along the longer side, the last of which is padded
+    # with points at the origin
+    n, m, k = len(x), len(y), x.shape[1]
+    side = min(n, m)
+    if n == m and side:
+        return compute(x, y, metric, out)
+
+    r = np.empty((n, m)) if out is None else out
+    if side == 0:
+        return r
+
+    for i in range(0, n, side):
+        for j in range(0, m, side):
+            xb, yb = x[i:i+side], y[j:j+side]
+            rows, cols = len(xb), len(yb)
+            if rows < side:
+                xb = np.concatenate([xb, np.zeros((side - rows, k))])
+            if cols < side:
+                yb = np.concatenate([yb, np.zeros((side - cols, k))])
+
+            r[i:i+rows, j:j+cols] = compute(xb, yb, metric,
+                                            None)[:rows, :cols]
+
+    return r
+
+
+def _into(r, out, dtype):
+    # r in out, which it is if the backend wrote into out, or in dtype
+    if out is None:
+        return r.astype(dtype, copy=False)
+
+    if r is not out:
+        out[...] = r
+
+    return out
+
+
+def compute(name, x, y, metric, out=None):
+    # the distance matrix by the backend, in out if given, or in the dtype
+    # of x and y; the kernels of double precision only get C-contiguous
+    # arrays of it
+    backend = BACKENDS[name]
+    dtype = x.dtype if out is None else out.dtype
+    if backend.double:
+        # from the points as given, rather than rounded to dtype first
+        x = np.ascontiguousarray(x, dtype=np.float64)
+        y = np.ascontiguousarray(y, dtype=np.float64)
+    else:
+        # at least in dtype, double precision points are not rounded to
+        # single precision, whose differences would cancel
+        precision = np.result_type(x.dtype, y.dtype, dtype)
+        x = x.astype(precision, copy=False)
+        y = y.astype(precision, copy=False)
+
+    target = out if out is not None and backend.writes(out) else None
+    if backend.square:
+        r = _square_blocks(backend.compute, x, y, metric, target)
+    else:
+        r = backend.compute(x, y, metric, target)
+
+    return _into(r, out, dtype)
+
+
+def _condensed_tiles(name, x, metric, out):
+    # the distances of i < j of x in the order of pdist(), in out if given,
+    # by compute() on blocks of rows of x of at most BLOCK_BYTES of the
+    # distances to the rows that follow them, without the whole matrix
+    n = len(x)
+    r = np.empty(n*(n - 1)//2, dtype=x.dtype) if out is None else out
+    rows = max(1, BLOCK_BYTES // max(1, n * x.itemsize))
+    for i0 in range(0, n - 1, rows):
+        i1 = min(i0 + rows, n - 1)
+        tile = compute(name, x[i0:i1], x[i0+1:], metric)
+        for i in range(i0, i1):
+            # the distances of row i to the rows j > i
+            start = i*n - i*(i + 1)//2
+            r[start:start + n - i - 1] = tile[i - i0, i - i0:]
+
+    return r
+
+
+def compute_self(name, x, metric, condensed=False, out=None):
+    # the distances of x to itself by the backend, in out if given, or in
+    # the dtype of x, as a matrix or condensed to those of i < j in the order
+    # of pdist()
+    backend = BACKENDS[name]
+    dtype = x.dtype if out is None else out.dtype
+    if backend.double:
+        x = np.ascontiguousarray(x, dtype=np.float64)
+    else:
+        x = x.astype(np.result_type(x.dtype, dtype), copy=False)
+
+    if backend.symmetric is not None:
+        r = backend.symmetric(x, metric, condensed, out)
+    elif condensed:
+        r = _condensed_tiles(name, x, metric, out)
+    else:
+        r = compute(name, x, x, metric, out)
+
+        # the distances of the points to themselves are zero, rather than
+        # the rounding errors of |x|^2 + |x|^2 - 2*x.x^T
+        np.fill_diagonal(r, 0.)
+
+    return _into(r, out, dtype)
@@ -0,0 +1,88 @@
+#
+# The distance matrix of two sets of points
+#
+
+import numpy as np
+
+from . import backends
+from .autotune import tune
+
+
+def points(x, y):
+    # x and y, or x twice if y is None, as arrays of points of the floating
+    # point type of the distances
+    x = np.asarray(x)
+    y = x if y is None else np.asarray(y)
+    dtype = np.result_type(x, y, np.float32)
+    x = x.astype(dtype, copy=False)
+    y = y.astype(dtype, copy=False)
+    if x.ndim != 2 or y.ndim != 2 or x.shape[1] != y.shape[1]:
+        raise ValueError(f'x and y must be arrays of points with as many '
+                         f'coordinates, not of the shapes {x.shape} and '
+                         f'{y.shape}')
+
+    return x, y
+
+
+def check_out(out, shape):
+    # that out, if given, can hold the distances
+    if out is not None and (not isinstance(out, np.ndarray) or
+                            out.dtype not in (np.float32, np.float64) or
+                            out.shape != shape):
+        raise ValueError(f'out must be a float32 or float64 array of the '
+                         f'shape {shape} of the distances')
+
+
+def select(backend, metric, x, y, condensed=False, out=None):
+    # the backend of the distances of x and y, or of x to itself if y is
+    # None, the fastest for 'auto' of those that write into out, if any do
+    if metric not in backends.METRICS:
+        raise ValueError(f'unknown metric: {metric}')
+
+    if backend == 'auto':
+        return tune(metric, x, y, condensed, out)
+
+    if backend not in backends.BACKENDS:
+        raise ValueError(f'unknown backend: {backend}')
+
+    if backend not in backends.available(metric):
+        raise ValueError(f'backend {backend} cannot compute {metric} '
+                         f'distances here')
+
+    return backend
+
+
+def distance_matrix(x, y=None, metric='euclidean', backend='auto',
+                    condensed=False, out=None):
+    """The (n, m) matrix of the distances between the rows of the (n, k) and
+    (m, k) arrays x and y, or between those of x if y is None.
+
+    metric is one of METRICS, and backend one of BACKENDS, or 'auto' for the
+    fastest one that is available. The distances are in the floating point
+    type of x and y, at least single precision.
+
+    If y is None, only the distances of i < j are computed, and condensed
+    returns them as the vector of n*(n-1)/2 distances of
+    scipy.spatial.distance.pdist() rather than as the symmetric matrix.
+
+    out is an array of float32 or float64 to write the distances into,
+    which is returned, and whose dtype the distances are computed in. The
+    backends write into C- or F-contiguous arrays without a copy, except
+    for those that accepts() tells they do not; 'auto' chooses among those
+    that do, if any.
+    """
+    if y is None:
+        x, _ = points(x, None)
+        n = len(x)
+        check_out(out, (n*(n - 1)//2,) if condensed else (n, n))
+        backend = select(backend, metric, x, None, condensed, out)
+        return backends.compute_self(backend, x, metric, condensed, out)
+
+    if condensed:
+        raise ValueError('condensed distances are those of x to itself, '
+                         'y must be None')
+
+    x, y = points(x, y)
+    check_out(out, (len(x), len(y)))
+    backend = select(backend, metric, x, y, out=out)
+    return backends.compute(backend, x, y, metric, out)
@@ -0,0 +1,80 @@
+#
+# The distances of queries to a fixed set of points
+#
+# A service that answers many small batches of queries x against the same
+# points y computes, with distance_matrix(), the norms of y and takes y.T
+# again for every batch. DistanceIndex does that once: it keeps the squared
+# norms of y and y transposed into a C-contiguous (k, m) array, so that a
+# batch takes the matrix product x.y^T, the norms of x and the additions in
+# place, see backends.gram_distances().
+#
+# The products and the norms are in double precision whatever the dtype of
+# the distances: in single precision, |x|^2 + |y|^2 - 2*x.y^T cancels to
+# almost no digits for close points, see backends._numpy_single(). The
+# distances of a single precision index are computed over blocks of rows of
+# at most BLOCK_BYTES and rounded once.
+
+import numpy as np
+
+from . import backends
+from .backends import BLOCK_BYTES
+from .distance import points
+
+INDEX_METRICS = ['euclidean', 'sqeuclidean']
+
+
+class DistanceIndex:
+    """The points of the (m, k) array y, to which distances() computes the
+    distances of batches of query points.
+
+    metric is one of INDEX_METRICS. dtype is the floating point type of the
+    distances, by default that of y, at least single precision; np.float32
+    halves the memory of the distances, which are computed in double
+    precision and rounded.
+    """
+
+    def __init__(self, y, metric='euclidean', dtype=None):
+        if metric not in INDEX_METRICS:
+            raise ValueError(f'the index computes Euclidean distances, not '
+                             f'{metric}')
+
+        y, _ = points(y, None)
+        self.metric = metric
+        self.dtype = np.dtype(y.dtype if dtype is None else dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError(f'dtype must be float32 or float64, not '
+                             f'{self.dtype}')
+
+        self.yt = np.ascontiguousarray(y.T, dtype=np.float64)
+        self.y2 = backends.norms(self.yt.T)
+
+    def __len__(self):
+        return self.yt.shape[1]
+
+    def distances(self, x, out=None):
+        """The (n, m) matrix of the distances of the rows of the (n, k) array
+        x to the points of the index, in out if given, a C-contiguous array
+        of the dtype of the index."""
+        x = np.asarray(x, dtype=np.float64)
+        if x.ndim != 2 or x.shape[1] != self.yt.shape[0]:
+            raise ValueError(f'x must be an array of points with '
+                             f'{self.yt.shape[0]} coordinates, not of the '
+                             f'shape {x.shape}')
+
+        if self.dtype == np.float64:
+            r = np.matmul(x, self.yt, out=out)
+            return backends.gram_distances(r, backends.norms(x), self.y2,
+                                           self.metric)
+
+        r = out
+        if r is None:
+            r = np.empty((len(x), len(self)), dtype=self.dtype)
+
+        rows = max(1, BLOCK_BYTES // max(1, 8*len(self)))
+        for i in range(0, len(x), rows):
+            xb = x[i:i+rows]
+            r[i:i+rows] = backends.gram_distances(xb @ self.yt,
+                                                  backends.norms(xb),
+                                                  self.y2, self.metric)
+
+        return r
@@ -0,0 +1,167 @@
+#
+# The k nearest neighbours of points
+#
+# What is used of a distance matrix is often only the k nearest neighbours
+# of every point, which argsort() or argpartition() find in the matrix, of
+# n*m distances, 20 GB for 50000 points in double precision. knn() keeps
+# only the (n, k) neighbours:
+#
+#   numba   the kernel computes the distances of a block of rows of x to a
+#           tile of y at a time, the Euclidean ones by a matrix product as
+#           in numpy/, and keeps the k nearest of every row in a max-heap,
+#           whose root, the farthest of them, is the only one a distance is
+#           compared to
+#   others  the distances are computed in tiles of rows, see tiled.py, and
+#           the neighbours of every tile found by argpartition()
+#
+# The Euclidean neighbours are those of the squared distances, of which only
+# the k of every row are square rooted, computed in double precision for
+# single precision points.
+
+import numba
+import numpy as np
+
+from . import backends
+from .distance import points
+from .tiled import distance_tiles
+
+# the rows of x and the points of y in the blocks and tiles of the kernel
+BLOCK_ROWS = 256
+TILE_POINTS = 1024
+
+
+@numba.njit(cache=True)
+def _sift_down(distances, indices, start, end):
+    # restore the max-heap of distances[start:end] whose root was replaced
+    i = start
+    while True:
+        child = 2*i + 1
+        if child >= end:
+            break
+
+        if child + 1 < end and distances[child + 1] > distances[child]:
+            child += 1
+
+        if distances[child] <= distances[i]:
+            break
+
+        distances[i], distances[child] = distances[child], distances[i]
+        indices[i], indices[child] = indices[child], indices[i]
+        i = child
+
+
+@numba.njit(cache=True)
+def _tile(x, y, x2, y2, cityblock):
+    # the distances of the rows of x to the points of y, squared for the
+    # Euclidean ones, which are |x|^2 + |y|^2 - 2*x.y^T by a matrix product
+    if cityblock:
+        r = np.empty((x.shape[0], y.shape[0]), dtype=x.dtype)
+        for i in range(x.shape[0]):
+            for j in range(y.shape[0]):
+                s = r.dtype.type(0.)
+                for l in range(x.shape[1]):
+                    s += abs(x[i, l] - y[j, l])
+
+                r[i, j] = s
+    else:
+        r = np.dot(x, y.T)
+        for i in range(x.shape[0]):
+            for j in range(y.shape[0]):
+                r[i, j] = max(x2[i] + y2[j] - 2*r[i, j], 0.)
+
+    return r
+
+
+@numba.njit(cache=True, parallel=True)
+def _knn(x, y, cityblock, itself, indices, distances):
+    # the k = indices.shape[1] nearest points of y to every row of x, the
+    # point of the same index left out if itself, y being x
+    n, m, k = x.shape[0], y.shape[0], indices.shape[1]
+    x2 = (x*x).sum(axis=1)
+    y2 = (y*y).sum(axis=1)
+    blocks = (n + BLOCK_ROWS - 1) // BLOCK_ROWS
+    for b in numba.prange(blocks):
+        first = b*BLOCK_ROWS
+        last = min(first + BLOCK_ROWS, n)
+        distances[first:last] = np.inf
+        indices[first:last] = -1
+        for tile in range(0, m, TILE_POINTS):
+            end = min(tile + TILE_POINTS, m)
+            r = _tile(x[first:last], y[tile:end], x2[first:last],
+                      y2[tile:end], cityblock)
+            for i in range(first, last):
+                heap = distances[i]
+                for j in range(tile, end):
+                    s = r[i - first, j - tile]
+                    if s < heap[0] and not (itself and i == j):
+                        heap[0] = s
+                        indices[i, 0] = j
+                        _sift_down(heap, indices[i], 0, k)
+
+        # sort the heaps, nearest first
+        for i in range(first, last):
+            for end in range(k - 1, 0, -1):
+                distances[i, 0], distances[i, end] = \
+                    distances[i, end], distances[i, 0]
+                indices[i, 0], indices[i, end] = \
+                    indices[i, end], indices[i, 0]
+                _sift_down(distances[i], indices[i], 0, end)
+
+
+def _knn_tiles(x, y, k, metric, backend, itself, rows):
+    # the neighbours of every tile of rows of the distance matrix
+    indices = np.empty((len(x), k), dtype=np.intp)
+    distances = np.empty((len(x), k), dtype=x.dtype)
+    for i, tile in distance_tiles(x, y, metric, backend, rows):
+        r = np.arange(len(tile))
+        if itself:
+            tile[r, i + r] = np.inf
+
+        nearest = np.argpartition(tile, k - 1, axis=1)[:, :k]
+        d = np.take_along_axis(tile, nearest, axis=1)
+        order = np.argsort(d, axis=1, kind='stable')
+        indices[i:i+len(tile)] = np.take_along_axis(nearest, order, axis=1)
+        distances[i:i+len(tile)] = np.take_along_axis(d, order, axis=1)
+
+    return indices, distances
+
+
+def knn(x, y=None, k=1, metric='euclidean', backend='numba', rows=None):
+    """The k nearest neighbours among the rows of the (m, d) array y of
+    every row of the (n, d) array x, or among the other rows of x if y is
+    None, as the (n, k) arrays (indices, distances) of the neighbours,
+    nearest first.
+
+    The numba backend computes the neighbours in one kernel without the
+    distance matrix. Any other backend, see distance_matrix(), computes the
+    matrix in tiles of rows, see distance_tiles().
+    """
+    itself = y is None
+    x, y = points(x, y)
+    if metric not in backends.METRICS:
+        raise ValueError(f'unknown metric: {metric}')
+
+    if not 1 <= k <= len(y) - itself:
+        raise ValueError(f'k must be between 1 and the {len(y) - itself} '
+                         f'points to choose from, not {k}')
+
+    if backend != 'numba':
+        return _knn_tiles(x, y, k, metric, backend, itself, rows)
+
+    # the Euclidean distances |x|^2 + |y|^2 - 2*x.y^T of close points cancel
+    # to the few digits of single precision that are left, so they are
+    # computed from double precision copies of single precision points, as
+    # the numpy backend does, and rounded once
+    dtype = x.dtype
+    if metric != 'cityblock':
+        x = x.astype(np.float64, copy=False)
+        y = y.astype(np.float64, copy=False)
+
+    indices = np.empty((len(x), k), dtype=np.intp)
+    distances = np.empty((len(x), k), dtype=x.dtype)
+    _knn(np.ascontiguousarray(x), np.ascontiguousarray(y),
+         metric == 'cityblock', itself, indices, distances)
+    if metric == 'euclidean':
+        np.sqrt(distances, out=distances)
+
+    return indices, distances.astype(dtype, copy=False)
@@ -0,0 +1,107 @@
+#
+# The distances of every backend compared to cdist() on near-duplicate
+# points, whose Euclidean distances cancel in |x|^2 + |y|^2 - 2*x.y^T, and
+# the distances of the points to each other by every function of metrics
+#
+#   python -m metrics.test_metrics
+#
+
+import tempfile
+
+import numpy as np
+from scipy.spatial.distance import cdist, pdist, squareform
+
+import metrics
+
+nsamples, nfeat = 2000, 100
+
+rng = np.random.default_rng()
+x = rng.random((nsamples, nfeat))
+y = x + 1e-4 * rng.standard_normal(x.shape)
+
+
+def relative(r, r_cdist):
+    return (np.abs(r - r_cdist) / r_cdist).max()
+
+
+for dtype in (np.float64, np.float32):
+    xd, yd = x.astype(dtype), y.astype(dtype)
+
+    # the distances of the points as they are given, in double precision
+    r_cdist = {metric: cdist(xd.astype(np.float64), yd.astype(np.float64),
+                             metric) for metric in metrics.METRICS}
+
+    print(f'\n{np.dtype(dtype).name}: relative difference to cdist')
+    for metric in metrics.METRICS:
+        for backend in ['auto'] + metrics.available(metric):
+            r = metrics.distance_matrix(xd, yd, metric, backend)
+            print(f'{metric:11s} {backend:5s} : '
+                  f'{relative(r, r_cdist[metric]):.2e}')
+
+# the distances of the points to each other, whose diagonal is zero by all
+# of distance_matrix(), distance_tiles() and distance_memmap()
+x32 = x.astype(np.float32)
+print('\nfloat32: distances of x to itself, difference to distance_matrix()')
+for backend in metrics.available('euclidean'):
+    r = metrics.distance_matrix(x32, backend=backend)
+    tiles = np.concatenate([tile for _, tile in metrics.distance_tiles(
+        x32, backend=backend, rows=300)])
+    with tempfile.TemporaryDirectory() as tmp:
+        r_memmap = metrics.distance_memmap(f'{tmp}/r.npy', x32,
+                                           backend=backend, rows=300)
+        memmap_diff = np.abs(r_memmap - r).max()
+        del r_memmap
+
+    print(f'euclidean   {backend:5s} : tiles {np.abs(tiles - r).max():.2e}, '
+          f'memmap {memmap_diff:.2e}, diagonal {np.abs(np.diag(r)).max():.2e}')
+
+# the index, whose products are in double precision for either dtype
+print('\nDistanceIndex: relative difference to cdist')
+r_cdist = cdist(x, y)
+for dtype in (np.float64, np.float32):
+    r = metrics.DistanceIndex(y, dtype=dtype).distances(x)
+    print(f'{np.dtype(dtype).name:11s}       : {relative(r, r_cdist):.2e}')
+
+# double precision points into a single precision out, which every backend
+# computes from the points as given and rounds once into out
+print('\nfloat64 points, float32 out: relative difference to cdist')
+for metric in metrics.METRICS:
+    r_cdist = cdist(x, y, metric)
+    for backend in metrics.available(metric):
+        out = np.empty((nsamples, nsamples), dtype=np.float32)
+        r = metrics.distance_matrix(x, y, metric, backend, out=out)
+        print(f'{metric:11s} {backend:5s} : {relative(r, r_cdist):.2e}')
+
+# the nearest neighbours of single precision points, among near duplicates
+print('\nfloat32 knn: neighbours found, relative difference to cdist')
+r_cdist = cdist(x32.astype(np.float64), y.astype(np.float32).astype(np.float64))
+nearest = np.argsort(r_cdist, axis=1, kind='stable')[:, :5]
+d_cdist = np.take_along_axis(r_cdist, nearest, axis=1)
+for backend in metrics.available('euclidean'):
+    indices, distances = metrics.knn(x32, y.astype(np.float32), k=5,
+                                     backend=backend)
+    print(f'euclidean   {backend:5s} : {(indices == nearest).mean():.1%}, '
+          f'{relative(distances, d_cdist):.2e}')
+
+# the distances of the points to each other into out, as an F-contiguous
+# matrix and condensed, by the backends that write into it without a copy
+# and by the others
+print('\nfloat64: distances of x to itself into out, difference to pdist')
+for metric in metrics.METRICS:
+    d_pdist = pdist(x, metric)
+    for backend in ['auto'] + metrics.available(metric):
+        out_matrix = np.empty((nsamples, nsamples), order='F')
+        out_condensed = np.empty(len(d_pdist))
+        matrix = metrics.distance_matrix(x, None, metric, backend,
+                                         out=out_matrix)
+        condensed = metrics.distance_matrix(x, None, metric, backend,
+                                            condensed=True, out=out_condensed)
+        matrix_diff = np.abs(squareform(matrix, checks=False) - d_pdist).max()
+        print(f'{metric:11s} {backend:5s} : matrix {matrix_diff:.2e}, '
+              f'condensed {np.abs(condensed - d_pdist).max():.2e}', end='')
+        if backend != 'auto':
+            print(f', written into out: '
+                  f'{metrics.accepts(backend, out_matrix, "matrix")}, '
+                  f'{metrics.accepts(backend, out_condensed, "condensed")}',
+                  end='')
+        print()
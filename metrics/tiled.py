@@ -0,0 +1,89 @@
+#
+# Distance matrices in tiles of rows
+#
+# The distance matrix of 12000 points, as in f2py/, takes 1.1 GB in double
+# precision, and the matrices of a few times as many points take more memory
+# than a node has. distance_tiles() computes the matrix in tiles of rows,
+# each only when it is asked for, so that a pipeline that consumes the tiles
+# one after the other holds one tile at a time. distance_memmap() writes the
+# tiles into a .npy file mapped into memory, whose pages are written back
+# to the file after every tile, so that the matrix can be larger than the
+# memory.
+#
+# A tile holds the distances of its rows of x to all of y and is computed by
+# one call of the backend, see backends.compute(), which runs the Fortran
+# kernels on square blocks of the tile.
+
+import numpy as np
+
+from . import backends
+from .distance import points, select
+
+# the size of a tile, if its rows are not given
+TILE_BYTES = 2**26
+
+
+def tile_rows(m, dtype, rows=None):
+    # the rows of the tiles of a matrix with m columns
+    if rows is not None:
+        if rows < 1:
+            raise ValueError(f'rows must be positive: {rows}')
+
+        return rows
+
+    return max(1, TILE_BYTES // max(1, m * np.dtype(dtype).itemsize))
+
+
+def _zero_diagonal(tile, i):
+    # the distances of the points of the tile of the rows i... to themselves
+    # are zero, as those of backends.compute_self(), rather than the
+    # rounding errors of |x|^2 + |x|^2 - 2*x.x^T
+    r = np.arange(len(tile))
+    tile[r, i + r] = 0.
+
+
+def distance_tiles(x, y=None, metric='euclidean', backend='auto', rows=None):
+    """Yield the distance matrix of distance_matrix() in tiles of rows, as
+    pairs (i, tile) of the first row i of a tile and the tile, the distances
+    of x[i:i+len(tile)] to all of y.
+
+    rows is the number of rows of a tile, by default as many as fit in
+    TILE_BYTES. With backend='auto', the backend is chosen for a problem of
+    the size of a tile.
+    """
+    itself = y is None
+    x, y = points(x, y)
+    rows = tile_rows(len(y), x.dtype, rows)
+    backend = select(backend, metric, x[:rows], y)
+    for i in range(0, len(x), rows):
+        tile = backends.compute(backend, x[i:i+rows], y, metric)
+        if itself:
+            _zero_diagonal(tile, i)
+
+        yield i, tile
+
+
+def distance_memmap(filename, x, y=None, metric='euclidean', backend='auto',
+                    rows=None):
+    """Write the distance matrix of distance_matrix() to the .npy file
+    filename tile by tile, see distance_tiles(), and return it as a
+    read-only np.memmap.
+    """
+    itself = y is None
+    x, y = points(x, y)
+    out = np.lib.format.open_memmap(filename, mode='w+', dtype=x.dtype,
+                                    shape=(len(x), len(y)))
+    rows = tile_rows(len(y), x.dtype, rows)
+    backend = select(backend, metric, x[:rows], y, out=out[:rows])
+    for i in range(0, len(x), rows):
+        # the tiles go straight into the file, by the backends that write
+        # into out
+        backends.compute(backend, x[i:i+rows], y, metric, out[i:i+rows])
+        if itself:
+            _zero_diagonal(out[i:i+rows], i)
+
+        # written back now rather than when the memory runs out
+        out.flush()
+
+    del out
+    return np.load(filename, mmap_mode='r')
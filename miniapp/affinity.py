@@ -0,0 +1,144 @@
+#
+# Thread affinity of the miniapp
+#
+# The threads of numba's parallel backend are left to the scheduler of the
+# operating system, which is free to move them away from the NUMA node
+# whose memory they first touched, see linalg.zeros(). pin() binds the
+# threads, numbered in the order of numba.get_thread_id(), to CPUs:
+#
+#   compact  one CPU each, filling one NUMA node before the next
+#   spread   one CPU each, dealt out round-robin over the NUMA nodes
+#   none     all CPUs of the process, which undoes the others
+#
+# Threads are pinned by their kernel thread ids, which only Linux has. The
+# omp and workqueue threading layers run every thread in every parallel
+# region; tbb does not, and its threads cannot all be found.
+
+import ctypes
+import errno
+import glob
+import mmap
+import os
+import platform
+import re
+
+import numba
+import numpy as np
+
+AFFINITIES = ['none', 'compact', 'spread']
+
+# the CPUs of the process, before any of its threads were pinned
+ALLOWED = os.sched_getaffinity(0)
+
+_libc = ctypes.CDLL(None)
+_gettid = _libc.gettid
+_gettid.restype = ctypes.c_int
+_gettid.argtypes = []
+
+# glibc has no wrapper of move_pages(2), which pages() calls by its number
+_syscall = _libc.syscall
+_syscall.restype = ctypes.c_long
+_syscall.argtypes = [ctypes.c_long, ctypes.c_int, ctypes.c_ulong,
+                     ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p,
+                     ctypes.c_int]
+_SYS_MOVE_PAGES = {
+    'x86_64': 279,
+    'aarch64': 239,
+    'ppc64le': 301,
+}.get(platform.machine())
+
+
+def _cpulist(text):
+    # the CPUs of a list such as 0-3,8-11
+    cpus = []
+    for part in text.strip().split(','):
+        if part:
+            first, _, last = part.partition('-')
+            cpus.extend(range(int(first), int(last or first) + 1))
+
+    return cpus
+
+
+def nodes():
+    # the CPUs of every NUMA node that this process may run on, or all of
+    # its CPUs as one node if the system does not say
+    found = []
+    paths = glob.glob('/sys/devices/system/node/node[0-9]*/cpulist')
+    for path in sorted(paths, key=lambda p: int(re.findall(r'\d+', p)[-1])):
+        with open(path) as f:
+            cpus = [cpu for cpu in _cpulist(f.read()) if cpu in ALLOWED]
+
+        if cpus:
+            found.append(cpus)
+
+    return found or [sorted(ALLOWED)]
+
+
+def placement(kind, threads):
+    # the CPUs of each of the threads
+    numa = nodes()
+    if kind == 'compact':
+        cpus = [cpu for node in numa for cpu in node]
+        return [{cpus[t % len(cpus)]} for t in range(threads)]
+
+    if kind == 'spread':
+        placed = []
+        for t in range(threads):
+            node = numa[t % len(numa)]
+            placed.append({node[(t // len(numa)) % len(node)]})
+
+        return placed
+
+    if kind == 'none':
+        return [ALLOWED] * threads
+
+    raise ValueError(f'unknown affinity: {kind}')
+
+
+@numba.njit(parallel=True)
+def _thread_ids(threads):
+    # the kernel thread id of every thread, or 0 for those that took no part
+    tids = np.zeros(threads, dtype=np.int64)
+    for _ in numba.prange(threads):
+        tids[numba.get_thread_id()] = _gettid()
+
+    return tids
+
+
+def pin(kind):
+    # pin the numba.get_num_threads() threads of the parallel backend as
+    # given by kind, and return the CPU of each, or None for those not
+    # pinned to one
+    threads = numba.get_num_threads()
+    tids = _thread_ids(threads)
+    if not tids.all():
+        raise RuntimeError(f'only {np.count_nonzero(tids)} of {threads} '
+                           f'threads could be found to pin; use '
+                           f'NUMBA_THREADING_LAYER=omp or workqueue')
+
+    cpus = placement(kind, threads)
+    for tid, allowed in zip(tids, cpus):
+        os.sched_setaffinity(int(tid), allowed)
+
+    return [min(allowed) if len(allowed) == 1 else None for allowed in cpus]
+
+
+def pages(x):
+    # the number of pages of the array x on every NUMA node, with -1 for
+    # the pages that were never touched, as move_pages(2) reports them when
+    # it is not asked to move them; {} where there is no move_pages(2)
+    if _SYS_MOVE_PAGES is None:
+        return {}
+
+    first = x.ctypes.data - x.ctypes.data % mmap.PAGESIZE
+    addresses = np.arange(first, x.ctypes.data + x.nbytes, mmap.PAGESIZE,
+                          dtype=np.uintp)
+    status = np.zeros(addresses.size, dtype=np.int32)
+    if _syscall(_SYS_MOVE_PAGES, 0, addresses.size,
+                addresses.ctypes.data_as(ctypes.c_void_p), None,
+                status.ctypes.data_as(ctypes.c_void_p), 0) != 0:
+        return {}
+
+    status[status == -errno.ENOENT] = -1
+    nodes, counts = np.unique(status, return_counts=True)
+    return dict(zip(nodes.tolist(), counts.tolist()))
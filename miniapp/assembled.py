@@ -0,0 +1,272 @@
+#
+# Assembled Jacobian for the miniapp solver
+#
+# The Jacobian of operators.diffusion() is a 5-point matrix whose
+# off-diagonal entries are all 1 and whose diagonal c0 - c1*u is the only
+# part that depends on the solution u. It is assembled once as a CSR matrix,
+# of which only the diagonal is updated, and the linear systems of the
+# Newton iteration are solved either by cg() on the CSR matrix or by a
+# sparse LU factorization of it.
+#
+# The factorization is reused across Newton iterations and timesteps of the
+# same alpha as long as it keeps the Newton iteration converging fast; with a factorization of an
+# older Jacobian, the Newton iteration becomes the chord method, which
+# converges linearly at a rate that grows with the distance of u from the
+# point of the factorization.
+
+import collections
+import time
+
+import numba
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+
+import linalg
+
+# a factorization is made afresh when the Newton residual fell by less than
+# REFACTOR_RATIO in the last iteration that used it, so that the chord
+# iterations are kept only while they converge about as fast as Newton's,
+# and whenever alpha, and with it the timestep, differs from that of the
+# factorization; the adaptive timestepping of main.py shrinks the timestep
+# after steps of many Newton iterations, which slower chord iterations
+# would make it do over and over
+REFACTOR_RATIO = 0.01
+
+# the CSR storage of a matrix, with the positions in data of the diagonal
+# entries of the rows
+Matrix = collections.namedtuple('Matrix',
+                                ['indptr', 'indices', 'data', 'diag'])
+
+
+def pattern(nx, ny):
+    # the 5-point matrix of a nx*ny grid, with all entries 1
+    #
+    # the columns of every row are, in ascending order, its neighbours at
+    # i-1, j-1, itself and its neighbours at j+1, i+1, those outside the
+    # grid left out
+    N = nx*ny
+    k = np.arange(N, dtype=np.int32).reshape((nx, ny))
+    cols = np.full((nx, ny, 5), -1, dtype=np.int32)
+    cols[1:, :, 0] = k[:-1, :]
+    cols[:, 1:, 1] = k[:, :-1]
+    cols[:, :, 2] = k
+    cols[:, :-1, 3] = k[:, 1:]
+    cols[:-1, :, 4] = k[1:, :]
+    cols = cols.reshape((N, 5))
+
+    inside = cols >= 0
+    indptr = np.zeros(N + 1, dtype=np.int32)
+    np.cumsum(inside.sum(axis=1), out=indptr[1:])
+    diag = indptr[:-1] + inside[:, :2].sum(axis=1, dtype=np.int32)
+    return Matrix(indptr, cols[inside], np.ones(indptr[-1]), diag)
+
+
+def update(A, u, options):
+    # the diagonal of A = J(u), see operators.jacobian_apply()
+    dxs = 1000. * options.dx * options.dx
+    A.data[A.diag] = (dxs - (4. + options.alpha)) - 2.*dxs*u
+
+
+@numba.njit(cache=True)
+def csr_apply(v, Av, A, parallel):
+    # Av = A*v
+    if parallel:
+        _csr_apply_parallel(v, Av, A)
+        return
+
+    for row in range(Av.size):
+        s = 0.
+        for k in range(A.indptr[row], A.indptr[row+1]):
+            s += A.data[k] * v[A.indices[k]]
+
+        Av[row] = s
+
+
+@numba.njit(cache=True, parallel=True)
+def _csr_apply_parallel(v, Av, A):
+    for row in numba.prange(Av.size):
+        s = 0.
+        for k in range(A.indptr[row], A.indptr[row+1]):
+            s += A.data[k] * v[A.indices[k]]
+
+        Av[row] = s
+
+
+@numba.njit(cache=True)
+def cg(x, u, x_old, b, boundary, options, tolerance, maxiters, A, precond,
+       ws, parallel):
+    # linalg.cg() with A*v computed by csr_apply() instead of matvec(); the
+    # preconditioners of linalg apply unchanged, as A is the exact Jacobian
+    r, p, z, Ap = ws.r, ws.p, ws.z, ws.Ap
+    count = ws.counters
+
+    csr_apply(x, Ap, A, parallel)
+    linalg.waxpby(r, 1., b, -1., Ap, parallel)
+    rnew = linalg.dot(r, r, parallel)
+    count[linalg.COUNT_STENCIL] += 1
+    count[linalg.COUNT_WAXPBY] += 1
+    count[linalg.COUNT_DOT] += 1
+    if np.sqrt(rnew) < tolerance:
+        return linalg.CGStatus(True, 0, np.sqrt(rnew))
+
+    linalg.precond_update(precond, u, options)
+    linalg.precond_apply(precond, r, z)
+    linalg.copy(p, z)
+    rold = linalg.dot(r, z, parallel)
+    count[linalg.COUNT_PRECOND_SETUP] += 1
+    count[linalg.COUNT_PRECOND] += 1
+    count[linalg.COUNT_COPY] += 1
+    count[linalg.COUNT_DOT] += 1
+
+    for it in range(1, maxiters + 1):
+        csr_apply(p, Ap, A, parallel)
+        alpha = rold / linalg.dot(p, Ap, parallel)
+        rnew = linalg.cg_update(x, r, p, Ap, alpha, parallel)
+        count[linalg.COUNT_STENCIL] += 1
+        count[linalg.COUNT_DOT] += 1
+        count[linalg.COUNT_CG_UPDATE] += 1
+
+        residual = np.sqrt(rnew)
+        if (residual < tolerance):
+            return linalg.CGStatus(True, it, residual)
+
+        linalg.precond_apply(precond, r, z)
+        rz = linalg.dot(r, z, parallel)
+        linalg.waxpby(p, 1., z, rz / rold, p, parallel)
+        rold = rz
+        count[linalg.COUNT_PRECOND] += 1
+        count[linalg.COUNT_DOT] += 1
+        count[linalg.COUNT_WAXPBY] += 1
+
+    return linalg.CGStatus(False, it, residual)
+
+
+class Assembled:
+    def __init__(self, options, method='direct'):
+        # the Jacobian of a grid with the given discretization, solved for
+        # with cg() for method 'csr', or by sparse LU factorization for
+        # method 'direct'
+        if method not in ('csr', 'direct'):
+            raise ValueError(f'unknown method: {method}')
+
+        self.method = method
+        self.A = pattern(options.nx, options.ny)
+        self._lu = None
+        self._alpha = None
+
+        # what was done, and the seconds it took
+        self.assemblies = 0
+        self.factorizations = 0
+        self.solves = 0
+        self.time_assemble = 0.
+        self.time_factorize = 0.
+        self.time_solve = 0.
+
+    def assemble(self, u, options):
+        start = time.perf_counter()
+        update(self.A, u, options)
+        self.assemblies += 1
+        self.time_assemble += time.perf_counter() - start
+
+    def factorize(self, u, options):
+        # assemble and factorize J(u)
+        self.assemble(u, options)
+        start = time.perf_counter()
+        A = self.A
+        csr = scipy.sparse.csr_matrix((A.data, A.indices, A.indptr),
+                                      shape=(options.N, options.N))
+        # the matrix is structurally symmetric, for which a minimum degree
+        # ordering of A^T+A fills in about half as much as the default
+        self._lu = scipy.sparse.linalg.splu(csr.tocsc(),
+                                            permc_spec='MMD_AT_PLUS_A')
+        self._alpha = options.alpha
+        self.factorizations += 1
+        self.time_factorize += time.perf_counter() - start
+
+    def solve(self, x, b, u, options, stale):
+        # x = J^-1*b with the current factorization, which is made afresh at
+        # u if there is none, if it is stale or if it is of another alpha
+        if self._lu is None or stale or options.alpha != self._alpha:
+            self.factorize(u, options)
+
+        start = time.perf_counter()
+        x[:] = self._lu.solve(b)
+        self.solves += 1
+        self.time_solve += time.perf_counter() - start
+
+    def summary(self):
+        if self.method == 'direct':
+            return (f'{self.factorizations} sparse LU factorizations in '
+                    f'{self.time_factorize:.3f} seconds, {self.solves} '
+                    f'solves in {self.time_solve:.3f} seconds')
+
+        return (f'{self.assemblies} CSR assemblies in '
+                f'{self.time_assemble:.3f} seconds')
+
+
+def timeloop(x, boundary, options, solver, precond, ws, single, first, last,
+             assembled):
+    # the fields of main.NewtonStatus after the timesteps first..last, with
+    # the linear systems solved by assembled; iters_cg counts the CG
+    # iterations with method 'csr' and the triangular solves with 'direct'
+    b, deltax, x_old = ws.b, ws.deltax, ws.x_old
+
+    tolerance = solver.tolerance
+    parallel = solver.parallel
+    iters_newton = 0
+    iters_cg = 0
+    cg_status = linalg.CGStatus(True, 0, 0.)
+
+    count = ws.counters
+    converged = True
+
+    timestep = first - 1
+    for timestep in range(first, last+1):
+        linalg.copy(x_old, x)
+        count[linalg.COUNT_COPY] += 1
+        linalg.predict(x, ws, timestep, options.dt, solver.predictor,
+                       parallel)
+        converged = False
+        residual_prev = 0.
+        eta = 0.
+        for it in range(solver.max_newton_iters):
+            linalg.diffusion(x, b, x_old, boundary, options, parallel)
+            residual = np.sqrt(linalg.dot(b, b, parallel))
+            count[linalg.COUNT_RESIDUAL] += 1
+            if residual < tolerance:
+                converged = True
+                break
+
+            if assembled.method == 'direct':
+                # the first iteration of a timestep has no previous residual
+                # to judge the factorization by
+                stale = it > 0 and residual > REFACTOR_RATIO*residual_prev
+                residual_prev = residual
+                assembled.solve(deltax, b, x, options, stale)
+                cg_status = linalg.CGStatus(True, 1, 0.)
+            else:
+                cg_tolerance, eta = linalg.forcing(solver.forcing, tolerance,
+                                                   residual, residual_prev,
+                                                   eta)
+                residual_prev = residual
+                if solver.forcing != linalg.FORCING_FIXED:
+                    deltax[:] = 0.
+
+                assembled.assemble(x, options)
+                cg_status = cg(deltax, x, x_old, b, boundary, options,
+                               cg_tolerance, solver.max_cg_iters,
+                               assembled.A, precond, ws, parallel)
+
+            iters_cg += cg_status.iters
+            if not cg_status.converged:
+                break
+
+            linalg.waxpby(x, 1., x, -1., deltax, parallel)
+            count[linalg.COUNT_WAXPBY] += 1
+
+        iters_newton += it + 1
+        if not converged:
+            break
+
+    return (x, converged, timestep, iters_newton, iters_cg, 0, cg_status)
@@ -0,0 +1,477 @@
+#
+# Scaling benchmarks of the miniapp
+#
+#   python benchmark.py strong nx ny nt t --threads 1 2 4 8 -o strong.json
+#   python benchmark.py weak nx ny nt t --threads 1 2 4 8 -o weak.json
+#   python benchmark.py newton nx ny nt t -o newton.json
+#   python benchmark.py linear nt t --sizes 32 64 128 256 -o linear.json
+#   python benchmark.py backends nt t --sizes 32 64 128 256 -o xla.json
+#   python benchmark.py numa nx ny --affinity none compact spread
+#   python benchmark.py compare old.json new.json --threshold 0.05
+#
+# Strong scaling solves the same nx*ny grid on every thread count; weak
+# scaling grows the grid with the thread count, so that every thread keeps
+# about nx*ny points. The newton benchmark compares the forcing terms and
+# predictors of the Newton iteration side by side, and the linear benchmark
+# the matrix-free and assembled linear solvers over a range of grid sizes,
+# to find where one overtakes the other. The backends benchmark runs the
+# same grids with the numba loops, the XLA program of the jax backend, see
+# xla.py, and the array operations of vectorized.py. The numa benchmark
+# measures the memory bandwidth of the parallel kernels on grids first
+# touched by the main thread or by the threads of the kernels, and where
+# their pages went. Every point is warmed up first, so that numba
+# compilation is not timed, and then repeated on a fresh initial condition.
+
+import argparse
+import itertools
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import numba
+import numpy as np
+
+import linalg
+import main
+import operators
+import perf
+
+
+def timeloop(problem, first, last, linear, backend='serial'):
+    # main.timeloop(), xla.timeloop() for the jax backend,
+    # vectorized.timeloop() for numpy and cupy, or assembled.timeloop() with
+    # the Jacobian assembled within the timing
+    if backend == 'jax':
+        import xla
+
+        return xla.timeloop(*problem, first, last)
+
+    if backend in ('numpy', 'cupy'):
+        import vectorized
+
+        return vectorized.timeloop(*problem, first, last,
+                                   vectorized.array_module(backend))
+
+    if linear == 'matrix-free':
+        return main.timeloop(*problem, first, last)
+
+    import assembled
+
+    jac = assembled.Assembled(problem.options, linear)
+    return main.NewtonStatus(*assembled.timeloop(*problem, first, last, jac))
+
+
+def run(nx, ny, nt, t, threads, backend, jacobian, precond, precision,
+        repeat, forcing='fixed', predictor='none', linear='matrix-free'):
+    # run the timeloop `repeat` times and return the timings of the point
+    parallel = backend == 'parallel'
+    numba.set_num_threads(threads)
+    solver = {'precision': precision, 'forcing': forcing,
+              'predictor': predictor}
+
+    # compile, or load from the cache, with a single timestep
+    problem = main.setup(nx, ny, 1, t / nt, jacobian, precond, parallel,
+                         **solver)
+    timeloop(problem, 1, 1, linear, backend)
+
+    times = []
+    for _ in range(repeat):
+        problem = main.setup(nx, ny, nt, t, jacobian, precond, parallel,
+                             **solver)
+        start = time.perf_counter()
+        status = timeloop(problem, 1, nt, linear, backend)
+        times.append(time.perf_counter() - start)
+
+    return {
+        'nx': nx, 'ny': ny, 'nt': nt, 't': t, 'threads': threads,
+        'backend': backend, 'jacobian': jacobian, 'precond': precond,
+        'precision': precision, 'forcing': forcing, 'predictor': predictor,
+        'linear_solver': linear,
+        'converged': bool(status.converged),
+        'iters_cg': int(status.iters_cg),
+        'iters_newton': int(status.iters_newton),
+        'iters_refine': int(status.iters_refine),
+        'times': times,
+        'median': statistics.median(times),
+        'min': min(times),
+        'variance': statistics.variance(times) if repeat > 1 else 0.,
+    }
+
+
+def key(point):
+    # results from before --precision, --forcing, --predictor and
+    # --linear-solver used the defaults
+    return (point['nx'], point['ny'], point['nt'], point['t'],
+            point['threads'], point['backend'], point['jacobian'],
+            point['precond'], point.get('precision', 'double'),
+            point.get('linear_solver', 'matrix-free'),
+            point.get('forcing', 'fixed'), point.get('predictor', 'none'))
+
+
+def write(kind, points, output):
+    results = {
+        'kind': kind,
+        'date': datetime.now().isoformat(),
+        'host': platform.node(),
+        'numba': numba.__version__,
+        'points': points,
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+        print(f'results written to "{output}"')
+
+
+def scaling(args):
+    points = []
+    for threads in args.threads:
+        if threads > numba.config.NUMBA_NUM_THREADS:
+            print(f'{sys.argv[0]}: skipping {threads} threads, only '
+                  f'{numba.config.NUMBA_NUM_THREADS} are available; '
+                  f'set NUMBA_NUM_THREADS', file=sys.stderr)
+            continue
+
+        nx, ny = args.nx, args.ny
+        if args.kind == 'weak':
+            nx = round(nx * math.sqrt(threads))
+            ny = round(ny * math.sqrt(threads))
+
+        point = run(nx, ny, args.nt, args.t, threads, args.backend,
+                    args.jacobian, args.precond, args.precision,
+                    args.repeat, args.forcing, args.predictor)
+        points.append(point)
+        print(f'{nx:>6} * {ny:<6} {threads:>4} threads: '
+              f'median {point["median"]:.4f} s, min {point["min"]:.4f} s, '
+              f'{point["iters_cg"]} CG / {point["iters_newton"]} Newton '
+              f'iterations')
+
+    write(args.kind, points, args.output)
+
+
+def newton(args):
+    # every combination of forcing term and predictor on the same problem
+    threads = 1
+    if args.backend == 'parallel':
+        threads = numba.config.NUMBA_NUM_THREADS
+
+    points = []
+    print(f'{"forcing":<8} {"predictor":<10} {"CG":>8} {"Newton":>8} '
+          f'{"CG/time":>10} {"seconds":>10}')
+    for forcing, predictor in itertools.product(main.FORCINGS,
+                                                main.PREDICTORS):
+        point = run(args.nx, args.ny, args.nt, args.t, threads, args.backend,
+                    args.jacobian, args.precond, args.precision, args.repeat,
+                    forcing, predictor)
+        points.append(point)
+
+        # CG iterations per unit of simulated time
+        rate = point['iters_cg'] / args.t
+        failed = '' if point['converged'] else ' (failed)'
+        print(f'{forcing:<8} {predictor:<10} {point["iters_cg"]:>8} '
+              f'{point["iters_newton"]:>8} {rate:>10.0f} '
+              f'{point["median"]:>10.4f}{failed}')
+
+    write(args.kind, points, args.output)
+
+
+def linear(args):
+    # the linear solvers on square grids of growing size, with the fastest
+    # marked, to find the grid sizes at which each of them wins
+    threads = 1
+    if args.backend == 'parallel':
+        threads = numba.config.NUMBA_NUM_THREADS
+
+    points = []
+    wins = {}
+    print(f'{"grid":>13} {"solver":<12} {"Newton":>8} {"seconds":>10}')
+    for n in args.sizes:
+        times = {}
+        for solver in main.LINEAR_SOLVERS:
+            point = run(n, n, args.nt, args.t, threads, args.backend,
+                        'exact', args.precond, 'double', args.repeat,
+                        args.forcing, args.predictor, solver)
+            points.append(point)
+            if point['converged']:
+                times[solver] = point['median']
+
+            failed = '' if point['converged'] else ' (failed)'
+            print(f'{n:>6} * {n:<6} {solver:<12} '
+                  f'{point["iters_newton"]:>8} '
+                  f'{point["median"]:>10.4f}{failed}')
+
+        if times:
+            fastest = min(times, key=times.get)
+            wins.setdefault(fastest, []).append(n*n)
+            print(f'{"":>13} fastest: {fastest}')
+
+    for solver, sizes in wins.items():
+        print(f'{solver} is fastest for nx*ny in {sizes}')
+
+    write(args.kind, points, args.output)
+
+
+def backends(args):
+    # the numba backends against the XLA program of the jax backend and the
+    # vectorized array operations of numpy and cupy on square grids of
+    # growing size, with the fastest marked
+    points = []
+    wins = {}
+    print(f'{"grid":>13} {"backend":<9} {"CG":>8} {"rate":>10} '
+          f'{"seconds":>10}')
+    for n in args.sizes:
+        times = {}
+        for backend in args.backends:
+            threads = 1
+            if backend == 'parallel':
+                threads = numba.config.NUMBA_NUM_THREADS
+
+            point = run(n, n, args.nt, args.t, threads, backend, 'exact',
+                        'none', 'double', args.repeat)
+            points.append(point)
+            if point['converged']:
+                times[backend] = point['median']
+
+            rate = point['iters_cg'] / point['median']
+            failed = '' if point['converged'] else ' (failed)'
+            print(f'{n:>6} * {n:<6} {backend:<9} {point["iters_cg"]:>8} '
+                  f'{rate:>10.0f} {point["median"]:>10.4f}{failed}')
+
+        if times:
+            fastest = min(times, key=times.get)
+            wins.setdefault(fastest, []).append(n*n)
+            print(f'{"":>13} fastest: {fastest}')
+
+    for backend, sizes in wins.items():
+        print(f'{backend} is fastest for nx*ny in {sizes}')
+
+    write(args.kind, points, args.output)
+
+
+def numa(args):
+    # the bandwidth of the parallel stencil and vector update, with the
+    # grids first touched by the main thread, as np.zeros() followed by
+    # writing the initial condition does, or by linalg.zeros(), for every
+    # affinity of the threads
+    import affinity
+
+    nx, ny = args.nx, args.ny
+    problem = main.setup(nx, ny, 1, 1.e-4, parallel=True)
+    boundary, options = problem.boundary, problem.options
+    stencil = perf.COST[linalg.COUNT_RESIDUAL][1] * options.N
+    vector = perf.COST[linalg.COUNT_WAXPBY][1] * options.N
+
+    def grid(touch):
+        if touch == 'main':
+            x = np.empty(options.N)
+            x.fill(0.)
+            return x
+
+        return linalg.zeros(nx, ny, parallel=True)
+
+    def bandwidth(kernel, nbytes):
+        kernel()
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            kernel()
+
+        return nbytes * args.repeat / (time.perf_counter() - start) * 1.e-9
+
+    points = []
+    print(f'{nx} * {ny} grid, {numba.get_num_threads()} threads, NUMA nodes '
+          f'{affinity.nodes()}')
+    print(f'{"affinity":<8} {"first touch":<12} {"stencil GB/s":>12} '
+          f'{"waxpby GB/s":>12}  pages per node')
+    for kind in args.affinity:
+        cpus = affinity.pin(kind)
+        for touch in ['main', 'threads']:
+            U, S, x_old = grid(touch), grid(touch), grid(touch)
+            U[:] = problem.x
+            x_old[:] = problem.x
+            point = {
+                'nx': nx, 'ny': ny, 'threads': numba.get_num_threads(),
+                'affinity': kind, 'cpus': cpus, 'first_touch': touch,
+                'stencil': bandwidth(lambda: operators.diffusion_parallel(
+                    U, S, x_old, boundary, options), stencil),
+                'waxpby': bandwidth(lambda: linalg.waxpby(
+                    S, 1., U, 2., x_old, True), vector),
+                'pages': {str(node): n for node, n in
+                          sorted(affinity.pages(U).items())},
+            }
+            points.append(point)
+
+            # node -1 holds the pages that were never touched
+            pages = ' '.join(f'N{node}={n}' if int(node) >= 0 else
+                             f'untouched={n}'
+                             for node, n in point['pages'].items())
+            print(f'{kind:<8} {touch:<12} {point["stencil"]:>12.2f} '
+                  f'{point["waxpby"]:>12.2f}  {pages}')
+
+    affinity.pin('none')
+    write(args.kind, points, args.output)
+
+
+def timings(path):
+    # the timed points of a results file, by key(); the points of numa
+    # measure bandwidths rather than times and are left out
+    with open(path) as f:
+        return {key(p): p for p in json.load(f)['points'] if 'median' in p}
+
+
+def compare(args):
+    old = timings(args.old)
+    new = timings(args.new)
+
+    regressions = 0
+    for k in sorted(old.keys() & new.keys()):
+        told, tnew = old[k]['median'], new[k]['median']
+        change = tnew / told - 1
+        flag = ''
+        if change > args.threshold:
+            flag = 'REGRESSION'
+            regressions += 1
+        elif old[k]['iters_cg'] != new[k]['iters_cg']:
+            flag = 'iterations changed'
+
+        nx, ny, nt, t, threads, *_, solver, forcing, predictor = k
+        print(f'{nx:>6} * {ny:<6} {threads:>4} threads {solver:>11} '
+              f'{forcing:>5} {predictor:>6}: {told:.4f} s -> {tnew:.4f} s '
+              f'({change:+.1%}) {flag}')
+
+    for k in sorted(old.keys() ^ new.keys()):
+        print(f'{k}: only in {args.old if k in old else args.new}')
+
+    print(f'{regressions} regressions above {args.threshold:.0%}')
+    return 1 if regressions else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Scaling benchmarks of the miniapp'
+    )
+    commands = parser.add_subparsers(dest='kind', required=True)
+    helps = {
+        'strong': 'strong scaling over threads',
+        'weak': 'weak scaling over threads',
+        'newton': 'compare the forcing terms and predictors of the Newton '
+                  'iteration',
+    }
+    for kind, help in helps.items():
+        p = commands.add_parser(kind, help=help)
+        p.add_argument('nx', type=main.positive(int),
+                       help='gridpoints in x-direction (on one thread for '
+                            'weak scaling)')
+        p.add_argument('ny', type=main.positive(int),
+                       help='gridpoints in y-direction (on one thread for '
+                            'weak scaling)')
+        p.add_argument('nt', type=main.positive(int),
+                       help='number of timesteps')
+        p.add_argument('t', type=main.positive(float),
+                       help='total simulated time')
+        if kind != 'newton':
+            p.add_argument('--threads', type=main.positive(int), nargs='+',
+                           default=[1], help='thread counts (default: 1)')
+            p.add_argument('--forcing', choices=main.FORCINGS,
+                           default='fixed')
+            p.add_argument('--predictor', choices=main.PREDICTORS,
+                           default='none')
+
+        p.add_argument('--repeat', type=main.positive(int), default=5,
+                       help='runs of every point (default: %(default)s)')
+        p.add_argument('--backend', choices=['serial', 'parallel'],
+                       default='parallel',
+                       help='serial runs on one thread, parallel on '
+                            '--threads, or all threads for newton '
+                            '(default: %(default)s)')
+        p.add_argument('--jacobian', choices=main.JACOBIANS, default='exact')
+        p.add_argument('--precond', choices=main.PRECONDITIONERS,
+                       default='none')
+        p.add_argument('--precision', choices=['double', 'mixed'],
+                       default='double')
+        p.add_argument('-o', '--output', help='JSON file of the results')
+
+    p = commands.add_parser('linear',
+                            help='find the crossover between the linear '
+                                 'solvers over grid sizes')
+    p.add_argument('nt', type=main.positive(int), help='number of timesteps')
+    p.add_argument('t', type=main.positive(float),
+                   help='total simulated time')
+    p.add_argument('--sizes', type=main.positive(int), nargs='+',
+                   default=[16, 32, 64, 128, 256],
+                   help='gridpoints in both directions (default: '
+                        '%(default)s)')
+    p.add_argument('--repeat', type=main.positive(int), default=3,
+                   help='runs of every point (default: %(default)s)')
+    p.add_argument('--backend', choices=['serial', 'parallel'],
+                   default='serial',
+                   help='run CG on one or on all threads; the sparse LU '
+                        'factorization is serial (default: %(default)s)')
+    p.add_argument('--precond', choices=main.PRECONDITIONERS,
+                   default='none')
+    p.add_argument('--forcing', choices=main.FORCINGS, default='fixed')
+    p.add_argument('--predictor', choices=main.PREDICTORS, default='none')
+    p.add_argument('-o', '--output', help='JSON file of the results')
+
+    p = commands.add_parser('backends',
+                            help='compare the numba loops with the XLA '
+                                 'program of jax and the array operations '
+                                 'of numpy over grid sizes')
+    p.add_argument('nt', type=main.positive(int), help='number of timesteps')
+    p.add_argument('t', type=main.positive(float),
+                   help='total simulated time')
+    p.add_argument('--sizes', type=main.positive(int), nargs='+',
+                   default=[16, 32, 64, 128, 256],
+                   help='gridpoints in both directions (default: '
+                        '%(default)s)')
+    p.add_argument('--backends', nargs='+', choices=main.BACKENDS,
+                   default=['serial', 'parallel', 'jax', 'numpy'],
+                   help='backends to compare, the parallel one on all '
+                        'threads (default: all but cupy)')
+    p.add_argument('--repeat', type=main.positive(int), default=3,
+                   help='runs of every point (default: %(default)s)')
+    p.add_argument('-o', '--output', help='JSON file of the results')
+
+    p = commands.add_parser('numa',
+                            help='bandwidth of the parallel kernels by first '
+                                 'touch and thread affinity')
+    p.add_argument('nx', type=main.positive(int),
+                   help='gridpoints in x-direction')
+    p.add_argument('ny', type=main.positive(int),
+                   help='gridpoints in y-direction')
+    p.add_argument('--affinity', nargs='+', choices=['none', 'compact',
+                                                     'spread'],
+                   default=['none', 'compact', 'spread'],
+                   help='thread affinities (default: all)')
+    p.add_argument('--repeat', type=main.positive(int), default=20,
+                   help='sweeps of every kernel (default: %(default)s)')
+    p.add_argument('-o', '--output', help='JSON file of the results')
+
+    p = commands.add_parser('compare',
+                            help='flag regressions between two results')
+    p.add_argument('old')
+    p.add_argument('new')
+    p.add_argument('--threshold', type=float, default=0.05,
+                   help='relative slowdown of the median that counts as a '
+                        'regression (default: %(default)s)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.kind == 'compare':
+        sys.exit(compare(args))
+
+    if args.kind == 'newton':
+        newton(args)
+    elif args.kind == 'linear':
+        linear(args)
+    elif args.kind == 'backends':
+        backends(args)
+    elif args.kind == 'numa':
+        numa(args)
+    else:
+        scaling(args)
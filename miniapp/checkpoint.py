@@ -0,0 +1,113 @@
+#
+# Asynchronous checkpointing of the miniapp solution
+#
+# Snapshots are written as .npy files by a background thread, so that the
+# timeloop only pays for copying the solution; the timeloop is compiled with
+# nogil=True so that the writer thread can run while it computes.
+
+import glob
+import os
+import queue
+import re
+import threading
+import time
+
+import numpy as np
+
+
+def filename(directory, prefix, timestep):
+    return os.path.join(directory, f'{prefix}_step={timestep:08d}.npy')
+
+
+def latest(directory, prefix):
+    # the timestep and file name of the most recent checkpoint, or None
+    pattern = re.compile(re.escape(prefix) + r'_step=(\d+)\.npy$')
+    found = []
+    for path in glob.glob(os.path.join(glob.escape(directory), '*.npy')):
+        m = pattern.match(os.path.basename(path))
+        if m:
+            found.append((int(m.group(1)), path))
+
+    return max(found, default=None)
+
+
+def load(path, shape):
+    # the solution stored at path, memory-mapped until it is copied
+    u = np.load(path, mmap_mode='r')
+    if u.shape != shape:
+        raise ValueError(f'checkpoint {path} has shape {u.shape}, '
+                         f'expected {shape}')
+
+    return np.array(u).flatten()
+
+
+class CheckpointWriter:
+    def __init__(self, directory, prefix, shape, keep=2):
+        # only the `keep` most recent checkpoints are kept on disk
+        self._directory = directory
+        self._prefix = prefix
+        self._shape = shape
+        self._keep = keep
+        self._written = []
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._error = None
+
+        # seconds spent writing in the background and the time the caller
+        # was blocked by write() and close()
+        self.count = 0
+        self.nbytes = 0
+        self.time_io = 0.
+        self.time_blocked = 0.
+
+        os.makedirs(directory, exist_ok=True)
+        self._thread.start()
+
+    def write(self, timestep, x):
+        # queue a snapshot of x; x may be modified as soon as this returns
+        start = time.perf_counter()
+        if self._error is not None:
+            raise self._error
+
+        self._queue.put((timestep, np.copy(x).reshape(self._shape)))
+        self.time_blocked += time.perf_counter() - start
+
+    def close(self):
+        # wait for all queued snapshots to be written
+        start = time.perf_counter()
+        self._queue.put(None)
+        self._thread.join()
+        self.time_blocked += time.perf_counter() - start
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            if self._error is not None:
+                continue
+
+            timestep, u = item
+            start = time.perf_counter()
+            try:
+                # write to a temporary file first, so that a crash while
+                # writing never leaves a truncated latest checkpoint
+                path = filename(self._directory, self._prefix, timestep)
+                tmp = path + '.tmp'
+                with open(tmp, 'wb') as f:
+                    np.save(f, u)
+
+                os.replace(tmp, path)
+                self._written.append(path)
+                while len(self._written) > self._keep:
+                    os.remove(self._written.pop(0))
+            except OSError as e:
+                self._error = e
+                continue
+
+            self.count += 1
+            self.nbytes += u.nbytes
+            self.time_io += time.perf_counter() - start
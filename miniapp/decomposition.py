@@ -0,0 +1,298 @@
+#
+# Distributed-memory version of the miniapp solver
+#
+# The grid is decomposed over a 2D Cartesian grid of MPI ranks. Every rank
+# owns a sub-grid and runs the numba kernels on it, with the edges of the
+# neighbouring sub-grids exchanged into its Boundary before every stencil
+# application and with the dot products reduced over all ranks.
+
+import numpy as np
+from mpi4py import MPI
+
+import linalg
+import operators
+
+# tags of the halo messages, named after the direction they travel
+NORTHWARD = 0
+SOUTHWARD = 1
+EASTWARD = 2
+WESTWARD = 3
+
+
+def partition(n, parts, k):
+    # the range of the k-th of `parts` almost equal parts of range(n)
+    size, rem = divmod(n, parts)
+    start = k*size + min(k, rem)
+    return start, start + size + (1 if k < rem else 0)
+
+
+class Decomposition:
+    def __init__(self, nx, ny, comm=MPI.COMM_WORLD):
+        dims = MPI.Compute_dims(comm.Get_size(), 2)
+        self.comm = comm.Create_cart(dims, periods=[False, False],
+                                     reorder=True)
+        self.rank = self.comm.Get_rank()
+        self.size = self.comm.Get_size()
+        self.dims = dims
+        self.coords = self.comm.Get_coords(self.rank)
+
+        # the global index ranges of the local sub-grid
+        self.irange = partition(nx, dims[0], self.coords[0])
+        self.jrange = partition(ny, dims[1], self.coords[1])
+        self.nx = self.irange[1] - self.irange[0]
+        self.ny = self.jrange[1] - self.jrange[0]
+
+        # neighbours are MPI.PROC_NULL at the edges of the global grid, so
+        # that the Dirichlet boundary values there are never overwritten
+        self.west, self.east = self.comm.Shift(0, 1)
+        self.south, self.north = self.comm.Shift(1, 1)
+
+        # send buffers for the edges, which are not contiguous in the
+        # south and north directions
+        self.send_north = np.zeros(self.nx)
+        self.send_south = np.zeros(self.nx)
+        self.send_east = np.zeros(self.ny)
+        self.send_west = np.zeros(self.ny)
+
+    @property
+    def islice(self):
+        return slice(*self.irange)
+
+    @property
+    def jslice(self):
+        return slice(*self.jrange)
+
+    def exchange(self, U, boundary):
+        # fill boundary with the edges of U on the neighbouring ranks
+        U = U.reshape((self.nx, self.ny))
+        self.send_north[:] = U[:, -1]
+        self.send_south[:] = U[:, 0]
+        self.send_east[:] = U[-1, :]
+        self.send_west[:] = U[0, :]
+
+        comm = self.comm
+        requests = [
+            comm.Irecv(boundary.north, source=self.north, tag=SOUTHWARD),
+            comm.Irecv(boundary.south, source=self.south, tag=NORTHWARD),
+            comm.Irecv(boundary.east, source=self.east, tag=WESTWARD),
+            comm.Irecv(boundary.west, source=self.west, tag=EASTWARD),
+            comm.Isend(self.send_north, dest=self.north, tag=NORTHWARD),
+            comm.Isend(self.send_south, dest=self.south, tag=SOUTHWARD),
+            comm.Isend(self.send_east, dest=self.east, tag=EASTWARD),
+            comm.Isend(self.send_west, dest=self.west, tag=WESTWARD),
+        ]
+        MPI.Request.Waitall(requests)
+
+    def dot(self, x, y, parallel):
+        return self.comm.allreduce(linalg.dot(x, y, parallel), op=MPI.SUM)
+
+    def min(self, value):
+        return self.comm.allreduce(value, op=MPI.MIN)
+
+    def gather(self, x, nx, ny):
+        # assemble the global solution on rank 0; None on the other ranks
+        parts = self.comm.gather((self.islice, self.jslice, x), root=0)
+        if self.rank != 0:
+            return None
+
+        u = np.empty((nx, ny))
+        for islice, jslice, xloc in parts:
+            u[islice, jslice] = xloc.reshape((islice.stop - islice.start,
+                                              jslice.stop - jslice.start))
+
+        return u.flatten()
+
+
+def matvec(v, Av, u, x_old, boundary, halo, options, jacobian, ws, parallel,
+           decomp):
+    if jacobian == linalg.JACOBIAN_EXACT:
+        # Av = J(u)*v, with v on the neighbouring sub-grids added on the edges
+        decomp.exchange(v, halo)
+        if parallel:
+            operators.jacobian_apply_parallel(v, Av, u, options)
+        else:
+            operators.jacobian_apply(v, Av, u, options)
+
+        operators.add_halo(Av, halo, options)
+    else:
+        # A*v = 1/epsilon * ( F(xold+epsilon*v) - Fxold )
+        linalg.waxpby(ws.v, 1., ws.xold, linalg.EPS, v, parallel)
+        decomp.exchange(ws.v, boundary)
+        linalg.diffusion(ws.v, Av, x_old, boundary, options, parallel)
+        linalg.waxpby(Av, linalg.EPS_INV, Av, -linalg.EPS_INV, ws.Fxold,
+                      parallel)
+
+
+def cg(x, u, x_old, b, boundary, halo, options, tolerance, maxiters, jacobian,
+       precond, ws, parallel, decomp):
+    # linalg.cg() with halo exchanges and global dot products; every rank
+    # preconditions its own sub-grid, so that the ssor and mg
+    # preconditioners become block preconditioners
+    r, p, z, Ap = ws.r, ws.p, ws.z, ws.Ap
+    count = ws.counters
+
+    if jacobian == linalg.JACOBIAN_FD:
+        linalg.copy(ws.xold, x)
+        decomp.exchange(x, boundary)
+        linalg.diffusion(x, ws.Fxold, x_old, boundary, options, parallel)
+        count[linalg.COUNT_COPY] += 1
+        count[linalg.COUNT_STENCIL] += 1
+
+    matvec(x, Ap, u, x_old, boundary, halo, options, jacobian, ws, parallel,
+           decomp)
+    linalg.waxpby(r, 1., b, -1., Ap, parallel)
+    rnew = decomp.dot(r, r, parallel)
+    count[linalg.COUNT_STENCIL] += 1
+    count[linalg.COUNT_WAXPBY] += 1
+    count[linalg.COUNT_DOT] += 1
+    if np.sqrt(rnew) < tolerance:
+        return linalg.CGStatus(True, 0, np.sqrt(rnew))
+
+    linalg.precond_update(precond, u, options)
+    linalg.precond_apply(precond, r, z)
+    linalg.copy(p, z)
+    rold = decomp.dot(r, z, parallel)
+    count[linalg.COUNT_PRECOND_SETUP] += 1
+    count[linalg.COUNT_PRECOND] += 1
+    count[linalg.COUNT_COPY] += 1
+    count[linalg.COUNT_DOT] += 1
+
+    for it in range(1, maxiters + 1):
+        matvec(p, Ap, u, x_old, boundary, halo, options, jacobian, ws,
+               parallel, decomp)
+        alpha = rold / decomp.dot(p, Ap, parallel)
+        rnew = decomp.comm.allreduce(
+            linalg.cg_update(x, r, p, Ap, alpha, parallel), op=MPI.SUM
+        )
+        count[linalg.COUNT_STENCIL] += 1
+        count[linalg.COUNT_DOT] += 1
+        count[linalg.COUNT_CG_UPDATE] += 1
+
+        residual = np.sqrt(rnew)
+        if (residual < tolerance):
+            return linalg.CGStatus(True, it, residual)
+
+        linalg.precond_apply(precond, r, z)
+        rz = decomp.dot(r, z, parallel)
+        linalg.waxpby(p, 1., z, rz / rold, p, parallel)
+        rold = rz
+        count[linalg.COUNT_PRECOND] += 1
+        count[linalg.COUNT_DOT] += 1
+        count[linalg.COUNT_WAXPBY] += 1
+
+    return linalg.CGStatus(False, it, residual)
+
+
+def refine(x, u, x_old, b, boundary, halo, options, tolerance, maxiters,
+           jacobian, single, ws, parallel, decomp):
+    # linalg.refine() with halo exchanges and global dot products
+    r, Ap = ws.r, ws.Ap
+    c = single.ws.deltax
+    count = ws.counters
+
+    linalg.copy(single.u, u)
+    count[linalg.COUNT_COPY] += 1
+
+    iters = 0
+    for k in range(linalg.REFINE_MAX + 1):
+        matvec(x, Ap, u, x_old, boundary, halo, options, jacobian, ws,
+               parallel, decomp)
+        linalg.waxpby(r, 1., b, -1., Ap, parallel)
+        residual = np.sqrt(decomp.dot(r, r, parallel))
+        count[linalg.COUNT_STENCIL] += 1
+        count[linalg.COUNT_WAXPBY] += 1
+        count[linalg.COUNT_DOT] += 1
+        if residual < tolerance:
+            return linalg.CGStatus(True, iters, residual), k
+
+        if k == linalg.REFINE_MAX:
+            break
+
+        linalg.waxpby(single.ws.b, 1./residual, r, 0., r, parallel)
+        c[:] = 0.
+        count[linalg.COUNT_WAXPBY] += 1
+        status = cg(c, single.u, x_old, single.ws.b, single.boundary, halo,
+                    options, max(tolerance/residual, linalg.REFINE_REDUCTION),
+                    maxiters, jacobian, single.precond, single.ws, parallel,
+                    decomp)
+        iters += status.iters
+        if not status.converged:
+            return linalg.CGStatus(False, iters, residual), k
+
+        linalg.waxpby(x, 1., x, residual, c, parallel)
+        count[linalg.COUNT_WAXPBY] += 1
+
+    return linalg.CGStatus(False, iters, residual), linalg.REFINE_MAX
+
+
+def timeloop(x, boundary, options, solver, precond, ws, single, first, last,
+             decomp):
+    # the fields of main.NewtonStatus for the local sub-grid, after the
+    # timesteps first..last
+
+    # halo of the vectors the Jacobian is applied to, which are zero outside
+    # the global grid
+    halo = type(boundary)(*(np.zeros_like(bnd) for bnd in boundary))
+    b, deltax, x_old = ws.b, ws.deltax, ws.x_old
+
+    tolerance = solver.tolerance
+    parallel = solver.parallel
+    iters_newton = 0
+    iters_cg = 0
+    iters_refine = 0
+    cg_status = linalg.CGStatus(True, 0, 0.)
+
+    count = ws.counters
+    converged = True
+
+    timestep = first - 1
+    for timestep in range(first, last+1):
+        linalg.copy(x_old, x)
+        count[linalg.COUNT_COPY] += 1
+        linalg.predict(x, ws, timestep, options.dt, solver.predictor,
+                       parallel)
+        converged = False
+        residual_prev = 0.
+        eta = 0.
+        for it in range(solver.max_newton_iters):
+            decomp.exchange(x, boundary)
+            linalg.diffusion(x, b, x_old, boundary, options, parallel)
+            residual = np.sqrt(decomp.dot(b, b, parallel))
+            count[linalg.COUNT_RESIDUAL] += 1
+            if residual < tolerance:
+                converged = True
+                break
+
+            cg_tolerance, eta = linalg.forcing(solver.forcing, tolerance,
+                                               residual, residual_prev, eta)
+            residual_prev = residual
+            if solver.forcing != linalg.FORCING_FIXED:
+                deltax[:] = 0.
+
+            if solver.mixed:
+                cg_status, refinements = refine(
+                    deltax, x, x_old, b, boundary, halo, options,
+                    cg_tolerance, solver.max_cg_iters, solver.jacobian,
+                    single, ws, parallel, decomp
+                )
+                iters_refine += refinements
+            else:
+                cg_status = cg(
+                    deltax, x, x_old, b, boundary, halo, options,
+                    cg_tolerance, solver.max_cg_iters, solver.jacobian,
+                    precond, ws, parallel, decomp
+                )
+
+            iters_cg += cg_status.iters
+            if not cg_status.converged:
+                break
+
+            linalg.waxpby(x, 1., x, -1., deltax, parallel)
+            count[linalg.COUNT_WAXPBY] += 1
+
+        iters_newton += it + 1
+        if not converged:
+            break
+
+    return (x, converged, timestep, iters_newton, iters_cg, iters_refine,
+            cg_status)
@@ -0,0 +1,271 @@
+#
+# Ensembles of miniapp runs
+#
+#   python ensemble.py nx ny nt --t 0.005 0.01 --D 0.5 1 2 --radius 0.05 0.1
+#
+# Parameter sweeps solve many problems on grids too small to keep more than
+# one core busy. An ensemble stores the solutions of all its members in a
+# (batch, nx, ny) array and advances them all in one call of timeloop(),
+# which hands the members out to a pool of threads, each running
+# main.timeloop() on the rows of the batched arrays that belong to its
+# member; main.timeloop() releases the GIL, and members that converge
+# quickly do not hold up the others. Members converge, or fail,
+# independently of each other: a member that failed is masked out of later
+# calls.
+#
+# With --jax, the ensemble is also solved by the timeloop of the JAX backend,
+# see xla.py, vectorized over the members by jax.vmap(): all members advance
+# in lockstep, as one XLA program on arrays with a batch dimension.
+
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import json
+import time
+
+import numba
+import numpy as np
+
+import linalg
+import main
+
+# the parameters of a member: total simulated time, diffusion coefficient
+# and radius of the initial circle, with None for the default radius of
+# main.initial_condition()
+Member = collections.namedtuple('Member', ['t', 'D', 'radius'],
+                                defaults=[1., None])
+
+# the members share the grid, the number of timesteps, the boundary and the
+# solver; dt, dx and alpha hold one value per member, and the arrays of
+# precond, ws and status one row per member
+#
+# the fields are the arguments of _advance() after the member
+Ensemble = collections.namedtuple(
+    'Ensemble', ['x', 'boundary', 'nt', 'dt', 'dx', 'alpha', 'solver',
+                 'precond', 'ws', 'single', 'status']
+)
+
+
+def setup(nx, ny, nt, members, jacobian='exact', precond='none',
+          forcing='fixed', predictor='none'):
+    # an ensemble of the given members on a nx*ny grid, run for nt steps
+    batch = len(members)
+    dx = 1. / (nx - 1)
+    x = np.empty((batch, nx, ny))
+    for m, member in enumerate(members):
+        x[m] = main.initial_condition(nx, ny, dx,
+                                      radius=member.radius).reshape((nx, ny))
+
+    # the kernels only see the diffusion coefficient through
+    # alpha = dx^2/(D*dt) and 1000*dx^2/D, so a member with coefficient D is
+    # solved as the problem with coefficient 1 on a grid spacing dx/sqrt(D)
+    t = np.array([member.t for member in members], dtype=np.float64)
+    D = np.array([member.D for member in members], dtype=np.float64)
+    dt = t / nt
+    dxs = dx / np.sqrt(D)
+    alpha = dxs*dxs / dt
+
+    # the members run on one thread each
+    solver = main.Solver(main.MAX_CG_ITERS, main.MAX_NEWTON_ITERS,
+                         main.TOLERANCE, main.JACOBIANS[jacobian], False,
+                         False, main.FORCINGS[forcing],
+                         main.PREDICTORS[predictor])
+    boundary = main.Boundary(np.zeros(nx), np.zeros(nx),
+                             np.zeros(ny), np.zeros(ny))
+
+    # a preconditioner and workspace with a leading batch dimension
+    pc = linalg.preconditioner(main.PRECONDITIONERS[precond], nx, ny)
+    pc = pc._replace(**{field: np.zeros((batch, getattr(pc, field).size))
+                        for field in ['diag', 'x', 'b', 'r']})
+    ws = linalg.Workspace(*(np.zeros((batch, nx*ny))
+                            for _ in linalg.Workspace._fields[:-3]),
+                          np.full((batch, 1), -1, dtype=np.int64),
+                          np.zeros((batch, 1)),
+                          np.zeros((batch, linalg.NCOUNTERS),
+                                   dtype=np.int64))
+
+    zeros = np.zeros(batch, dtype=np.int64)
+    status = main.NewtonStatus(
+        x, np.ones(batch, dtype=np.bool_), zeros.copy(), zeros.copy(),
+        zeros.copy(), zeros.copy(),
+        linalg.CGStatus(np.ones(batch, dtype=np.bool_), zeros.copy(),
+                        np.zeros(batch))
+    )
+    return Ensemble(x, boundary, nt, dt, dxs, alpha, solver, pc, ws,
+                    linalg.single_precision(linalg.PRECOND_NONE, 0, 0,
+                                            boundary),
+                    status)
+
+
+@numba.njit(cache=True, nogil=True)
+def _advance(m, x, boundary, nt, dt, dx, alpha, solver, precond, ws, single,
+             status, first, last):
+    # main.timeloop() on member m, unless it failed earlier
+    if not status.converged[m]:
+        return
+
+    nx, ny = x.shape[1], x.shape[2]
+    options = main.Discretization(nx, ny, nx*ny, nt, dt[m], dx[m], alpha[m])
+    pc = linalg.Preconditioner(precond.kind, precond.omega, precond.nx,
+                               precond.ny, precond.offset, precond.diag[m],
+                               precond.x[m], precond.b[m], precond.r[m])
+    w = linalg.Workspace(ws.b[m], ws.deltax[m], ws.x_old[m], ws.r[m],
+                         ws.p[m], ws.z[m], ws.Ap[m], ws.xold[m], ws.Fxold[m],
+                         ws.v[m], ws.x_prev[m], ws.x_prev_step[m],
+                         ws.dt_prev[m], ws.counters[m])
+    s = main.timeloop(x[m].reshape(nx*ny), boundary, options, solver, pc, w,
+                      single, first, last)
+    status.converged[m] = s.converged
+    status.timestep[m] = s.timestep
+    status.iters_newton[m] += s.iters_newton
+    status.iters_cg[m] += s.iters_cg
+    status.status_cg.converged[m] = s.status_cg.converged
+    status.status_cg.iters[m] = s.status_cg.iters
+    status.status_cg.residual[m] = s.status_cg.residual
+
+
+def timeloop(ens, first, last, threads=None):
+    # advance the members that have not failed over the timesteps
+    # first..last on `threads` threads, by default NUMBA_NUM_THREADS;
+    # returns the status of all members as a main.NewtonStatus of arrays,
+    # with the iterations summed over all calls
+    threads = threads or numba.get_num_threads()
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        # list() re-raises the exceptions of the workers
+        list(pool.map(lambda m: _advance(m, *ens, first, last),
+                      range(len(ens.x))))
+
+    return ens.status
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Solve an ensemble of 2D Fisher equations on a nx*ny '
+                    'grid, one member for every combination of the '
+                    'parameters'
+    )
+    parser.add_argument('nx', type=main.positive(int),
+                        help='number of gridpoints in x-direction')
+    parser.add_argument('ny', type=main.positive(int),
+                        help='number of gridpoints in y-direction')
+    parser.add_argument('nt', type=main.positive(int),
+                        help='number of timesteps')
+    parser.add_argument('--t', type=main.positive(float), nargs='+',
+                        default=[0.01], help='total simulated times')
+    parser.add_argument('--D', type=main.positive(float), nargs='+',
+                        default=[1.], help='diffusion coefficients')
+    parser.add_argument('--radius', type=main.positive(float), nargs='+',
+                        default=[None], help='radii of the initial circle')
+    parser.add_argument('--jacobian', choices=main.JACOBIANS, default='exact')
+    parser.add_argument('--precond', choices=main.PRECONDITIONERS,
+                        default='none')
+    parser.add_argument('--forcing', choices=main.FORCINGS, default='fixed')
+    parser.add_argument('--predictor', choices=main.PREDICTORS,
+                        default='none')
+    parser.add_argument('--threads', type=main.positive(int),
+                        help='number of threads (default: NUMBA_NUM_THREADS)')
+    parser.add_argument('--sequential', action='store_true',
+                        help='also solve the members one after the other '
+                             'with main.timeloop(), for comparison')
+    parser.add_argument('--jax', action='store_true',
+                        help='also solve the members with the timeloop of '
+                             'the JAX backend vectorized over the members by '
+                             'jax.vmap, for comparison; only with the '
+                             'default solver options')
+    parser.add_argument('--json', metavar='FILE',
+                        help='write the results of all members to FILE')
+    args = parser.parse_args()
+    if args.jax and (args.jacobian, args.precond, args.forcing,
+                     args.predictor) != ('exact', 'none', 'fixed', 'none'):
+        parser.error('--jax supports only the default solver options')
+
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.threads:
+        numba.set_num_threads(args.threads)
+
+    members = [Member(*p) for p in itertools.product(args.t, args.D,
+                                                     args.radius)]
+    nx, ny, nt = args.nx, args.ny, args.nt
+
+    solver = (args.jacobian, args.precond, args.forcing, args.predictor)
+
+    # compile, or load from the cache, before the timing starts
+    timeloop(setup(nx, ny, nt, members[:1], *solver), 1, 0)
+
+    ens = setup(nx, ny, nt, members, *solver)
+    x0 = ens.x.copy()
+    start = time.perf_counter()
+    status = timeloop(ens, 1, nt)
+    seconds = time.perf_counter() - start
+
+    failed = int(np.count_nonzero(~status.converged))
+    print(f'{len(members)} members on {nx} * {ny} grids, {nt} timesteps, '
+          f'{numba.get_num_threads()} threads')
+    print(f'ensemble took {seconds:.3f} seconds, '
+          f'{len(members)/seconds:.1f} problems/second')
+    print(f'{status.iters_cg.sum()} conjugate gradient iterations, '
+          f'{status.iters_newton.sum()} newton iterations')
+    if failed:
+        print(f'{failed} members failed to converge')
+
+    if args.sequential:
+        problems = []
+        for m, member in enumerate(members):
+            problem = main.setup(nx, ny, nt, member.t, args.jacobian,
+                                 args.precond, forcing=args.forcing,
+                                 predictor=args.predictor)
+            options = problem.options._replace(dx=ens.dx[m],
+                                               alpha=ens.alpha[m])
+            problems.append(problem._replace(x=x0[m].flatten(),
+                                             options=options))
+
+        start = time.perf_counter()
+        for problem in problems:
+            main.timeloop(*problem, 1, nt)
+
+        seq = time.perf_counter() - start
+        print(f'sequential runs took {seq:.3f} seconds, '
+              f'{len(members)/seq:.1f} problems/second')
+
+    if args.jax:
+        # imported here, so that jax is only needed with --jax
+        import xla
+
+        solver = xla.solver_of(ens.solver)
+
+        # compile before the timing starts
+        xla.ensemble_timeloop(x0, ens.boundary, ens.dx, ens.alpha, solver, 1,
+                              0)
+        start = time.perf_counter()
+        _, vmapped = xla.ensemble_timeloop(x0, ens.boundary, ens.dx,
+                                           ens.alpha, solver, 1, nt)
+        vec = time.perf_counter() - start
+        print(f'jax.vmap ensemble took {vec:.3f} seconds, '
+              f'{len(members)/vec:.1f} problems/second, '
+              f'{vmapped.iters_cg.sum()} conjugate gradient iterations')
+        print(f'largest difference to the numba solutions: '
+              f'{np.abs(vmapped.solution - ens.x).max():.3g}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'config': {'nx': nx, 'ny': ny, 'nt': nt,
+                           'jacobian': args.jacobian,
+                           'precond': args.precond,
+                           'threads': numba.get_num_threads()},
+                'seconds': seconds,
+                'members': [{
+                    **member._asdict(),
+                    'converged': bool(status.converged[m]),
+                    'timestep': int(status.timestep[m]),
+                    'iters_newton': int(status.iters_newton[m]),
+                    'iters_cg': int(status.iters_cg[m]),
+                } for m, member in enumerate(members)],
+            }, f, indent=2)
+
+        print(f'results written to "{args.json}"')
@@ -0,0 +1,163 @@
+#
+# Ahead-of-time compiled kernels of the miniapp
+#
+#   python kernels.py
+#
+# builds the extension module kernels_aot next to this file, with the jitted
+# functions of EXPORTS compiled for the argument types of a double precision
+# run, so that a run on a node without a numba cache does not have to JIT
+# compile them. get() returns the compiled function if the module has been
+# built, and the jitted function otherwise.
+#
+# numba cannot compile parallel=True functions ahead of time, so the module
+# is built with serial versions of the parallel kernels, and the parallel
+# backend is always JIT compiled.
+#
+# The build records hashes of the sources of the kernels; a module built
+# from other sources is ignored with a warning, as it would run the kernels
+# as they were.
+
+import hashlib
+import importlib
+import json
+import os
+import tempfile
+import warnings
+
+import numba
+
+MODULE = 'kernels_aot'
+
+# the sources the exported functions are compiled from
+SOURCES = ['main.py', 'linalg.py', 'operators.py']
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# the exported functions, by module and name
+EXPORTS = [
+    ('main', 'timeloop'),
+    ('linalg', 'cg'),
+    ('linalg', 'diffusion'),
+    ('linalg', 'matvec'),
+    ('linalg', 'precond_apply'),
+    ('linalg', 'precond_update'),
+    ('linalg', 'dot'),
+    ('linalg', 'waxpby'),
+    ('linalg', 'cg_update'),
+    ('linalg', 'copy'),
+]
+
+
+def hashes(directory):
+    # the hashes of the sources in directory
+    digests = {}
+    for source in SOURCES:
+        with open(os.path.join(directory, source), 'rb') as f:
+            digests[source] = hashlib.sha256(f.read()).hexdigest()
+
+    return digests
+
+
+def _load():
+    try:
+        module = importlib.import_module(MODULE)
+    except ImportError:
+        return None
+
+    try:
+        with open(os.path.join(DIRECTORY, MODULE + '.json')) as f:
+            built = json.load(f)
+    except OSError:
+        built = None
+
+    if built != hashes(DIRECTORY):
+        warnings.warn(f'{MODULE} was built from other sources; run '
+                      f'"python kernels.py" to rebuild it, using the JIT '
+                      f'compiled kernels until then')
+        return None
+
+    return module
+
+
+kernels_aot = _load()
+
+
+def export_name(module, name):
+    return f'{module}_{name}'
+
+
+def get(fn, jit=False):
+    # the ahead-of-time compiled version of the jitted function fn, unless
+    # jit is true, e.g. for the parallel backend or other argument types
+    if jit or kernels_aot is None:
+        return fn
+
+    return getattr(kernels_aot,
+                   export_name(fn.py_func.__module__, fn.__name__), fn)
+
+
+def source():
+    # 'aot' if the compiled module is there, 'jit' otherwise
+    return 'jit' if kernels_aot is None else 'aot'
+
+
+def _arguments(problem):
+    # arguments of the exported functions on a problem
+    x, boundary, options, solver, precond, ws, single = problem
+    v = ws.v
+    return {
+        'timeloop': (*problem, 1, 0),
+        'cg': (ws.deltax, x, ws.x_old, ws.b, boundary, options, 1., 0,
+               solver.jacobian, precond, ws, False),
+        'diffusion': (x, v, ws.x_old, boundary, options, False),
+        'matvec': (ws.p, ws.Ap, x, ws.x_old, boundary, options,
+                   solver.jacobian, ws, False),
+        'precond_apply': (precond, ws.r, ws.z),
+        'precond_update': (precond, x, options),
+        'dot': (ws.r, ws.z, False),
+        'waxpby': (v, 1., ws.r, 1., ws.z, False),
+        'cg_update': (v, ws.Ap, ws.p, ws.r, 0., False),
+        'copy': (v, ws.r),
+    }
+
+
+def build(output_dir):
+    # numba compiles the module in the same process, with the parallel
+    # kernels replaced by serial ones; the jitted code of that build must
+    # not end up in the cache of the JIT compiled runs
+    numba.config.CACHE_DIR = tempfile.mkdtemp()
+
+    from numba.pycc import CC
+
+    import linalg
+    import main
+    import operators
+
+    for module in (linalg, operators):
+        for name, fn in vars(module).items():
+            if (isinstance(fn, numba.core.registry.CPUDispatcher) and
+                    fn.targetoptions.get('parallel')):
+                setattr(module, name, numba.njit(fn.py_func))
+
+    cc = CC(MODULE)
+    cc.output_dir = output_dir
+    problem = main.setup(8, 8, 1, 1.e-4)
+    arguments = _arguments(problem)
+    for module, name in EXPORTS:
+        fn = getattr(importlib.import_module(module), name)
+        args = arguments[name]
+
+        # the return type is that of the jitted function on the arguments
+        fn(*args)
+        signature = fn.overloads[tuple(numba.typeof(a) for a in args)]
+        cc.export(export_name(module, name),
+                  signature.signature)(fn.py_func)
+
+    cc.compile()
+    with open(os.path.join(output_dir, MODULE + '.json'), 'w') as f:
+        json.dump(hashes(DIRECTORY), f, indent=2)
+
+
+if __name__ == '__main__':
+    build(DIRECTORY)
+    print(f'built {MODULE} in {DIRECTORY}')
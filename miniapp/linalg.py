@@ -15,66 +15,619 @@ import operators
 EPS = 1.0e-8
 EPS_INV = 1.0 / EPS
 
+# how the Jacobian-vector product A*v is computed inside cg()
+JACOBIAN_FD = 0         # finite-difference approximation
+JACOBIAN_EXACT = 1      # analytic Jacobian, see operators.jacobian_apply()
+
+# preconditioners for cg()
+PRECOND_NONE = 0
+PRECOND_JACOBI = 1      # diagonal of the Jacobian
+PRECOND_SSOR = 2        # symmetric successive over-relaxation
+PRECOND_MG = 3          # geometric multigrid V-cycle
+
+# multigrid parameters: coarsening stops at grids narrower than MG_COARSEST
+# points; Gauss-Seidel sweeps per level and symmetric sweeps on the coarsest
+MG_COARSEST = 8
+MG_SMOOTH = 2
+MG_COARSE_SWEEPS = 10
+
+# mixed precision iterative refinement, see refine(): every single precision
+# cg() reduces the double precision residual by REFINE_REDUCTION, which is
+# well within reach of single precision, and at most REFINE_MAX corrections
+# are made per linear system
+REFINE_REDUCTION = 1.e-4
+REFINE_MAX = 10
+
+# how the tolerances of the linear systems of the Newton iteration are
+# chosen, see forcing()
+FORCING_FIXED = 0       # the tolerance of the Newton iteration
+FORCING_EW = 1          # Eisenstat-Walker, relative to the Newton residual
+
+# the Eisenstat-Walker forcing terms are their choice 2, with the safeguards
+# of Kelley, "Iterative Methods for Linear and Nonlinear Equations", 1995
+EW_GAMMA = 0.9
+EW_ALPHA = 2.
+EW_ETA_MAX = 0.9
+
+# initial guesses of the Newton iteration of a timestep, see predict()
+PREDICT_NONE = 0        # the solution of the previous timestep
+PREDICT_LINEAR = 1      # extrapolated from the previous two timesteps
+
 CGStatus = collections.namedtuple('CGStatus',
                                   ['converged', 'iters', 'residual'])
 
+Preconditioner = collections.namedtuple(
+    'Preconditioner', ['kind', 'omega', 'nx', 'ny', 'offset',
+                       'diag', 'x', 'b', 'r']
+)
+
+# operations counted in Workspace.counters
+COUNT_RESIDUAL = 0      # Newton residuals, i.e. diffusion() and its norm
+COUNT_STENCIL = 1       # Jacobian-vector products, see matvec()
+COUNT_PRECOND = 2       # precond_apply()
+COUNT_PRECOND_SETUP = 3 # precond_update()
+COUNT_DOT = 4
+COUNT_WAXPBY = 5
+COUNT_CG_UPDATE = 6
+COUNT_COPY = 7
+NCOUNTERS = 8
+
+# storage for the Newton iteration (b, deltax, x_old) and for cg(), which is
+# allocated once so that the timeloop does not allocate any memory, the
+# solution of the timestep before x_old with the number of that timestep
+# and the size of the timestep from it to x_old, kept by predict(), and the
+# operation counters
+Workspace = collections.namedtuple(
+    'Workspace', ['b', 'deltax', 'x_old', 'r', 'p', 'z', 'Ap',
+                  'xold', 'Fxold', 'v', 'x_prev', 'x_prev_step', 'dt_prev',
+                  'counters']
+)
+
+
+# storage of the single precision cg() of the mixed precision solver: u is a
+# single precision copy of the Newton iterate at which the Jacobian is
+# applied, the correction is solved for in ws.deltax with right hand side
+# ws.b, and precond is the single precision preconditioner; boundary is
+# never read, as the exact Jacobian does not depend on it, but the stencils
+# need it in the same precision as the grid
+SinglePrecision = collections.namedtuple(
+    'SinglePrecision', ['u', 'boundary', 'precond', 'ws']
+)
+
+
+def zeros(nx, ny, dtype=np.float64, parallel=False):
+    # a vector of zeros on a nx*ny grid
+    #
+    # pages of memory are placed on the NUMA node of the thread that first
+    # writes to them; with parallel, the vector is zeroed by
+    # operators.first_touch() on the threads of the parallel kernels, so
+    # that every thread finds the rows it works on in its own node's memory
+    if not parallel:
+        return np.zeros(nx*ny, dtype=dtype)
+
+    x = np.empty(nx*ny, dtype=dtype)
+    operators.first_touch(x, nx, ny)
+    return x
+
+
+def workspace(nx, ny, dtype=np.float64, parallel=False):
+    # the workspace of a nx*ny grid, with the vectors allocated by zeros()
+    return Workspace(*(zeros(nx, ny, dtype, parallel)
+                       for _ in Workspace._fields[:-3]),
+                     np.full(1, -1, dtype=np.int64), np.zeros(1),
+                     np.zeros(NCOUNTERS, dtype=np.int64))
+
+
+def single_precision(kind, nx, ny, boundary, parallel=False):
+    # storage for refine() on a nx*ny grid with the given boundary; refine()
+    # is never called on the empty storage for a 0*0 grid, which stands in
+    # for it in double precision runs
+    return SinglePrecision(
+        zeros(nx, ny, np.float32, parallel),
+        type(boundary)(*(np.zeros_like(bnd, dtype=np.float32)
+                         for bnd in boundary)),
+        preconditioner(kind, nx, ny, dtype=np.float32),
+        workspace(nx, ny, np.float32, parallel)
+    )
+
+
+@numba.njit(cache=True)
+def copy(y, x):
+    # y = x
+    #
+    # unlike y[:] = x, this does not create a temporary copy of x when numba
+    # cannot prove that x and y do not overlap
+    for k in range(x.size):
+        y[k] = x[k]
+
+
+@numba.njit(cache=True)
+def dot(x, y, parallel):
+    # <x,y>
+    if parallel:
+        return _dot_parallel(x, y)
+
+    s = 0.
+    for k in range(x.size):
+        s += x[k] * y[k]
+
+    return s
+
+
+@numba.njit(cache=True, parallel=True)
+def _dot_parallel(x, y):
+    s = 0.
+    for k in numba.prange(x.size):
+        s += x[k] * y[k]
+
+    return s
+
+
+@numba.njit(cache=True)
+def waxpby(w, alpha, x, beta, y, parallel):
+    # w = alpha*x + beta*y; w may be the same vector as x or y
+    #
+    # alpha and beta are cast to the precision of w here and in the other
+    # kernels, so that single precision vectors are not promoted to double
+    alpha = w.dtype.type(alpha)
+    beta = w.dtype.type(beta)
+    if parallel:
+        _waxpby_parallel(w, alpha, x, beta, y)
+        return
+
+    for k in range(w.size):
+        w[k] = alpha * x[k] + beta * y[k]
+
+
+@numba.njit(cache=True, parallel=True)
+def _waxpby_parallel(w, alpha, x, beta, y):
+    for k in numba.prange(w.size):
+        w[k] = alpha * x[k] + beta * y[k]
+
+
+@numba.njit(cache=True)
+def cg_update(x, r, p, Ap, alpha, parallel):
+    # x += alpha*p and r -= alpha*Ap, returning the new <r,r>
+    alpha = x.dtype.type(alpha)
+    if parallel:
+        return _cg_update_parallel(x, r, p, Ap, alpha)
+
+    rnew = 0.
+    for k in range(x.size):
+        x[k] += alpha * p[k]
+        r[k] -= alpha * Ap[k]
+        rnew += r[k] * r[k]
+
+    return rnew
+
+
+@numba.njit(cache=True, parallel=True)
+def _cg_update_parallel(x, r, p, Ap, alpha):
+    rnew = 0.
+    for k in numba.prange(x.size):
+        x[k] += alpha * p[k]
+        r[k] -= alpha * Ap[k]
+        rnew += r[k] * r[k]
+
+    return rnew
+
+
+@numba.njit(cache=True)
+def matvec(v, Av, u, x_old, boundary, options, jacobian, ws, parallel):
+    if jacobian == JACOBIAN_EXACT:
+        # Av = J(u)*v
+        if parallel:
+            operators.jacobian_apply_parallel(v, Av, u, options)
+        else:
+            operators.jacobian_apply(v, Av, u, options)
+    else:
+        # matrix vector multiplication is approximated with
+        # A*v = 1/epsilon * ( F(xold+epsilon*v) - Fxold )
+        waxpby(ws.v, 1., ws.xold, EPS, v, parallel)
+        diffusion(ws.v, Av, x_old, boundary, options, parallel)
+        waxpby(Av, EPS_INV, Av, -EPS_INV, ws.Fxold, parallel)
+
+
+@numba.njit(cache=True)
+def diffusion(U, S, x_old, boundary, options, parallel):
+    if parallel:
+        operators.diffusion_parallel(U, S, x_old, boundary, options)
+    else:
+        operators.diffusion(U, S, x_old, boundary, options)
+
+
+def preconditioner(kind, nx, ny, omega=1.5, dtype=np.float64):
+    # allocate the storage of a preconditioner for a nx*ny grid
+    #
+    # all preconditioners are built from the diagonal of the Jacobian, which
+    # is refreshed by precond_update() at every Newton iterate; the multigrid
+    # preconditioner additionally keeps a hierarchy of coarser grids, which
+    # are stored level after level in flat arrays
+    level_nx = [nx]
+    level_ny = [ny]
+    if kind == PRECOND_MG:
+        while min(level_nx[-1], level_ny[-1]) >= MG_COARSEST:
+            level_nx.append(level_nx[-1] // 2)
+            level_ny.append(level_ny[-1] // 2)
+
+    level_nx = np.array(level_nx)
+    level_ny = np.array(level_ny)
+    offset = np.zeros(len(level_nx) + 1, dtype=np.int64)
+    offset[1:] = np.cumsum(level_nx * level_ny)
+    size = offset[-1]
+    return Preconditioner(kind, omega, level_nx, level_ny, offset,
+                          *(np.zeros(size, dtype=dtype) for _ in range(4)))
+
+
+@numba.njit(cache=True)
+def precond_update(pc, u, options):
+    # compute the diagonal of the Jacobian at u on every level
+    #
+    # on level l the Jacobian is rediscretized as
+    #   A_l*v = 4^-l * (sum of neighbours of v - 4*v) + c*v
+    # where c = -alpha + dxs*(1-2u) is injected from the finer level
+    if pc.kind == PRECOND_NONE:
+        return
+
+    dxs = 1000. * options.dx * options.dx
+    alpha = options.alpha
+    d = pc.diag
+    for k in range(options.N):
+        d[k] = -(4. + alpha) + dxs*(1. - 2.*u[k])
+
+    for l in range(1, len(pc.nx)):
+        nxf, nyf, of = pc.nx[l-1], pc.ny[l-1], pc.offset[l-1]
+        nxc, nyc, oc = pc.nx[l], pc.ny[l], pc.offset[l]
+        sf = 0.25**(l-1)
+        sc = 0.25**l
+        for i in range(nxc):
+            for j in range(nyc):
+                c = d[of + (2*i+1)*nyf + 2*j+1] + 4.*sf
+                d[oc + i*nyc + j] = c - 4.*sc
+
+
+@numba.njit(cache=True)
+def precond_apply(pc, r, z):
+    # z = M^-1 * r
+    if pc.kind == PRECOND_JACOBI:
+        for k in range(r.size):
+            z[k] = r[k] / pc.diag[k]
+    elif pc.kind == PRECOND_SSOR:
+        _ssor(pc, r, z)
+    elif pc.kind == PRECOND_MG:
+        _vcycle(pc, r, z)
+    else:
+        copy(z, r)
+
 
 @numba.njit(cache=True)
-def cg(x, x_old, b, boundary, options, tolerance, maxiters):
+def _ssor(pc, r, z):
+    # z = omega*(2-omega) * (D + omega*U)^-1 * D * (D + omega*L)^-1 * r
+    nx, ny = pc.nx[0], pc.ny[0]
+    omega = pc.omega
+    d = pc.diag
 
-    # Initialize temporary storage
-    Fx = np.zeros_like(x)
-    Fxold = np.zeros_like(x)
-    xold = np.copy(x)
+    # forward sweep
+    for i in range(nx):
+        for j in range(ny):
+            s = r[i*ny + j]
+            if i > 0:
+                s -= omega*z[(i-1)*ny + j]
 
-    # matrix vector multiplication is approximated with
-    # A*v = 1/epsilon * ( F(x+epsilon*v) - F(x) )
-    #     = 1/epsilon * ( F(x+epsilon*v) - Fxold )
-    # we compute Fxold at startup
-    # we have to keep x so that we can compute the F(x+exps*v)
-    operators.diffusion(x, Fxold, x_old, boundary, options)
+            if j > 0:
+                s -= omega*z[i*ny + j-1]
 
-    v = (1. + EPS) * x
+            z[i*ny + j] = s / d[i*ny + j]
 
-    # Fx = F(v)
-    operators.diffusion(v, Fx, x_old, boundary, options)
+    # backward sweep
+    scale = omega*(2. - omega)
+    for i in range(nx-1, -1, -1):
+        for j in range(ny-1, -1, -1):
+            s = d[i*ny + j]*z[i*ny + j]
+            if i < nx-1:
+                s -= omega*z[(i+1)*ny + j]
 
-    # r = b - A*x
-    # where A*x = (Fx-Fxold)/eps
-    r = b - EPS_INV * (Fx - Fxold)
+            if j < ny-1:
+                s -= omega*z[i*ny + j+1]
 
-    # p = r
-    p = np.copy(r)
+            z[i*ny + j] = s / d[i*ny + j]
 
-    # rold = <r,r>
-    rold = r @ r
-    rnew = rold
+    for k in range(nx*ny):
+        z[k] *= scale
 
-    if np.sqrt(rold) < tolerance:
+
+@numba.njit(cache=True)
+def _gauss_seidel(pc, l, forward):
+    # one Gauss-Seidel sweep for A_l*x_l = b_l
+    nx, ny, o = pc.nx[l], pc.ny[l], pc.offset[l]
+    s = 0.25**l
+    x, b, d = pc.x, pc.b, pc.diag
+    for ii in range(nx):
+        i = ii if forward else nx - 1 - ii
+        for jj in range(ny):
+            j = jj if forward else ny - 1 - jj
+            k = o + i*ny + j
+            nbrs = 0.
+            if i > 0:
+                nbrs += x[k-ny]
+
+            if i < nx-1:
+                nbrs += x[k+ny]
+
+            if j > 0:
+                nbrs += x[k-1]
+
+            if j < ny-1:
+                nbrs += x[k+1]
+
+            x[k] = (b[k] - s*nbrs) / d[k]
+
+
+@numba.njit(cache=True)
+def _restrict_residual(pc, l):
+    # r_l = b_l - A_l*x_l and b_l+1 = R*r_l, with R the full weighting
+    # operator, i.e. the transpose of bilinear interpolation scaled by 1/4
+    nx, ny, o = pc.nx[l], pc.ny[l], pc.offset[l]
+    nxc, nyc, oc = pc.nx[l+1], pc.ny[l+1], pc.offset[l+1]
+    s = 0.25**l
+    x, b, r, d = pc.x, pc.b, pc.r, pc.diag
+    for i in range(nx):
+        for j in range(ny):
+            k = o + i*ny + j
+            nbrs = 0.
+            if i > 0:
+                nbrs += x[k-ny]
+
+            if i < nx-1:
+                nbrs += x[k+ny]
+
+            if j > 0:
+                nbrs += x[k-1]
+
+            if j < ny-1:
+                nbrs += x[k+1]
+
+            r[k] = b[k] - s*nbrs - d[k]*x[k]
+
+    for ic in range(nxc):
+        for jc in range(nyc):
+            acc = 0.
+            for a in range(-1, 2):
+                i = 2*ic + 1 + a
+                if i >= nx:
+                    continue
+
+                for c in range(-1, 2):
+                    j = 2*jc + 1 + c
+                    if j >= ny:
+                        continue
+
+                    w = (1. if a == 0 else 0.5) * (1. if c == 0 else 0.5)
+                    acc += w*r[o + i*ny + j]
+
+            b[oc + ic*nyc + jc] = 0.25*acc
+
+
+@numba.njit(cache=True)
+def _prolongate(pc, l):
+    # x_l += P*x_l+1, with P bilinear interpolation
+    nx, ny, o = pc.nx[l], pc.ny[l], pc.offset[l]
+    nxc, nyc, oc = pc.nx[l+1], pc.ny[l+1], pc.offset[l+1]
+    x = pc.x
+    for ic in range(nxc):
+        for jc in range(nyc):
+            e = x[oc + ic*nyc + jc]
+            for a in range(-1, 2):
+                i = 2*ic + 1 + a
+                if i >= nx:
+                    continue
+
+                for c in range(-1, 2):
+                    j = 2*jc + 1 + c
+                    if j >= ny:
+                        continue
+
+                    w = (1. if a == 0 else 0.5) * (1. if c == 0 else 0.5)
+                    x[o + i*ny + j] += w*e
+
+
+@numba.njit(cache=True)
+def _vcycle(pc, r, z):
+    # one symmetric multigrid V-cycle: forward Gauss-Seidel pre-smoothing,
+    # backward post-smoothing and symmetric sweeps on the coarsest level,
+    # so that the preconditioner stays symmetric
+    nlevels = len(pc.nx)
+    copy(pc.b, r)
+    pc.x[:] = 0.
+
+    for l in range(nlevels - 1):
+        for sweep in range(MG_SMOOTH):
+            _gauss_seidel(pc, l, True)
+
+        _restrict_residual(pc, l)
+
+    for sweep in range(MG_COARSE_SWEEPS):
+        _gauss_seidel(pc, nlevels - 1, True)
+        _gauss_seidel(pc, nlevels - 1, False)
+
+    for l in range(nlevels - 2, -1, -1):
+        _prolongate(pc, l)
+        for sweep in range(MG_SMOOTH):
+            _gauss_seidel(pc, l, False)
+
+    copy(z, pc.x[:r.size])
+
+
+@numba.njit(cache=True)
+def cg(x, u, x_old, b, boundary, options, tolerance, maxiters, jacobian,
+       precond, ws, parallel):
+    r, p, z, Ap = ws.r, ws.p, ws.z, ws.Ap
+    count = ws.counters
+
+    # the finite-difference approximation needs F(x) at the initial x,
+    # which we compute at startup; we have to keep x so that we can compute
+    # the F(x+eps*v)
+    if jacobian == JACOBIAN_FD:
+        copy(ws.xold, x)
+        diffusion(x, ws.Fxold, x_old, boundary, options, parallel)
+        count[COUNT_COPY] += 1
+        count[COUNT_STENCIL] += 1
+
+    # r = b - A*x and rnew = <r,r>
+    matvec(x, Ap, u, x_old, boundary, options, jacobian, ws, parallel)
+    waxpby(r, 1., b, -1., Ap, parallel)
+    rnew = dot(r, r, parallel)
+    count[COUNT_STENCIL] += 1
+    count[COUNT_WAXPBY] += 1
+    count[COUNT_DOT] += 1
+    if np.sqrt(rnew) < tolerance:
         return CGStatus(True, 0, np.sqrt(rnew))
 
+    # z = M^-1*r
+    precond_update(precond, u, options)
+    precond_apply(precond, r, z)
+    count[COUNT_PRECOND_SETUP] += 1
+    count[COUNT_PRECOND] += 1
+
+    # p = z and rold = <r,z>
+    copy(p, z)
+    rold = dot(r, z, parallel)
+    count[COUNT_COPY] += 1
+    count[COUNT_DOT] += 1
+
     for it in range(1, maxiters + 1):
         # Ap = A*p
-        v = xold + EPS * p
-        operators.diffusion(v, Fx, x_old, boundary, options)
-
-        Ap = EPS_INV * (Fx - Fxold)
+        matvec(p, Ap, u, x_old, boundary, options, jacobian, ws, parallel)
 
         # alpha = rold / p'*Ap
-        alpha = rold / (p @ Ap)
-
-        x += alpha * p
+        alpha = rold / dot(p, Ap, parallel)
 
-        r -= alpha * Ap
-
-        # find new norm
-        rnew = r @ r
+        # x += alpha*p, r -= alpha*Ap and find new norm
+        rnew = cg_update(x, r, p, Ap, alpha, parallel)
+        count[COUNT_STENCIL] += 1
+        count[COUNT_DOT] += 1
+        count[COUNT_CG_UPDATE] += 1
 
         residual = np.sqrt(rnew)
         if (residual < tolerance):
             return CGStatus(True, it, residual)
 
-        p = r + (rnew / rold) * p
-        rold = rnew
+        precond_apply(precond, r, z)
+        rz = dot(r, z, parallel)
+
+        # p = z + beta*p
+        waxpby(p, 1., z, rz / rold, p, parallel)
+        rold = rz
+        count[COUNT_PRECOND] += 1
+        count[COUNT_DOT] += 1
+        count[COUNT_WAXPBY] += 1
 
     return CGStatus(False, it, residual)
+
+
+@numba.njit(cache=True)
+def refine(x, u, x_old, b, boundary, options, tolerance, maxiters, jacobian,
+           single, ws, parallel):
+    # solve A*x = b in mixed precision by iterative refinement: the residual
+    # r = b - A*x is computed in double precision, and the correction
+    # A*c = r is solved for by cg() in single precision, which halves the
+    # memory traffic of its stencils and vector operations
+    #
+    # cg() solves for c/|r| instead, as the residual shrinks by orders of
+    # magnitude over the Newton iteration and would otherwise underflow in
+    # single precision
+    #
+    # returns the status with the iterations of all single precision cg()
+    # calls and the residual in double precision, and the number of
+    # corrections made
+    r, Ap = ws.r, ws.Ap
+    c = single.ws.deltax
+    count = ws.counters
+
+    copy(single.u, u)
+    count[COUNT_COPY] += 1
+
+    iters = 0
+    for k in range(REFINE_MAX + 1):
+        # r = b - A*x in double precision
+        matvec(x, Ap, u, x_old, boundary, options, jacobian, ws, parallel)
+        waxpby(r, 1., b, -1., Ap, parallel)
+        residual = np.sqrt(dot(r, r, parallel))
+        count[COUNT_STENCIL] += 1
+        count[COUNT_WAXPBY] += 1
+        count[COUNT_DOT] += 1
+        if residual < tolerance:
+            return CGStatus(True, iters, residual), k
+
+        if k == REFINE_MAX:
+            break
+
+        # A*c = r/|r| in single precision, starting from c = 0
+        waxpby(single.ws.b, 1./residual, r, 0., r, parallel)
+        c[:] = 0.
+        count[COUNT_WAXPBY] += 1
+        status = cg(c, single.u, x_old, single.ws.b, single.boundary,
+                    options, max(tolerance/residual, REFINE_REDUCTION),
+                    maxiters, jacobian, single.precond, single.ws, parallel)
+        iters += status.iters
+        if not status.converged:
+            return CGStatus(False, iters, residual), k
+
+        # x += |r|*c
+        waxpby(x, 1., x, residual, c, parallel)
+        count[COUNT_WAXPBY] += 1
+
+    return CGStatus(False, iters, residual), REFINE_MAX
+
+
+@numba.njit(cache=True)
+def forcing(kind, tolerance, residual, residual_prev, eta_prev):
+    # the tolerance of the linear system of a Newton iteration with residual
+    # |F(x)|, and its forcing term eta, given those of the previous Newton
+    # iteration of the timestep, with residual_prev = 0 at the first
+    #
+    # with FORCING_EW the linear systems are solved to eta*|F(x)|: loosely
+    # while the Newton iteration is far from converged, and ever tighter as
+    # it converges
+    if kind == FORCING_FIXED:
+        return tolerance, 0.
+
+    if residual_prev == 0.:
+        eta = EW_ETA_MAX
+    else:
+        eta = EW_GAMMA * (residual / residual_prev)**EW_ALPHA
+
+        # do not tighten faster than the previous forcing term suggests
+        safeguard = EW_GAMMA * eta_prev**EW_ALPHA
+        if safeguard > 0.1:
+            eta = max(eta, safeguard)
+
+    # and do not solve beyond what brings |F(x)| below the tolerance
+    eta = min(EW_ETA_MAX, max(eta, 0.5 * tolerance / residual))
+    return eta * residual, eta
+
+
+@numba.njit(cache=True)
+def predict(x, ws, timestep, dt, predictor, parallel):
+    # the initial guess x of the Newton iteration of timestep, of size dt,
+    # where x and ws.x_old are the solution of the previous timestep
+    #
+    # ws.x_prev keeps the solution of the timestep before, for the next call;
+    # it is extrapolated from only if it is from the timestep right before
+    # x_old, which it is not on the first timestep after a restart, nor when
+    # a failed timestep is retried
+    if predictor == PREDICT_NONE:
+        return
+
+    count = ws.counters
+    if timestep >= 2 and ws.x_prev_step[0] == timestep - 2:
+        # x = x_old + theta*(x_old - x_prev), with theta the ratio of this
+        # timestep to the previous one
+        theta = dt / ws.dt_prev[0]
+        waxpby(x, 1. + theta, ws.x_old, -theta, ws.x_prev, parallel)
+        count[COUNT_WAXPBY] += 1
+
+    copy(ws.x_prev, ws.x_old)
+    ws.x_prev_step[0] = timestep - 1
+    ws.dt_prev[0] = dt
+    count[COUNT_COPY] += 1
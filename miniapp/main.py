@@ -7,16 +7,24 @@
 #   Originally developed in C++ by Ben Cumming, CSCS
 #   Ported to Python by Vasileios Karakasis, CSCS
 
+from datetime import datetime
+
+# the start of the run, before the imports, for the startup time
+STARTED = datetime.now()
+
+import argparse
 import collections
-import matplotlib
+import json
 import numba
 import numpy as np
 import os
 import sys
-from datetime import datetime
+from numba.core.runtime import rtsys
 
+import checkpoint
+import kernels
 import linalg
-import operators
+import perf
 
 
 Discretization = collections.namedtuple(
@@ -27,155 +35,649 @@ Boundary = collections.namedtuple(
     'Boundary', ['north', 'south', 'east', 'west']
 )
 
-NewtonStatus = collections.namedtuple(
-    'NewtonStatus', ['solution', 'converged', 'timestep',
-                     'iters_newton', 'iters_cg', 'status_cg']
+# with mixed=True the linear systems of the Newton iteration are solved by
+# linalg.refine() instead of linalg.cg(); forcing and predictor select
+# linalg.forcing() and linalg.predict()
+Solver = collections.namedtuple(
+    'Solver', ['max_cg_iters', 'max_newton_iters', 'tolerance', 'jacobian',
+               'parallel', 'mixed', 'forcing', 'predictor']
 )
 
+Problem = collections.namedtuple(
+    'Problem', ['x', 'boundary', 'options', 'solver', 'precond', 'ws',
+                'single']
+)
 
-def usage():
-    print(f'Usage: {sys.argv[0]} nx ny nt t', file=sys.stderr)
-    print(f'  nx  number of gridpoints in x-direction', file=sys.stderr)
-    print(f'  ny  number of gridpoints in y-direction', file=sys.stderr)
-    print(f'  nt  number of timesteps', file=sys.stderr)
-    print(f'  t   total simulated time', file=sys.stderr)
+NewtonStatus = collections.namedtuple(
+    'NewtonStatus', ['solution', 'converged', 'timestep', 'iters_newton',
+                     'iters_cg', 'iters_refine', 'status_cg']
+)
 
+# iteration parameters
+MAX_CG_ITERS = 200
+MAX_NEWTON_ITERS = 50
+TOLERANCE = 1.e-6
+
+# adaptive timestepping: the timestep grows by DT_GROW after a step that
+# took at most NEWTON_FEW Newton iterations and shrinks by DT_SHRINK after a
+# step that took at least NEWTON_MANY; a step that fails is retried with a
+# timestep DT_SHRINK times smaller, at most MAX_RETRIES times
+DT_GROW = 1.5
+DT_SHRINK = 0.5
+NEWTON_FEW = 3
+NEWTON_MANY = 8
+MAX_RETRIES = 10
+
+# the points per rank and direction of the grid whose timestep compiles the
+# jitted kernels of the timeloops that are Python loops, see main()
+WARM_UP_GRID = 8
+
+# an accepted step of adaptive_timeloop(), which reached the simulated time
+# `time` with a timestep dt after `retries` failed attempts
+AdaptiveStep = collections.namedtuple(
+    'AdaptiveStep', ['status', 'time', 'dt', 'retries']
+)
 
-def parse_arg(v, argname, fn):
-    try:
+
+def positive(fn):
+    def _parse(v):
         v = fn(v)
-    except ValueError as e:
-        print(f'{sys.argv[0]}: could not parse argument {argname}: {e}')
-        usage()
-        sys.exit(1)
+        if v <= 0:
+            raise ValueError(f'value must be positive: {v}')
 
-    return v
+        return v
 
+    _parse.__name__ = fn.__name__
+    return _parse
 
-@numba.njit(cache=True)
-def timeloop(x, boundary, options, max_cg_iters, max_newton_iters, tolerance):
-    # main timeloop
 
-    nx, ny = options.nx, options.ny
+JACOBIANS = {
+    'fd': linalg.JACOBIAN_FD,
+    'exact': linalg.JACOBIAN_EXACT,
+}
+
+PRECONDITIONERS = {
+    'none': linalg.PRECOND_NONE,
+    'jacobi': linalg.PRECOND_JACOBI,
+    'ssor': linalg.PRECOND_SSOR,
+    'mg': linalg.PRECOND_MG,
+}
+
+FORCINGS = {
+    'fixed': linalg.FORCING_FIXED,
+    'ew': linalg.FORCING_EW,
+}
+
+PREDICTORS = {
+    'none': linalg.PREDICT_NONE,
+    'linear': linalg.PREDICT_LINEAR,
+}
+
+# matrix-free runs linalg.cg(), the others assembled.timeloop()
+LINEAR_SOLVERS = ['matrix-free', 'csr', 'direct']
+
+# serial and parallel run timeloop(), jax xla.timeloop() and numpy and cupy
+# vectorized.timeloop() on the arrays of that library
+BACKENDS = ['serial', 'parallel', 'jax', 'numpy', 'cupy']
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Solve the 2D Fisher equation on a nx*ny grid'
+    )
+    parser.add_argument('nx', type=positive(int),
+                        help='number of gridpoints in x-direction')
+    parser.add_argument('ny', type=positive(int),
+                        help='number of gridpoints in y-direction')
+    parser.add_argument('nt', type=positive(int),
+                        help='number of timesteps')
+    parser.add_argument('t', type=positive(float),
+                        help='total simulated time')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='adapt the timestep to the convergence of the '
+                             'Newton iteration, starting from t/nt, until '
+                             'the simulated time reaches t')
+    parser.add_argument('--jacobian', choices=JACOBIANS, default='exact',
+                        help='how CG applies the Jacobian of the diffusion '
+                             'operator: analytically or by finite '
+                             'differences (default: %(default)s)')
+    parser.add_argument('--precond', choices=PRECONDITIONERS, default='none',
+                        help='preconditioner for CG (default: %(default)s)')
+    parser.add_argument('--linear-solver', choices=LINEAR_SOLVERS,
+                        default='matrix-free',
+                        help='solve the linear systems of the Newton '
+                             'iteration with matrix-free CG, with CG on the '
+                             'assembled CSR Jacobian, or with a sparse LU '
+                             'factorization of it that is reused while the '
+                             'Newton iteration converges fast; csr and '
+                             'direct need --jacobian exact and neither '
+                             '--mpi nor --precision mixed '
+                             '(default: %(default)s)')
+    parser.add_argument('--precision', choices=['double', 'mixed'],
+                        default='double',
+                        help='run CG in double precision, or in single '
+                             'precision refined to the tolerance in double '
+                             'precision; mixed needs --jacobian exact '
+                             '(default: %(default)s)')
+    parser.add_argument('--forcing', choices=FORCINGS, default='fixed',
+                        help='solve the linear systems of the Newton '
+                             'iteration to the Newton tolerance, or to '
+                             'Eisenstat-Walker tolerances relative to the '
+                             'Newton residual (default: %(default)s)')
+    parser.add_argument('--predictor', choices=PREDICTORS, default='none',
+                        help='start the Newton iteration of a timestep from '
+                             'the previous solution, or extrapolate it from '
+                             'the previous two (default: %(default)s)')
+    parser.add_argument('--backend', choices=BACKENDS, default='serial',
+                        help='run the stencils and the vector operations '
+                             'as numba loops on one or on all threads, the '
+                             'whole timeloop as one XLA program with JAX, '
+                             'or as whole-array operations on NumPy or CuPy '
+                             'arrays; jax, numpy and cupy only support the '
+                             'default solver options and not --mpi '
+                             '(default: %(default)s)')
+    parser.add_argument('--threads', type=positive(int),
+                        help='number of threads of the parallel backend '
+                             '(default: NUMBA_NUM_THREADS)')
+    parser.add_argument('--affinity', choices=['none', 'compact', 'spread'],
+                        default='none',
+                        help='pin the threads of the parallel backend to '
+                             'CPUs, filling one NUMA node after the other or '
+                             'dealt out over the nodes; Linux only '
+                             '(default: %(default)s)')
+    parser.add_argument('--checkpoint-every', type=positive(int),
+                        metavar='K',
+                        help='write a snapshot of the solution every K '
+                             'timesteps')
+    parser.add_argument('--checkpoint-dir', default='checkpoints',
+                        help='directory of the snapshots '
+                             '(default: %(default)s)')
+    parser.add_argument('--restart', action='store_true',
+                        help='resume from the latest snapshot in '
+                             '--checkpoint-dir')
+    parser.add_argument('--no-plot', action='store_true',
+                        help='do not plot the solution; matplotlib is only '
+                             'imported for the plot')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the performance report to FILE')
+    parser.add_argument('--mpi', action='store_true',
+                        help='decompose the grid over the MPI ranks; '
+                             'run with mpiexec -n <ranks>')
+    args = parser.parse_args(argv)
+    if args.precision == 'mixed' and args.jacobian != 'exact':
+        parser.error('--precision mixed needs --jacobian exact')
+
+    if args.linear_solver != 'matrix-free':
+        if args.jacobian != 'exact':
+            parser.error(f'--linear-solver {args.linear_solver} needs '
+                         f'--jacobian exact')
+
+        if args.mpi or args.precision == 'mixed':
+            parser.error(f'--linear-solver {args.linear_solver} supports '
+                         f'neither --mpi nor --precision mixed')
+
+    if args.backend not in ('serial', 'parallel'):
+        defaults = ('exact', 'none', 'double', 'fixed', 'none',
+                    'matrix-free')
+        if args.mpi or (args.jacobian, args.precond, args.precision,
+                        args.forcing, args.predictor,
+                        args.linear_solver) != defaults:
+            parser.error(f'--backend {args.backend} supports neither --mpi '
+                         f'nor solver options other than the defaults')
+
+    if args.affinity != 'none' and args.backend != 'parallel':
+        parser.error('--affinity needs --backend parallel')
+
+    if args.adaptive and args.restart:
+        # the checkpoints do not record the simulated time and the timestep
+        parser.error('--restart is not supported with --adaptive')
+
+    return args
+
+
+def initial_condition(nx, ny, dx, islice=slice(None), jslice=slice(None),
+                      radius=None):
+    # a circle of concentration 0.1 centred at (xdim/4, ydim/4) with radius
+    # no larger than 1/8 of both xdim and ydim, unless given, evaluated on
+    # the points islice*jslice of the grid
+    xspace = np.linspace(0, 1, nx)[islice]
+    yspace = np.linspace(0, 1, ny)[jslice]
+    X, Y = np.meshgrid(xspace, yspace, indexing='ij')
 
-    # initialize fields
-    b = np.zeros(nx*ny)
-    deltax = np.zeros(nx*ny)
+    xc = 1.0 / 4.0
+    yc = (ny - 1) * dx / 4
+    if radius is None:
+        radius = min(xc, yc) / 2.0
+
+    x = np.zeros(X.shape)
+    x[(X - xc) ** 2 + (Y - yc) ** 2 < radius * radius] = 0.1
+    return x.flatten()
+
+
+def setup(nx, ny, nt, t, jacobian='exact', precond='none', parallel=False,
+          islice=slice(None), jslice=slice(None), precision='double',
+          forcing='fixed', predictor='none'):
+    # the initial solution, boundary, discretization, solver parameters,
+    # preconditioner and workspaces of a run of nt steps up to time t on the
+    # points islice*jslice of a nx*ny grid
+    #
+    # returned as a Problem, whose fields are the arguments of timeloop()
+    mixed = precision == 'mixed'
+    if mixed and jacobian != 'exact':
+        # the finite-difference step is below single precision
+        raise ValueError('mixed precision needs the exact Jacobian')
+
+    # calculate timestep
+    dt = t / nt
+
+    # compute the distance between grid points
+    # assume that x dimension has length 1.0
+    dx = 1. / (nx - 1)
+
+    # set alpha, assume diffusion coefficient D is 1
+    alpha = (dx*dx) / dt
+
+    nxl = len(range(nx)[islice])
+    nyl = len(range(ny)[jslice])
+    options = Discretization(nxl, nyl, nxl*nyl, nt, dt, dx, alpha)
+
+    solver = Solver(MAX_CG_ITERS, MAX_NEWTON_ITERS, TOLERANCE,
+                    JACOBIANS[jacobian], parallel, mixed, FORCINGS[forcing],
+                    PREDICTORS[predictor])
+
+    # set dirichlet boundary conditions to 0 all around; with --mpi, the
+    # edges shared with other ranks are filled in by the halo exchange
+    bndN  = np.zeros(nxl)
+    bndS  = np.zeros(nxl)
+    bndE  = np.zeros(nyl)
+    bndW  = np.zeros(nyl)
+    boundary = Boundary(bndN, bndS, bndE, bndW)
+
+    # in mixed precision only the single precision CG is preconditioned
+    kind = PRECONDITIONERS[precond]
+    if mixed:
+        single = linalg.single_precision(kind, nxl, nyl, boundary, parallel)
+        kind = linalg.PRECOND_NONE
+    else:
+        single = linalg.single_precision(linalg.PRECOND_NONE, 0, 0,
+                                         boundary)
+
+    # the grids of the parallel backend are first touched by its threads,
+    # see linalg.zeros()
+    x = linalg.zeros(nxl, nyl, parallel=parallel)
+    x[:] = initial_condition(nx, ny, dx, islice, jslice)
+    return Problem(x, boundary, options, solver,
+                   linalg.preconditioner(kind, nxl, nyl),
+                   linalg.workspace(nxl, nyl, parallel=parallel), single)
+
+
+def nrt_allocations():
+    # number of allocations made so far by jitted code
+    try:
+        return rtsys.get_allocation_stats().alloc
+    except RuntimeError:
+        # the numba runtime is not initialized before the first jitted
+        # function is loaded, so nothing can have been allocated yet
+        return 0
 
-    nt = options.nt
+
+@numba.njit(cache=True, nogil=True)
+def timeloop(x, boundary, options, solver, precond, ws, single, first,
+             last):
+    # main timeloop, over the timesteps first..last
+
+    # fields are preallocated in the workspace
+    b, deltax, x_old = ws.b, ws.deltax, ws.x_old
+
+    tolerance = solver.tolerance
+    count = ws.counters
     iters_newton = 0
     iters_cg = 0
-
-    for timestep in range(1, nt+1):
-        x_old = np.copy(x)
+    iters_refine = 0
+    converged = True
+    cg_status = linalg.CGStatus(True, 0, 0.)
+
+    timestep = first - 1
+    for timestep in range(first, last+1):
+        linalg.copy(x_old, x)
+        count[linalg.COUNT_COPY] += 1
+        linalg.predict(x, ws, timestep, options.dt, solver.predictor,
+                       solver.parallel)
         converged = False
-        for it in range(max_newton_iters):
-            operators.diffusion(x, b, x_old, boundary, options)
-            residual = np.sqrt(b @ b)
+        residual_prev = 0.
+        eta = 0.
+        for it in range(solver.max_newton_iters):
+            linalg.diffusion(x, b, x_old, boundary, options, solver.parallel)
+            residual = np.sqrt(linalg.dot(b, b, solver.parallel))
+            count[linalg.COUNT_RESIDUAL] += 1
             if residual < tolerance:
                 converged = True
                 break
 
-            cg_status = linalg.cg(
-                deltax, x_old, b, boundary, options,
-                tolerance, max_cg_iters
-            )
+            cg_tolerance, eta = linalg.forcing(solver.forcing, tolerance,
+                                               residual, residual_prev, eta)
+            residual_prev = residual
+            if solver.forcing != linalg.FORCING_FIXED:
+                # the corrections shrink as the Newton iteration converges,
+                # so the previous one is a worse initial guess than zero
+                deltax[:] = 0.
+
+            if solver.mixed:
+                cg_status, refinements = linalg.refine(
+                    deltax, x, x_old, b, boundary, options,
+                    cg_tolerance, solver.max_cg_iters, solver.jacobian,
+                    single, ws, solver.parallel
+                )
+                iters_refine += refinements
+            else:
+                cg_status = linalg.cg(
+                    deltax, x, x_old, b, boundary, options,
+                    cg_tolerance, solver.max_cg_iters, solver.jacobian,
+                    precond, ws, solver.parallel
+                )
 
             iters_cg += cg_status.iters
             if not cg_status.converged:
                 break
 
-            x -= deltax
+            linalg.waxpby(x, 1., x, -1., deltax, solver.parallel)
+            count[linalg.COUNT_WAXPBY] += 1
 
         iters_newton += it + 1
         if not converged:
             break
 
     return NewtonStatus(x, converged, timestep,
-                        iters_newton, iters_cg, cg_status)
-
-
-def main():
-    if len(sys.argv) < 5:
-        print(f'{sys.argv[0]}: too few arguments', file=sys.stderr)
-        usage()
-        sys.exit(1)
-
-    nx, ny, nt, t, *_ = sys.argv[1:]
-
-    def is_positive(x):
-        if x <= 0:
-            raise ValueError(f'value must be positive: {x}')
-
-        return x
-
-    nx = parse_arg(nx, 'nx', lambda x: is_positive(int(x)))
-    ny = parse_arg(ny, 'ny', lambda x: is_positive(int(x)))
-    nt = parse_arg(nt, 'nt', lambda x: is_positive(int(x)))
-    t  = parse_arg(t,  't',  lambda x: is_positive(float(x)))
+                        iters_newton, iters_cg, iters_refine, cg_status)
+
+
+def adaptive_timeloop(advance, x, ws, options, t):
+    # advance the solution x from time 0 to t with adaptive timesteps,
+    # starting with options.dt, where advance(options, first, last) runs the
+    # timeloop over the timesteps first..last with the given discretization
+    #
+    # yields an AdaptiveStep for every accepted timestep, with the
+    # iterations of its failed attempts included in its status, and at last
+    # the status of a timestep that failed even with the smallest timestep
+    time = 0.
+    dt = options.dt
+    step = 1
+    while t - time > 1e-12*t:
+        # the last step ends exactly at t
+        dt = min(dt, t - time)
+        iters_newton = iters_cg = iters_refine = 0
+        for retry in range(MAX_RETRIES + 1):
+            opts = options._replace(dt=dt, alpha=options.dx**2/dt)
+            status = advance(opts, step, step)
+            iters_newton += status.iters_newton
+            iters_cg += status.iters_cg
+            iters_refine += status.iters_refine
+            if status.converged:
+                break
 
-    # calculate timestep
-    dt = t / nt
+            # undo the failed attempt; the timeloop keeps the solution of
+            # the previous step in ws.x_old
+            linalg.copy(x, ws.x_old)
+            dt *= DT_SHRINK
+
+        newton = status.iters_newton
+        status = status._replace(iters_newton=iters_newton,
+                                 iters_cg=iters_cg, iters_refine=iters_refine)
+        if not status.converged:
+            yield AdaptiveStep(status, time, opts.dt, retry)
+            return
+
+        time += opts.dt
+        yield AdaptiveStep(status, time, opts.dt, retry)
+
+        if newton <= NEWTON_FEW:
+            dt *= DT_GROW
+        elif newton >= NEWTON_MANY:
+            dt *= DT_SHRINK
+
+        step += 1
+
+
+def main(started=STARTED):
+    # started is the start of the run, from which the startup time is
+    # measured
+    args = parse_args()
+    nx, ny, nt, t = args.nx, args.ny, args.nt, args.t
+    if args.threads:
+        numba.set_num_threads(args.threads)
+
+    # the threads are pinned before setup() first touches the grids, so
+    # that the pages stay with the threads that work on them
+    cpus = None
+    if args.affinity != 'none':
+        # imported here, as it only works on Linux
+        import affinity
+
+        cpus = affinity.pin(args.affinity)
+
+    # with --mpi, every rank solves on its own part of the grid
+    decomp = None
+    islice = jslice = slice(None)
+    if args.mpi:
+        # imported here, so that mpi4py is only needed with --mpi
+        import decomposition
+
+        decomp = decomposition.Decomposition(nx, ny)
+        islice, jslice = decomp.islice, decomp.jslice
+        if decomp.rank != 0:
+            sys.stdout = open(os.devnull, 'w')
+
+    x, boundary, options, solver, precond, ws, single = setup(
+        nx, ny, nt, t, args.jacobian, args.precond,
+        args.backend == 'parallel', islice, jslice, args.precision,
+        args.forcing, args.predictor
+    )
+    dx, dt = options.dx, options.dt
 
-    # compute the distance between grid points
-    # assume that x dimension has length 1.0
-    dx = 1. / (nx - 1)
+    # imported here, so that scipy is only needed for the assembled Jacobian
+    jac = None
+    if args.linear_solver != 'matrix-free':
+        import assembled
 
-    # set alpha, assume diffusion coefficient D is 1
-    alpha = (dx*dx) / dt
+        jac = assembled.Assembled(options, args.linear_solver)
 
-    options = Discretization(nx, ny, nx*ny, nt, dt, dx, alpha)
+    # imported here, so that jax is only needed with --backend jax, and
+    # cupy with --backend cupy
+    if args.backend == 'jax':
+        import xla
+    elif args.backend in ('numpy', 'cupy'):
+        import vectorized
 
-    # set iteration parameters
-    max_cg_iters = 200
-    max_newton_iters = 50
-    tolerance = 1.e-6
+        xp = vectorized.array_module(args.backend)
 
     print(f'========================================================================')
     print(f'                      Welcome to mini-stencil!')
     print(f'version   :: Python')
     print(f'mesh      :: {nx} * {ny} dx = {dx}')
-    print(f'time      :: {nt} time steps from 0 .. {nt*dt}')
-    print(f'iteration :: CG {max_cg_iters}, Newton {max_newton_iters}, '
-          f'tolerance {tolerance}')
+    if args.adaptive:
+        print(f'time      :: adaptive time steps from 0 .. {t}, '
+              f'starting with {dt}')
+    else:
+        print(f'time      :: {nt} time steps from 0 .. {nt*dt}')
+    print(f'iteration :: CG {solver.max_cg_iters}, '
+          f'Newton {solver.max_newton_iters}, tolerance {solver.tolerance}')
+    print(f'solver    :: jacobian {args.jacobian}, '
+          f'preconditioner {args.precond}, precision {args.precision}, '
+          f'linear solver {args.linear_solver}')
+    print(f'newton    :: forcing {args.forcing}, predictor {args.predictor}')
+    if args.backend == 'jax':
+        print(f'backend   :: jax, XLA on {xla.jax.devices()[0]}')
+    elif args.backend in ('numpy', 'cupy'):
+        print(f'backend   :: {args.backend}, vectorized')
+    else:
+        print(f'backend   :: {args.backend}, '
+              f'{numba.get_num_threads() if solver.parallel else 1} threads')
+    if cpus is not None:
+        print(f'affinity  :: {args.affinity}, threads on CPUs {cpus}')
+    if decomp is not None:
+        print(f'mpi       :: {decomp.size} ranks, '
+              f'{decomp.dims[0]} * {decomp.dims[1]} sub-grids')
+
     print(f'========================================================================')
 
-    # Solution field
-    x = np.zeros(nx*ny)
+    iters_cg = 0
+    iters_newton = 0
+    iters_refine = 0
+
+    def stepper(problem, jac, decomp):
+        # advance(options, first, last), which runs the timeloop of the
+        # backend on problem over the timesteps first..last
+        x, boundary, _, solver, precond, ws, single = problem
+
+        def advance(options, first, last):
+            if jac is not None:
+                return NewtonStatus(*assembled.timeloop(
+                    x, boundary, options, solver, precond, ws, single, first,
+                    last, jac
+                ))
+
+            if args.backend == 'jax':
+                return xla.timeloop(x, boundary, options, solver, precond,
+                                    ws, single, first, last)
+
+            if args.backend in ('numpy', 'cupy'):
+                return vectorized.timeloop(x, boundary, options, solver,
+                                           precond, ws, single, first, last,
+                                           xp)
+
+            if decomp is None:
+                # the ahead-of-time compiled timeloop is serial
+                run = kernels.get(timeloop, jit=solver.parallel)
+                return NewtonStatus(*run(x, boundary, options, solver,
+                                         precond, ws, single, first, last))
+
+            return NewtonStatus(*decomposition.timeloop(
+                x, boundary, options, solver, precond, ws, single, first,
+                last, decomp
+            ))
+
+        return advance
+
+    advance = stepper(Problem(x, boundary, options, solver, precond, ws,
+                              single), jac, decomp)
+
+    # with --checkpoint-every, the timeloop is run in chunks of that many
+    # steps, after each of which a snapshot is handed to the writer thread
+    chunk = args.checkpoint_every or nt
+    first = 1
+    prefix = f'{nx}x{ny}_t={t}_steps={nt}'
+    if decomp is not None:
+        prefix += f'_rank={decomp.rank}'
+
+    if args.restart:
+        found = checkpoint.latest(args.checkpoint_dir, prefix)
+        step = found[0] if found else 0
+        if decomp is not None:
+            # the ranks might not all have finished writing the same step
+            step = decomp.min(step)
+
+        if step > 0:
+            path = checkpoint.filename(args.checkpoint_dir, prefix, step)
+            x = checkpoint.load(path, (options.nx, options.ny))
+            first = step + 1
+            print(f'restarting from step {step} in "{path}"')
+        else:
+            print(f'no checkpoint found in "{args.checkpoint_dir}", '
+                  f'starting from step 1')
+
+    writer = None
+    if args.checkpoint_every:
+        writer = checkpoint.CheckpointWriter(args.checkpoint_dir, prefix,
+                                             (options.nx, options.ny))
+
+    # compile the jitted code, or load it from the cache, before the timing
+    # of the simulation starts
+    timejit = datetime.now()
+    advance(options, first, first - 1)
+    if jac is not None or decomp is not None:
+        # the timeloops of the assembled Jacobian and of --mpi are Python
+        # loops over jitted kernels, which a call without timesteps never
+        # reaches; they are run for a timestep on a problem of WARM_UP_GRID
+        # points per rank and direction with the same options instead
+        warm_decomp = None
+        warm_nx = warm_ny = WARM_UP_GRID
+        warm_islice = warm_jslice = slice(None)
+        if decomp is not None:
+            warm_nx *= decomp.dims[0]
+            warm_ny *= decomp.dims[1]
+            warm_decomp = decomposition.Decomposition(warm_nx, warm_ny)
+            warm_islice, warm_jslice = warm_decomp.islice, warm_decomp.jslice
+
+        warm = setup(warm_nx, warm_ny, 1, dt, args.jacobian, args.precond,
+                     args.backend == 'parallel', warm_islice, warm_jslice,
+                     args.precision, args.forcing, args.predictor)
+        warm_jac = None
+        if jac is not None:
+            warm_jac = assembled.Assembled(warm.options, args.linear_solver)
+
+        stepper(warm, warm_jac, warm_decomp)(warm.options, 1, 1)
+
+    timejit = (datetime.now() - timejit).total_seconds()
+
+    # from the start of the run to the first timestep, including the imports
+    # and the setup
+    startup = (datetime.now() - started).total_seconds()
+
+    # only the serial timeloop is compiled ahead of time
+    compiled = 'jit'
+    if args.backend == 'jax':
+        compiled = 'xla'
+    elif args.backend in ('numpy', 'cupy'):
+        compiled = 'none' if args.backend == 'numpy' else 'cupy'
+    elif decomp is None and jac is None and not solver.parallel:
+        compiled = kernels.source()
+
+    # memory allocated by the jitted code is only tracked if numba is run
+    # with NUMBA_NRT_STATS=1
+    if numba.config.NRT_STATS:
+        allocs = nrt_allocations()
 
-    # set dirichlet boundary conditions to 0 all around
-    bndN  = np.zeros(nx)
-    bndS  = np.zeros(nx)
-    bndE  = np.zeros(ny)
-    bndW  = np.zeros(ny)
-    boundary = Boundary(bndN, bndS, bndE, bndW)
+    timespent = datetime.now()
 
-    # set the initial condition
-    # a circle of concentration 0.1 centred at (xdim/4, ydim/4) with radius
-    # no larger than 1/8 of both xdim and ydim
-    xspace = np.linspace(0, 1, nx)
-    yspace = np.linspace(0, 1, ny)
-    X, Y = np.meshgrid(xspace, yspace, indexing='ij')
+    status = NewtonStatus(x, True, first - 1, 0, 0, 0,
+                          linalg.CGStatus(True, 0, 0.))
+    simulated = 0.
+    rejected = 0
+    dts = []
+    if args.adaptive:
+        # with --checkpoint-every, a snapshot is written every K accepted
+        # timesteps
+        for step in adaptive_timeloop(advance, x, ws, options, t):
+            status = step.status
+            iters_cg += status.iters_cg
+            iters_newton += status.iters_newton
+            iters_refine += status.iters_refine
+            rejected += step.retries
+            if not status.converged:
+                break
 
-    xc = 1.0 / 4.0
-    yc = (ny - 1) * dx / 4
-    radius = min(xc, yc) / 2.0
-    x = x.reshape((nx, ny))
-    x[(X - xc) ** 2 + (Y - yc) ** 2 < radius * radius] = 0.1
+            simulated = step.time
+            dts.append(step.dt)
+            if writer is not None and status.timestep % chunk == 0:
+                writer.write(status.timestep, x)
+    else:
+        for step in range(first, nt+1, chunk):
+            status = advance(options, step, min(step + chunk - 1, nt))
+            iters_cg += status.iters_cg
+            iters_newton += status.iters_newton
+            iters_refine += status.iters_refine
+            if not status.converged:
+                break
 
-    # restore x_new's shape
-    x = x.flatten()
+            if writer is not None:
+                writer.write(status.timestep, x)
 
-    flops_bc = 0
-    flops_diff = 0
-    flops_blas1 = 0
-    iters_cg = 0
-    iters_newton = 0
-    timespent = datetime.now()
+        dts = [dt] * (status.timestep - first + status.converged)
+        simulated = len(dts) * dt
+
+    if writer is not None:
+        writer.close()
 
-    status = timeloop(
-        x, boundary, options, max_cg_iters, max_newton_iters, tolerance
-    )
     if not status.converged:
         cg_status = status.status_cg
         if not cg_status.converged:
@@ -191,12 +693,106 @@ def main():
     timespent = (datetime.now() - timespent).total_seconds()
     print('----------------------------------------'
           '----------------------------------------')
+    print(f'startup took {startup} seconds')
+    print(f'jit compilation took {timejit} seconds ({compiled})')
     print(f'simulation took {timespent} seconds')
-    print(f'{status.iters_cg} conjugate gradient iterations, at rate of '
-          f'{status.iters_cg/timespent} iters/second')
-    print(f'{status.iters_newton} newton iterations')
+    # with --linear-solver direct, iters_cg counts the direct solves
+    linear = 'conjugate gradient iterations'
+    if args.linear_solver == 'direct':
+        linear = 'sparse direct solves'
+
+    precision = ' in single precision' if solver.mixed else ''
+    print(f'{iters_cg} {linear}{precision}, at rate of '
+          f'{iters_cg/timespent} iters/second')
+    if solver.mixed:
+        print(f'{iters_refine} refinement steps in double precision')
+
+    print(f'{iters_newton} newton iterations')
+    if args.adaptive:
+        print(f'{len(dts)} time steps accepted, {rejected} rejected', end='')
+        if dts:
+            print(f', dt from {min(dts)} to {max(dts)}', end='')
+
+        print()
+    if simulated > 0:
+        print(f'{iters_cg/simulated:.1f} {linear} per unit of simulated '
+              f'time')
+    if writer is not None:
+        print(f'{writer.count} checkpoints, {writer.nbytes/2**20:.1f} MB '
+              f'written in {writer.time_io:.3f} seconds of background I/O, '
+              f'blocking the timeloop for {writer.time_blocked:.3f} seconds')
+    if numba.config.NRT_STATS:
+        allocs = nrt_allocations() - allocs
+        print(f'{allocs} memory allocations in the timeloop '
+              f'(including one per array argument)')
+
+    # time the kernels on their own to split the run into its phases, which
+    # are those of the matrix-free solver, which the jax, numpy and cupy
+    # backends do not count
+    phases = phases_single = None
+    if jac is not None:
+        print(jac.summary())
+    elif args.backend in ('serial', 'parallel'):
+        seconds = perf.calibrate(x, boundary, options, solver, precond, ws)
+        phases = perf.report(ws.counters, seconds, options, solver, precond)
+        if solver.mixed:
+            seconds = perf.calibrate(single.u, single.boundary, options,
+                                     solver, single.precond, single.ws)
+            phases_single = perf.report(single.ws.counters, seconds, options,
+                                        solver, single.precond, itemsize=4)
+
+    if phases is not None:
+        print()
+        if decomp is not None:
+            print(f'performance of rank 0 on its {options.nx} * {options.ny} '
+                  f'sub-grid:')
+
+        if solver.mixed:
+            print('double precision:')
+            perf.print_report(phases)
+            print('single precision:')
+            perf.print_report(phases_single)
+        else:
+            perf.print_report(phases)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'config': {
+                    'nx': nx, 'ny': ny, 'nt': nt, 't': t,
+                    'adaptive': args.adaptive,
+                    'jacobian': args.jacobian, 'precond': args.precond,
+                    'precision': args.precision, 'forcing': args.forcing,
+                    'predictor': args.predictor,
+                    'linear_solver': args.linear_solver,
+                    'backend': args.backend,
+                    'threads': numba.get_num_threads() if solver.parallel else 1,
+                    'affinity': args.affinity,
+                    'ranks': decomp.size if decomp is not None else 1,
+                },
+                'time': {'startup': startup, 'jit': timejit,
+                         'simulation': timespent, 'kernels': compiled},
+                'iterations': {'cg': iters_cg, 'newton': iters_newton,
+                               'refine': iters_refine},
+                'timesteps': {'accepted': len(dts), 'rejected': rejected,
+                              'simulated': simulated},
+                'phases': phases,
+                'phases_single': phases_single,
+            }, f, indent=2)
+
+        print(f'performance report written to "{args.json}"')
+
     print(f'Goodbye!')
 
+    if args.no_plot:
+        return
+
+    if decomp is not None:
+        x = decomp.gather(x, nx, ny)
+        if decomp.rank != 0:
+            return
+
+    # imported here, which takes a while, only when there is something to plot
+    import matplotlib
     if 'DISPLAY' not in os.environ:
         matplotlib.use('Agg')
 
@@ -209,6 +805,8 @@ def main():
     outfile = f'output_{nx}x{ny}_t={t}_steps={nt}.png'
 
     print(f'generating solution figure in "{outfile}" ...')
+    X, Y = np.meshgrid(np.linspace(0, 1, nx), np.linspace(0, 1, ny),
+                       indexing='ij')
     ax.contourf(X, Y, x.reshape((nx, ny)), V, alpha=.75, cmap='jet')
     ax.axes.set_aspect('equal')
     fig.savefig(outfile, dpi=72)
@@ -218,4 +816,9 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    # run main() of the module main rather than of __main__: jitted functions
+    # of __main__, and those called with its namedtuples, are compiled anew
+    # on every run instead of being loaded from the cache
+    import main as _main
+
+    _main.main(STARTED)
@@ -7,6 +7,18 @@
 import numba
 import numpy as np
 
+# the parallel stencils distribute blocks of BLOCK_ROWS rows over the
+# threads and sweep each block in tiles of BLOCK_COLS columns, so that the
+# neighbouring rows of a tile stay in cache
+BLOCK_ROWS = 8
+BLOCK_COLS = 512
+
+# start numba's threading layer: jitted functions that call the parallel
+# kernels, such as main.timeloop(), can be loaded from the cache without
+# ever compiling them, which is what would otherwise start it, and then
+# crash on the first call into it
+numba.get_num_threads()
+
 
 @numba.njit(cache=True)
 def diffusion(U, S, x_old, boundary, options):
@@ -72,3 +84,190 @@ def diffusion(U, S, x_old, boundary, options):
     i = iend
     S[i, j] = (-(4. + alpha) * U[i, j] + U[i-1, j] + U[i, j+1] + alpha *
                x_old[i, j] + bndE[j] + bndS[i] + dxs * U[i, j] * (1.0 - U[i, j]))
+
+
+@numba.njit(cache=True)
+def jacobian_apply(V, S, U, options):
+    # S = J(U)*V, where J(U) is the exact Jacobian of diffusion() at U
+    #
+    # the Dirichlet boundary values and the alpha*x_old term do not depend on
+    # U, so they drop out and V is taken to be zero outside the domain
+    #
+    # the diagonal -(4+alpha) + dxs*(1-2U) = c0 - c1*U is computed in the
+    # precision of U, so that single precision grids are not promoted
+    dxs = 1000. * options.dx * options.dx
+    c0 = U.dtype.type(dxs - (4. + options.alpha))
+    c1 = U.dtype.type(2. * dxs)
+    nx = options.nx
+    ny = options.ny
+    iend  = nx - 1
+    jend  = ny - 1
+
+    U = U.reshape((nx, ny))
+    V = V.reshape((nx, ny))
+    S = S.reshape((nx, ny))
+
+    # the interior grid points
+    for i in range(1, iend):
+        for j in range(1, jend):
+            S[i, j] = ((c0 - c1*U[i, j])*V[i, j] +
+                       V[i-1, j] + V[i+1, j] + V[i, j-1] + V[i, j+1])
+
+    # the west and east boundaries, including the corners
+    for i in (0, iend):
+        for j in range(ny):
+            S[i, j] = _jacobian_point(V, U, i, j, iend, jend, c0, c1)
+
+    # the south and north boundaries
+    for j in (0, jend):
+        for i in range(1, iend):
+            S[i, j] = _jacobian_point(V, U, i, j, iend, jend, c0, c1)
+
+
+@numba.njit(cache=True)
+def _jacobian_point(V, U, i, j, iend, jend, c0, c1):
+    s = (c0 - c1*U[i, j])*V[i, j]
+    if i > 0:
+        s += V[i-1, j]
+
+    if i < iend:
+        s += V[i+1, j]
+
+    if j > 0:
+        s += V[i, j-1]
+
+    if j < jend:
+        s += V[i, j+1]
+
+    return s
+
+
+@numba.njit(cache=True, parallel=True)
+def diffusion_parallel(U, S, x_old, boundary, options):
+    # multithreaded version of diffusion() with the boundary conditions
+    # fused into the sweep over the grid
+    dxs = 1000. * options.dx * options.dx
+    alpha = options.alpha
+    nx = options.nx
+    ny = options.ny
+    bndN = boundary.north
+    bndS = boundary.south
+    bndE = boundary.east
+    bndW = boundary.west
+    iend  = nx - 1
+    jend  = ny - 1
+
+    x_old = x_old.reshape((nx, ny))
+    U = U.reshape((nx, ny))
+    S = S.reshape((nx, ny))
+
+    nblocks = (nx + BLOCK_ROWS - 1) // BLOCK_ROWS
+    for ib in numba.prange(nblocks):
+        ibegin = ib * BLOCK_ROWS
+        istop = min(ibegin + BLOCK_ROWS, nx)
+        for jbegin in range(0, ny, BLOCK_COLS):
+            jstop = min(jbegin + BLOCK_COLS, ny)
+            for i in range(ibegin, istop):
+                # the neighbouring rows are the boundaries at the west and
+                # east edges of the grid
+                Uw = U[i-1] if i > 0 else bndW
+                Ue = U[i+1] if i < iend else bndE
+                Ui = U[i]
+                Si = S[i]
+                Xi = x_old[i]
+                for j in range(max(jbegin, 1), min(jstop, jend)):
+                    Si[j] = (-(4. + alpha)*Ui[j] + Uw[j] + Ue[j] + Ui[j-1] +
+                             Ui[j+1] + alpha*Xi[j] + dxs*Ui[j]*(1 - Ui[j]))
+
+                # the south boundary
+                if jbegin == 0:
+                    j = 0
+                    Si[j] = (-(4. + alpha)*Ui[j] + Uw[j] + Ue[j] + bndS[i] +
+                             Ui[j+1] + alpha*Xi[j] + dxs*Ui[j]*(1 - Ui[j]))
+
+                # the north boundary
+                if jstop == ny:
+                    j = jend
+                    Si[j] = (-(4. + alpha)*Ui[j] + Uw[j] + Ue[j] + Ui[j-1] +
+                             bndN[i] + alpha*Xi[j] + dxs*Ui[j]*(1 - Ui[j]))
+
+
+@numba.njit(cache=True, parallel=True)
+def jacobian_apply_parallel(V, S, U, options):
+    # multithreaded version of jacobian_apply()
+    dxs = 1000. * options.dx * options.dx
+    c0 = U.dtype.type(dxs - (4. + options.alpha))
+    c1 = U.dtype.type(2. * dxs)
+    zero = U.dtype.type(0.)
+    one = U.dtype.type(1.)
+    nx = options.nx
+    ny = options.ny
+    iend  = nx - 1
+    jend  = ny - 1
+
+    U = U.reshape((nx, ny))
+    V = V.reshape((nx, ny))
+    S = S.reshape((nx, ny))
+
+    nblocks = (nx + BLOCK_ROWS - 1) // BLOCK_ROWS
+    for ib in numba.prange(nblocks):
+        ibegin = ib * BLOCK_ROWS
+        istop = min(ibegin + BLOCK_ROWS, nx)
+        for jbegin in range(0, ny, BLOCK_COLS):
+            jstop = min(jbegin + BLOCK_COLS, ny)
+            for i in range(ibegin, istop):
+                # V is zero outside the domain, so the neighbouring rows at
+                # the west and east edges are masked out
+                cw = one if i > 0 else zero
+                ce = one if i < iend else zero
+                Vw = V[max(i-1, 0)]
+                Ve = V[min(i+1, iend)]
+                Ui = U[i]
+                Vi = V[i]
+                Si = S[i]
+                for j in range(max(jbegin, 1), min(jstop, jend)):
+                    Si[j] = ((c0 - c1*Ui[j])*Vi[j] +
+                             cw*Vw[j] + ce*Ve[j] + Vi[j-1] + Vi[j+1])
+
+                # the south boundary
+                if jbegin == 0:
+                    j = 0
+                    Si[j] = ((c0 - c1*Ui[j])*Vi[j] +
+                             cw*Vw[j] + ce*Ve[j] + Vi[j+1])
+
+                # the north boundary
+                if jstop == ny:
+                    j = jend
+                    Si[j] = ((c0 - c1*Ui[j])*Vi[j] +
+                             cw*Vw[j] + ce*Ve[j] + Vi[j-1])
+
+
+@numba.njit(cache=True, parallel=True)
+def first_touch(U, nx, ny):
+    # zero the nx*ny grid U in the blocks of rows of the parallel stencils,
+    # on the threads that sweep them; the vector operations of linalg split
+    # the grid into as many contiguous parts as there are threads, which
+    # are about the same
+    U = U.reshape((nx, ny))
+    zero = U.dtype.type(0.)
+    nblocks = (nx + BLOCK_ROWS - 1) // BLOCK_ROWS
+    for ib in numba.prange(nblocks):
+        for i in range(ib * BLOCK_ROWS, min((ib + 1) * BLOCK_ROWS, nx)):
+            for j in range(ny):
+                U[i, j] = zero
+
+
+@numba.njit(cache=True)
+def add_halo(S, halo, options):
+    # add the contribution of the values of V outside the domain to
+    # S = J(U)*V, which jacobian_apply() computes with V zero there
+    nx = options.nx
+    ny = options.ny
+    S = S.reshape((nx, ny))
+    for j in range(ny):
+        S[0, j] += halo.west[j]
+        S[nx-1, j] += halo.east[j]
+
+    for i in range(nx):
+        S[i, 0] += halo.south[i]
+        S[i, ny-1] += halo.north[i]
@@ -0,0 +1,160 @@
+#
+# Performance accounting for the miniapp
+#
+# The jitted code counts the operations it performs in Workspace.counters.
+# The time of one operation is measured afterwards by timing its kernel on
+# its own on the same grid, and combined with the counts and with the
+# floating point operations and memory traffic per grid point of each
+# kernel, as read off their source, into rates per phase of the solver.
+
+import time
+
+import numpy as np
+
+import kernels
+import linalg
+
+# the phases of the report and the counters they consist of
+PHASES = {
+    'newton residual': [linalg.COUNT_RESIDUAL],
+    'stencil': [linalg.COUNT_STENCIL],
+    'preconditioner': [linalg.COUNT_PRECOND, linalg.COUNT_PRECOND_SETUP],
+    'blas1': [linalg.COUNT_DOT, linalg.COUNT_WAXPBY, linalg.COUNT_CG_UPDATE,
+              linalg.COUNT_COPY],
+}
+
+# flops and bytes of memory traffic per grid point of the kernels, counting
+# every array as streamed once from memory and in double precision
+COST = {
+    linalg.COUNT_RESIDUAL: (13, 32),
+    linalg.COUNT_DOT: (2, 16),
+    linalg.COUNT_WAXPBY: (3, 24),
+    linalg.COUNT_CG_UPDATE: (6, 48),
+    linalg.COUNT_COPY: (0, 16),
+    linalg.COUNT_PRECOND_SETUP: (4, 16),
+}
+
+STENCIL_COST = {
+    linalg.JACOBIAN_EXACT: (9, 24),
+    # two waxpby() and one diffusion()
+    linalg.JACOBIAN_FD: (17, 72),
+}
+
+PRECOND_COST = {
+    linalg.PRECOND_NONE: (0, 16),
+    linalg.PRECOND_JACOBI: (1, 24),
+    linalg.PRECOND_SSOR: (12, 64),
+}
+
+
+def multigrid_cost(precond):
+    # flops and bytes per fine grid point of one V-cycle
+    #
+    # per point of a level: a Gauss-Seidel sweep is 7 flops and 32 bytes,
+    # the residual 8 flops and 32 bytes, and restriction and prolongation
+    # together about 10 flops and 24 bytes
+    n = precond.nx * precond.ny
+    sweeps = np.full(len(n), 2*linalg.MG_SMOOTH)
+    sweeps[-1] = 2*linalg.MG_COARSE_SWEEPS
+    flops = 7*sweeps*n
+    nbytes = 32*sweeps*n
+    flops[:-1] += 18*n[:-1]
+    nbytes[:-1] += 56*n[:-1]
+
+    # copying the right hand side in and the result out
+    return flops.sum() / n[0], (nbytes.sum() + 32*n[0]) / n[0]
+
+
+def cost(counter, solver, precond):
+    if counter == linalg.COUNT_STENCIL:
+        return STENCIL_COST[solver.jacobian]
+
+    if counter == linalg.COUNT_PRECOND:
+        if precond.kind == linalg.PRECOND_MG:
+            return multigrid_cost(precond)
+
+        return PRECOND_COST[precond.kind]
+
+    return COST[counter]
+
+
+def calibrate(x, boundary, options, solver, precond, ws, reps=10):
+    # seconds per call of the kernel of every counter, timed on the scratch
+    # vectors of the workspace so that the solution is left untouched
+    #
+    # the kernels are the ahead-of-time compiled ones if they have been
+    # built, which only cover double precision runs on the serial backend
+    parallel = solver.parallel
+    jit = parallel or x.dtype != np.float64
+    diffusion, matvec, precond_apply, precond_update, dot, waxpby, \
+        cg_update, copy = (kernels.get(fn, jit) for fn in (
+            linalg.diffusion, linalg.matvec, linalg.precond_apply,
+            linalg.precond_update, linalg.dot, linalg.waxpby,
+            linalg.cg_update, linalg.copy
+        ))
+    x_old = ws.x_old
+    timed = {
+        linalg.COUNT_RESIDUAL: lambda: (
+            diffusion(x, ws.v, x_old, boundary, options, parallel),
+            dot(ws.v, ws.v, parallel)
+        ),
+        linalg.COUNT_STENCIL: lambda: matvec(
+            ws.p, ws.Ap, x, x_old, boundary, options, solver.jacobian, ws,
+            parallel
+        ),
+        linalg.COUNT_PRECOND: lambda: precond_apply(precond, ws.r, ws.z),
+        linalg.COUNT_PRECOND_SETUP: lambda: precond_update(precond, x,
+                                                           options),
+        linalg.COUNT_DOT: lambda: dot(ws.r, ws.z, parallel),
+        linalg.COUNT_WAXPBY: lambda: waxpby(ws.v, 1., ws.r, 1., ws.z,
+                                            parallel),
+        linalg.COUNT_CG_UPDATE: lambda: cg_update(ws.v, ws.Ap, ws.p, ws.r,
+                                                  0., parallel),
+        linalg.COUNT_COPY: lambda: copy(ws.v, ws.r),
+    }
+
+    seconds = {}
+    for counter, kernel in timed.items():
+        kernel()
+        start = time.perf_counter()
+        for _ in range(reps):
+            kernel()
+
+        seconds[counter] = (time.perf_counter() - start) / reps
+
+    return seconds
+
+
+def report(counters, seconds, options, solver, precond, itemsize=8):
+    # calls, flops, bytes, seconds and rates of every phase, of kernels on
+    # floating point numbers of itemsize bytes
+    phases = {}
+    for phase, members in PHASES.items():
+        calls = flops = nbytes = secs = 0
+        for counter in members:
+            n = int(counters[counter])
+            f, b = cost(counter, solver, precond)
+            calls += n
+            flops += n * f * options.N
+            nbytes += n * b * options.N * itemsize / 8
+            secs += n * seconds[counter]
+
+        phases[phase] = {
+            'calls': calls,
+            'flops': float(flops),
+            'bytes': float(nbytes),
+            'seconds': secs,
+            'gflops': flops / secs * 1.e-9 if secs else 0.,
+            'gbytes': nbytes / secs * 1.e-9 if secs else 0.,
+        }
+
+    return phases
+
+
+def print_report(phases, file=None):
+    print(f'{"phase":<16} {"calls":>10} {"GFLOP":>10} {"GB":>10} '
+          f'{"seconds":>10} {"GFLOP/s":>10} {"GB/s":>10}', file=file)
+    for phase, p in phases.items():
+        print(f'{phase:<16} {p["calls"]:>10} {p["flops"]*1.e-9:>10.3f} '
+              f'{p["bytes"]*1.e-9:>10.3f} {p["seconds"]:>10.3f} '
+              f'{p["gflops"]:>10.3f} {p["gbytes"]:>10.3f}', file=file)
@@ -0,0 +1,359 @@
+#
+# Parameter sweeps of the miniapp
+#
+#   python sweep.py configs.json -o results.jsonl --workers 8
+#   python sweep.py configs.json -o results.jsonl --workers 8 --resume
+#
+# Runs every configuration of configs.json, a list of objects such as
+#
+#   [{"nx": 128, "ny": 128, "nt": 100, "t": 0.01},
+#    {"nx": 256, "ny": 256, "nt": 200, "t": 0.01, "precond": "mg"}]
+#
+# or one such object per line, with the solver options of main.py that are
+# not given set to their defaults, see DEFAULTS. Unlike ensemble.py, the
+# configurations do not have to share a grid.
+#
+# The runs are handed out to a pool of worker processes, which each run one
+# configuration at a time with the serial backend. The jitted code is
+# compiled into the numba cache once, before the workers start, so that
+# every worker only loads it from the cache, once, for all of its runs.
+# The runs are started from the largest estimated cost nx*ny*nt down, so
+# that the big runs do not end up last, on a single worker, while the others
+# are idle.
+#
+# Every run is appended to the output as a line of JSON as soon as it has
+# finished. With --resume, the runs already in the output are skipped, so
+# that a sweep that was interrupted can be completed; runs that raised an
+# error are run again.
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+import kernels
+import main
+
+# the options of a configuration besides nx, ny, nt and t, with their
+# defaults, which are those of main.py
+DEFAULTS = {
+    'adaptive': False,
+    'jacobian': 'exact',
+    'precond': 'none',
+    'precision': 'double',
+    'forcing': 'fixed',
+    'predictor': 'none',
+    'linear_solver': 'matrix-free',
+}
+
+CHOICES = {
+    'jacobian': main.JACOBIANS,
+    'precond': main.PRECONDITIONERS,
+    'precision': ['double', 'mixed'],
+    'forcing': main.FORCINGS,
+    'predictor': main.PREDICTORS,
+    'linear_solver': main.LINEAR_SOLVERS,
+}
+
+
+def configuration(config):
+    # config with the defaults filled in, checked as main.py checks its
+    # arguments
+    unknown = set(config) - {'nx', 'ny', 'nt', 't'} - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f'unknown options: {", ".join(sorted(unknown))}')
+
+    config = {**DEFAULTS, **config}
+    for name, fn in [('nx', int), ('ny', int), ('nt', int), ('t', float)]:
+        if name not in config:
+            raise ValueError(f'{name} is missing')
+
+        config[name] = main.positive(fn)(config[name])
+
+    config['adaptive'] = bool(config['adaptive'])
+    for name, choices in CHOICES.items():
+        if config[name] not in choices:
+            raise ValueError(f'invalid {name}: {config[name]}')
+
+    if config['precision'] == 'mixed' and config['jacobian'] != 'exact':
+        raise ValueError('precision mixed needs the exact jacobian')
+
+    if config['linear_solver'] != 'matrix-free':
+        if config['jacobian'] != 'exact':
+            raise ValueError(f'linear_solver {config["linear_solver"]} '
+                             f'needs the exact jacobian')
+        if config['precision'] != 'double':
+            raise ValueError(f'linear_solver {config["linear_solver"]} '
+                             f'needs double precision')
+
+    return config
+
+
+def key(config):
+    # what identifies a run in the output
+    return json.dumps(configuration(config), sort_keys=True)
+
+
+def cost(config):
+    return config['nx'] * config['ny'] * config['nt']
+
+
+def read_configs(path):
+    # the configurations of path, a JSON list or one object per line
+    with open(path) as f:
+        text = f.read()
+
+    try:
+        configs = json.loads(text)
+    except json.JSONDecodeError:
+        configs = [json.loads(line) for line in text.splitlines()
+                   if line.strip()]
+
+    if isinstance(configs, dict):
+        configs = [configs]
+
+    return configs
+
+
+def read_results(path):
+    # the results in the output path of an earlier sweep; a line cut short
+    # by an interrupted sweep is left out
+    results = []
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    results.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass
+    except FileNotFoundError:
+        pass
+
+    return results
+
+
+def run(config):
+    # run the configuration and return its result; called in the workers
+    start = time.perf_counter()
+    problem = main.setup(config['nx'], config['ny'], config['nt'],
+                         config['t'], config['jacobian'], config['precond'],
+                         precision=config['precision'],
+                         forcing=config['forcing'],
+                         predictor=config['predictor'])
+
+    jac = None
+    if config['linear_solver'] != 'matrix-free':
+        # imported here, so that scipy is only needed for the assembled
+        # Jacobian
+        import assembled
+
+        jac = assembled.Assembled(problem.options, config['linear_solver'])
+
+    def advance(options, first, last):
+        if jac is not None:
+            return main.NewtonStatus(*assembled.timeloop(
+                *problem._replace(options=options), first, last, jac
+            ))
+
+        timeloop = kernels.get(main.timeloop)
+        return main.NewtonStatus(*timeloop(*problem._replace(options=options),
+                                           first, last))
+
+    options = problem.options
+    iters_cg = iters_newton = iters_refine = 0
+    simulated = 0.
+    if config['adaptive']:
+        steps = main.adaptive_timeloop(advance, problem.x, problem.ws,
+                                       options, config['t'])
+    else:
+        steps = [advance(options, 1, config['nt'])]
+
+    for step in steps:
+        status = step.status if config['adaptive'] else step
+        iters_cg += status.iters_cg
+        iters_newton += status.iters_newton
+        iters_refine += status.iters_refine
+        if status.converged:
+            simulated = (step.time if config['adaptive'] else
+                         status.timestep * options.dt)
+
+    seconds = time.perf_counter() - start
+    x = problem.x
+    return {
+        'config': config,
+        'converged': bool(status.converged),
+        'timestep': int(status.timestep),
+        'simulated': simulated,
+        'iterations': {'cg': iters_cg, 'newton': iters_newton,
+                       'refine': iters_refine},
+        'seconds': seconds,
+        'solution': {'min': float(x.min()), 'max': float(x.max()),
+                     'mean': float(np.mean(x))},
+        'pid': os.getpid(),
+    }
+
+
+def options(config):
+    # the solver options of a configuration that the jitted code depends on
+    return tuple(config[name] for name in DEFAULTS if name != 'adaptive')
+
+
+def warm_up(configs):
+    # compile the jitted code of the configurations into the numba cache,
+    # once for every combination of the options, on a small grid; returns
+    # the errors raised by the combinations that failed, which the workers
+    # would raise as well
+    errors = {}
+    done = set()
+    for config in configs:
+        if options(config) not in done:
+            try:
+                run({**config, 'nx': 8, 'ny': 8, 'nt': 1, 'adaptive': False})
+            except Exception as e:
+                errors[options(config)] = e
+
+            done.add(options(config))
+
+    return errors
+
+
+def sweep(configs, output, workers):
+    # run the configurations on `workers` processes, appending their
+    # results to output as they finish
+    configs = sorted(configs, key=cost, reverse=True)
+    total = len(configs)
+
+    # the workers are spawned rather than forked, which is not safe with
+    # the threading layer of numba running in this process
+    context = multiprocessing.get_context('spawn')
+    start = time.perf_counter()
+    failed = errors = 0
+    with open(output, 'a') as f, concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=context) as pool:
+        # the workers take the runs in the order of submission
+        futures = {pool.submit(run, config): config for config in configs}
+        for done, future in enumerate(
+                concurrent.futures.as_completed(futures), start=1):
+            config = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'config': config, 'error': repr(e)}
+                errors += 1
+                outcome = f'error: {e!r}'
+            else:
+                failed += not result['converged']
+                outcome = (f'{result["seconds"]:.3f} seconds, '
+                           f'{result["iterations"]["cg"]} CG iterations' +
+                           ('' if result['converged'] else ', FAILED'))
+
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+            print(f'[{done}/{total}] {config["nx"]} * {config["ny"]}, '
+                  f'{config["nt"]} steps to {config["t"]}: {outcome}')
+
+    return time.perf_counter() - start, failed, errors
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Run a sweep of miniapp configurations on a pool of '
+                    'processes'
+    )
+    parser.add_argument('configs',
+                        help='JSON file of the configurations, a list of '
+                             'objects with nx, ny, nt, t and optionally '
+                             f'{", ".join(DEFAULTS)}, or one per line')
+    parser.add_argument('-o', '--output', required=True,
+                        help='JSON lines file the results are appended to')
+    parser.add_argument('--workers', type=main.positive(int),
+                        default=len(os.sched_getaffinity(0)),
+                        help='number of worker processes (default: number '
+                             'of CPUs)')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the configurations that already have a '
+                             'result in the output')
+    args = parser.parse_args()
+
+    try:
+        args.configs = [configuration(config)
+                        for config in read_configs(args.configs)]
+    except (OSError, ValueError, TypeError) as e:
+        parser.error(f'{args.configs}: {e}')
+
+    if not args.resume and os.path.exists(args.output):
+        parser.error(f'{args.output} exists; use --resume to complete the '
+                     f'sweep in it')
+
+    return args
+
+
+def _main():
+    args = parse_args()
+    configs = args.configs
+    if args.resume:
+        finished = {key(result['config'])
+                    for result in read_results(args.output)
+                    if 'error' not in result}
+        configs = [config for config in configs
+                   if key(config) not in finished]
+        print(f'{len(args.configs) - len(configs)} of {len(args.configs)} '
+              f'runs already in "{args.output}"')
+
+        # a line cut short by the interruption is ended, so that the
+        # results that follow are on lines of their own
+        if os.path.exists(args.output) and os.path.getsize(args.output):
+            with open(args.output, 'rb+') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+
+    if not configs:
+        return
+
+    start = time.perf_counter()
+    warm_errors = warm_up(configs)
+    warm = time.perf_counter() - start
+
+    # the configurations whose options failed to run are recorded as errors
+    # as the workers record theirs, rather than run
+    broken = [config for config in configs if options(config) in warm_errors]
+    configs = [config for config in configs
+               if options(config) not in warm_errors]
+    with open(args.output, 'a') as f:
+        for config in broken:
+            e = warm_errors[options(config)]
+            f.write(json.dumps({'config': config, 'error': repr(e)}) + '\n')
+            print(f'{config["nx"]} * {config["ny"]}, {config["nt"]} steps '
+                  f'to {config["t"]}: error: {e!r}')
+
+    failed, errors = 0, len(broken)
+    if configs:
+        workers = min(args.workers, len(configs))
+        print(f'{len(configs)} runs on {workers} workers, '
+              f'jit compilation took {warm:.3f} seconds')
+        seconds, failed, sweep_errors = sweep(configs, args.output, workers)
+        errors += sweep_errors
+        print(f'sweep took {seconds:.3f} seconds, '
+              f'{len(configs)/seconds:.2f} runs/second')
+
+    if failed:
+        print(f'{failed} runs failed to converge')
+    if errors:
+        print(f'{errors} runs raised an error; run again with --resume to '
+              f'retry them', file=sys.stderr)
+
+    print(f'results written to "{args.output}"')
+
+
+if __name__ == '__main__':
+    # as in main.py, the workers have to find run() in the module sweep
+    # rather than in __main__
+    import sweep as _sweep
+
+    _sweep._main()
@@ -0,0 +1,46 @@
+import numpy as np
+
+import main
+import operators
+import vectorized
+
+
+nx, ny, nt, t = 64, 48, 20, 0.01
+
+rng = np.random.default_rng()
+problem = main.setup(nx, ny, nt, t)
+options = problem.options
+boundary = main.Boundary(rng.random(nx), rng.random(nx), rng.random(ny),
+                         rng.random(ny))
+U = rng.random(nx * ny)
+V = rng.random(nx * ny)
+x_old = rng.random(nx * ny)
+
+# the stencil and the Jacobian, with non-zero boundaries, compared to the
+# numba kernels of operators.py
+S = np.empty(nx * ny)
+operators.diffusion(U, S, x_old, boundary, options)
+S_vec = vectorized.diffusion(U, x_old, boundary, options)
+S_numba = vectorized.numba_diffusion(U, x_old, boundary, options)
+print(f'diffusion            diff : {np.abs(S_vec - S).max():.2e}')
+print(f'numba_diffusion      diff : {np.abs(S_numba - S).max():.2e}')
+
+J = np.empty(nx * ny)
+operators.jacobian_apply(V, J, U, options)
+J_vec = vectorized.jacobian_apply(V, U, options)
+J_numba = vectorized.numba_jacobian_apply(V, U, options)
+print(f'jacobian_apply       diff : {np.abs(J_vec - J).max():.2e}')
+print(f'numba_jacobian_apply diff : {np.abs(J_numba - J).max():.2e}')
+
+# the timeloop, compared to that of main.py from the same initial condition
+status = main.NewtonStatus(*main.timeloop(*problem, 1, nt))
+print(f'\nmain.timeloop              : {status.iters_newton} Newton, '
+      f'{status.iters_cg} CG iterations')
+
+for numba_kernels in (False, True):
+    p = main.setup(nx, ny, nt, t)
+    s = vectorized.timeloop(*p, 1, nt, np, numba_kernels)
+    name = 'numba kernels' if numba_kernels else 'vectorized'
+    print(f'vectorized.timeloop ({name:13s}) : {s.iters_newton} Newton, '
+          f'{s.iters_cg} CG iterations, converged {s.converged}, '
+          f'diff {np.abs(p.x - problem.x).max():.2e}')
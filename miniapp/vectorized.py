@@ -0,0 +1,196 @@
+#
+# Vectorized miniapp solver on any array library
+#
+# operators.diffusion(), operators.jacobian_apply(), linalg.cg() and the
+# Newton timeloop of main.timeloop() written with whole-array operations of
+# the Python array API standard, without loops over the grid, so that the
+# same code runs on NumPy arrays on the CPU and on CuPy arrays on the GPU.
+# The functions take the namespace of the array library from the arrays
+# they are given, see namespace(); the stencils build the grid padded with
+# its boundary by concatenation rather than by assignment to slices, which
+# the standard leaves to the libraries.
+#
+# Each whole-array operation makes a pass over memory and a temporary, where
+# the numba loops make one pass for a whole stencil, which is what
+# `python benchmark.py backends` measures.
+#
+# host() hands an array in host memory to the numba kernels without copying
+# it, through DLPack: with numba_kernels=True, timeloop() runs the stencil
+# and the Jacobian by operators.diffusion() and operators.jacobian_apply()
+# on host() views of the arrays of the library, NumPy or any other that
+# exports host arrays by DLPack, and only the vector operations of CG and
+# Newton by the library. The solution is copied back into the NumPy array
+# of main.py through host() as well, which the checkpoints and the plot
+# read.
+
+import importlib
+import math
+
+import numpy as np
+
+import linalg
+import main
+import operators
+
+
+def array_module(name):
+    # the array library of the backend name of main.py
+    return importlib.import_module(name)
+
+
+def namespace(x):
+    # the array API namespace of the array x
+    return x.__array_namespace__()
+
+
+def host(x):
+    # x as a NumPy array, which shares its memory if x is in host memory and
+    # is a copy otherwise
+    return np.from_dlpack(x, device='cpu')
+
+
+def _pad(U, north, south, east, west, xp):
+    # the (nx+2, ny+2) grid U surrounded by the boundary values, with the
+    # corners, which no stencil reads, set to 0
+    zero = xp.zeros((1,), dtype=U.dtype)
+    inner = xp.concat([xp.expand_dims(south, axis=1), U,
+                       xp.expand_dims(north, axis=1)], axis=1)
+    return xp.concat([xp.expand_dims(xp.concat([zero, west, zero]), axis=0),
+                      inner,
+                      xp.expand_dims(xp.concat([zero, east, zero]), axis=0)],
+                     axis=0)
+
+
+def diffusion(U, x_old, boundary, options):
+    # operators.diffusion() at U, as a new array
+    xp = namespace(U)
+    nx, ny = options.nx, options.ny
+    dxs = 1000. * options.dx * options.dx
+    alpha = options.alpha
+
+    U = xp.reshape(U, (nx, ny))
+    P = _pad(U, boundary.north, boundary.south, boundary.east,
+             boundary.west, xp)
+    S = (-(4. + alpha)*U + P[:-2, 1:-1] + P[2:, 1:-1] + P[1:-1, :-2] +
+         P[1:-1, 2:] + alpha*xp.reshape(x_old, (nx, ny)) + dxs*U*(1. - U))
+    return xp.reshape(S, (nx*ny,))
+
+
+def jacobian_apply(V, U, options):
+    # operators.jacobian_apply(), J(U)*V as a new array
+    xp = namespace(U)
+    nx, ny = options.nx, options.ny
+    dxs = 1000. * options.dx * options.dx
+    c0 = dxs - (4. + options.alpha)
+
+    V = xp.reshape(V, (nx, ny))
+    zx = xp.zeros((nx,), dtype=V.dtype)
+    zy = xp.zeros((ny,), dtype=V.dtype)
+    P = _pad(V, zx, zx, zy, zy, xp)
+    S = ((c0 - 2.*dxs*xp.reshape(U, (nx, ny)))*V + P[:-2, 1:-1] +
+         P[2:, 1:-1] + P[1:-1, :-2] + P[1:-1, 2:])
+    return xp.reshape(S, (nx*ny,))
+
+
+def numba_diffusion(U, x_old, boundary, options):
+    # diffusion() by the numba kernel of operators.diffusion(), reading U,
+    # x_old and the boundary through host() views and writing into a new
+    # host array, which is handed back to the library of U
+    S = np.empty(options.N, dtype=U.dtype)
+    operators.diffusion(host(U), S, host(x_old),
+                        main.Boundary(*(host(b) for b in boundary)), options)
+    return namespace(U).asarray(S)
+
+
+def numba_jacobian_apply(V, U, options):
+    # jacobian_apply() by the numba kernel of operators.jacobian_apply()
+    S = np.empty(options.N, dtype=U.dtype)
+    operators.jacobian_apply(host(V), S, host(U), options)
+    return namespace(U).asarray(S)
+
+
+def cg(x, u, b, options, tolerance, maxiters, jacobian_apply=jacobian_apply):
+    # linalg.cg() without preconditioner, solving J(u)*x = b from the
+    # initial guess x; returns the solution and a linalg.CGStatus
+    #
+    # the residuals are brought to the host for the convergence test, which
+    # waits for the GPU once per iteration
+    r = b - jacobian_apply(x, u, options)
+    rold = float(r @ r)
+    if math.sqrt(rold) < tolerance:
+        return x, linalg.CGStatus(True, 0, math.sqrt(rold))
+
+    p = r
+    for it in range(1, maxiters + 1):
+        Ap = jacobian_apply(p, u, options)
+        alpha = rold / float(p @ Ap)
+        x = x + alpha*p
+        r = r - alpha*Ap
+        rnew = float(r @ r)
+
+        residual = math.sqrt(rnew)
+        if residual < tolerance:
+            return x, linalg.CGStatus(True, it, residual)
+
+        p = r + (rnew/rold)*p
+        rold = rnew
+
+    return x, linalg.CGStatus(False, it, residual)
+
+
+def timeloop(x, boundary, options, solver, precond, ws, single, first,
+             last, xp=np, numba_kernels=False):
+    # main.timeloop() with the arguments of main.setup(), run on arrays of
+    # the namespace xp; x, ws.x_old and ws.deltax are updated in place, as
+    # the next call and main.adaptive_timeloop() expect, and precond and
+    # single are not used
+    #
+    # with numba_kernels, the stencil and the Jacobian are run by the numba
+    # kernels on host() views of the arrays, see numba_diffusion()
+    #
+    # only the exact Jacobian, without preconditioner, with fixed forcing
+    # and without predictor is implemented
+    if numba_kernels:
+        stencil, apply = numba_diffusion, numba_jacobian_apply
+    else:
+        stencil, apply = diffusion, jacobian_apply
+
+    tolerance = solver.tolerance
+    boundary = main.Boundary(*(xp.asarray(b) for b in boundary))
+    u = xp.asarray(x)
+    u_old = xp.asarray(ws.x_old)
+    deltax = xp.asarray(ws.deltax)
+
+    iters_newton = 0
+    iters_cg = 0
+    converged = True
+    cg_status = linalg.CGStatus(True, 0, 0.)
+
+    timestep = first - 1
+    for timestep in range(first, last+1):
+        u_old = u
+        converged = False
+        for it in range(solver.max_newton_iters):
+            b = stencil(u, u_old, boundary, options)
+            residual = math.sqrt(float(b @ b))
+            if residual < tolerance:
+                converged = True
+                break
+
+            deltax, cg_status = cg(deltax, u, b, options, tolerance,
+                                   solver.max_cg_iters, apply)
+            iters_cg += cg_status.iters
+            if not cg_status.converged:
+                break
+
+            u = u - deltax
+
+        iters_newton += it + 1
+        if not converged:
+            break
+
+    x[:] = host(u)
+    ws.x_old[:] = host(u_old)
+    ws.deltax[:] = host(deltax)
+    return main.NewtonStatus(x, converged, timestep, iters_newton, iters_cg,
+                             0, cg_status)
@@ -0,0 +1,203 @@
+#
+# JAX backend of the miniapp
+#
+# operators.diffusion(), linalg.cg() and the Newton timeloop of
+# main.timeloop() written with jax.numpy and jax.lax, and jitted as one XLA
+# program for all the timesteps of a call:
+#
+#   - the stencil is a sum of shifted slices of the grid padded with the
+#     boundary, which XLA fuses into a single loop over the grid
+#   - the exact Jacobian is the linearization of the stencil at the current
+#     solution by jax.linearize(), rather than a second stencil written by
+#     hand as operators.jacobian_apply()
+#   - the CG, Newton and timestep loops are lax.while_loop()s, so that the
+#     program does not return to Python until the last timestep
+#
+# ensemble_timeloop() advances a batch of problems on grids of the same
+# size at once, with the timeloop vectorized over the batch by jax.vmap().
+#
+# Only the default solver of main.py is implemented: the exact Jacobian, no
+# preconditioner, fixed forcing and no predictor, in double precision.
+
+import collections
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+from jax import lax
+
+import linalg
+import main
+
+# the miniapp is in double precision, which jax only computes in if asked
+jax.config.update('jax_enable_x64', True)
+
+# the parameters of the solver that are passed to the XLA program as values
+# rather than compiled into it
+Solver = collections.namedtuple(
+    'Solver', ['tolerance', 'max_cg_iters', 'max_newton_iters']
+)
+
+
+def diffusion(U, x_old, boundary, dx, alpha):
+    # operators.diffusion() on the (nx, ny) grid U
+    dxs = 1000. * dx * dx
+    P = jnp.pad(U, 1)
+    P = P.at[0, 1:-1].set(boundary.west).at[-1, 1:-1].set(boundary.east)
+    P = P.at[1:-1, 0].set(boundary.south).at[1:-1, -1].set(boundary.north)
+    return (-(4. + alpha)*U + P[:-2, 1:-1] + P[2:, 1:-1] + P[1:-1, :-2] +
+            P[1:-1, 2:] + alpha*x_old + dxs*U*(1. - U))
+
+
+def cg(x, A, b, tolerance, maxiters):
+    # linalg.cg() without preconditioner, for A(x) = b from the initial
+    # guess x; returns x and the fields of a linalg.CGStatus
+    r = b - A(x)
+    rnew = jnp.vdot(r, r)
+
+    def cond(state):
+        x, r, p, rold, it = state
+        return (jnp.sqrt(rold) >= tolerance) & (it < maxiters)
+
+    def body(state):
+        x, r, p, rold, it = state
+        Ap = A(p)
+        alpha = rold / jnp.vdot(p, Ap)
+        x = x + alpha*p
+        r = r - alpha*Ap
+        rnew = jnp.vdot(r, r)
+        p = r + (rnew/rold)*p
+        return x, r, p, rnew, it + 1
+
+    x, _, _, rnew, it = lax.while_loop(cond, body,
+                                       (x, r, r, rnew, jnp.int64(0)))
+    residual = jnp.sqrt(rnew)
+    return x, (residual < tolerance, it, residual)
+
+
+def newton(x, x_old, deltax, boundary, dx, alpha, solver):
+    # the Newton iteration of a timestep from x, with the correction deltax
+    # of the last Newton iteration as the initial guess of CG, as in
+    # main.timeloop(); returns x, deltax, whether it converged, the Newton
+    # and CG iterations, and the fields of the last linalg.CGStatus
+    def F(u):
+        return diffusion(u, x_old, boundary, dx, alpha)
+
+    def cond(state):
+        x, deltax, converged, it, iters_cg, cg_status = state
+        return ~converged & cg_status[0] & (it < solver.max_newton_iters)
+
+    def body(state):
+        x, deltax, converged, it, iters_cg, cg_status = state
+        b, J = jax.linearize(F, x)
+        converged = jnp.sqrt(jnp.vdot(b, b)) < solver.tolerance
+
+        def solve(deltax):
+            deltax, cg_status = cg(deltax, J, b, solver.tolerance,
+                                   solver.max_cg_iters)
+            # x is not corrected by a CG solve that failed
+            return jnp.where(cg_status[0], x - deltax, x), deltax, cg_status
+
+        x, deltax, status = lax.cond(
+            converged, lambda deltax: (x, deltax, cg_status), solve, deltax
+        )
+        iters_cg = iters_cg + jnp.where(converged, 0, status[1])
+        return (x, deltax, converged, it + 1, iters_cg, status)
+
+    cg_status = (jnp.bool_(True), jnp.int64(0), jnp.float64(0.))
+    x, deltax, converged, it, iters_cg, cg_status = lax.while_loop(
+        cond, body,
+        (x, deltax, jnp.bool_(False), jnp.int64(0), jnp.int64(0), cg_status)
+    )
+    return x, deltax, converged, it, iters_cg, cg_status
+
+
+def _timeloop(x, x_old, deltax, boundary, dx, alpha, solver, first, last):
+    # main.timeloop() over the timesteps first..last on the (nx, ny) grid x;
+    # returns x, x_old and deltax, for the next call, and the fields of
+    # main.NewtonStatus after the solution
+    def cond(state):
+        timestep, x, x_old, deltax, converged = state[:5]
+        return converged & (timestep < last)
+
+    def body(state):
+        (timestep, x, _, deltax, _, iters_newton, iters_cg,
+         _) = state
+        x_old = x
+        x, deltax, converged, it, its_cg, cg_status = newton(
+            x, x_old, deltax, boundary, dx, alpha, solver
+        )
+        return (timestep + 1, x, x_old, deltax, converged,
+                iters_newton + it, iters_cg + its_cg, cg_status)
+
+    cg_status = (jnp.bool_(True), jnp.int64(0), jnp.float64(0.))
+    (timestep, x, x_old, deltax, converged, iters_newton, iters_cg,
+     cg_status) = lax.while_loop(
+        cond, body,
+        (jnp.int64(first) - 1, x, x_old, deltax, jnp.bool_(True),
+         jnp.int64(0), jnp.int64(0), cg_status)
+    )
+    return (x, x_old, deltax, converged, timestep, iters_newton, iters_cg,
+            cg_status)
+
+
+# the timeloop of one problem, and of a batch of problems that share the
+# boundary, the solver and the timesteps
+_timeloop_jit = jax.jit(_timeloop)
+_ensemble_jit = jax.jit(jax.vmap(
+    _timeloop, in_axes=(0, 0, 0, None, 0, 0, None, None, 0)
+))
+
+
+def solver_of(solver):
+    # the Solver of a main.Solver
+    return Solver(solver.tolerance, solver.max_cg_iters,
+                  solver.max_newton_iters)
+
+
+def _status(x, converged, timestep, iters_newton, iters_cg, cg_status):
+    return main.NewtonStatus(x, converged, timestep, iters_newton, iters_cg,
+                             0*iters_newton,
+                             linalg.CGStatus(*cg_status))
+
+
+def timeloop(x, boundary, options, solver, precond, ws, single, first,
+             last):
+    # main.timeloop() with the arguments of main.setup(), of which x,
+    # ws.x_old and ws.deltax are updated in place; precond and single are
+    # not used
+    shape = (options.nx, options.ny)
+    out = jax.device_get(_timeloop_jit(
+        x.reshape(shape), ws.x_old.reshape(shape), ws.deltax.reshape(shape),
+        boundary, options.dx, options.alpha, solver_of(solver), first, last
+    ))
+    x[:] = out[0].ravel()
+    ws.x_old[:] = out[1].ravel()
+    ws.deltax[:] = out[2].ravel()
+    converged, timestep, iters_newton, iters_cg, cg_status = out[3:]
+    return _status(x, bool(converged), int(timestep), int(iters_newton),
+                   int(iters_cg), (bool(cg_status[0]), int(cg_status[1]),
+                                   float(cg_status[2])))
+
+
+def ensemble_timeloop(x, boundary, dx, alpha, solver, first, last,
+                      state=None):
+    # the timeloop over the timesteps first..last of the problems on the
+    # grids x[m] of shape (batch, nx, ny), with grid spacing dx[m] and
+    # alpha[m]; returns the state to continue from, and a main.NewtonStatus
+    # of arrays with the status of every problem
+    #
+    # a problem that failed keeps its solution, and is not advanced by later
+    # calls
+    if state is None:
+        state = (x, x, np.zeros_like(x), np.ones(len(x), dtype=np.bool_))
+
+    x, x_old, deltax, active = state
+    out = jax.device_get(_ensemble_jit(
+        x, x_old, deltax, boundary, dx, alpha, solver, first,
+        np.where(active, last, first - 1)
+    ))
+    x, x_old, deltax, converged, timestep, iters_newton, iters_cg = out[:7]
+    converged = converged & active
+    return ((x, x_old, deltax, converged),
+            _status(x, converged, timestep, iters_newton, iters_cg, out[7]))
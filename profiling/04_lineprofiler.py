@@ -18,7 +18,7 @@ def euclidean_trick(x, y):
 
     xy = x @ y.T
 
-    return np.abs(x2 + y2 - 2. * xy)
+    return np.maximum(x2 + y2 - 2. * xy, 0.)
 
 
 if __name__ == "__main__":